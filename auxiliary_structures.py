@@ -1,3 +1,6 @@
+import heapq
+import itertools
+from collections import OrderedDict
 import numpy as np
 
 """
@@ -17,6 +20,9 @@ class PriorityQueue():
     [y0][y1][y2]....n
     [h0][h1][h2]....n
 
+    Other widths can be used, the priority is always the last value of each
+    entry (the searches store [id, h], the id of a vertex and it's heuristic)
+
     Attributes
     ----------
     array: np.ndarray
@@ -25,16 +31,17 @@ class PriorityQueue():
         The size of the queue
     """
 
-    def __init__(self):
+    def __init__(self, width: int = 3):
         """
         Initializes the Queue with a n dimensional 3xn array
 
         Parameters
         ----------
-        n: int
-            the n dimension of the queue
+        width: int
+            How many values each entry has, the last one being the priority,
+            defaults to 3
         """
-        self._array = np.zeros((0, 3))
+        self._array = np.zeros((0, width))
 
         self.size = self.array.size
 
@@ -62,17 +69,13 @@ class PriorityQueue():
         list[3] = [x, y, h]  where x is x coordinate, y is y coordinate and h is heuristic
 
         """
-        # Strip values from argument list
-        x = list[0]
-        y = list[1]
-        h = list[2]
-      
-
+        # Strip the priority from argument list
+        h = list[-1]
 
         # Search for the priority value on the sorted matrix, return it's index
-        index = np.searchsorted(self._array[:,2], h, side = "left",  )
+        index = np.searchsorted(self._array[:,-1], h, side = "left",  )
         # Adds to the leftmost part of given index the specified values
-        self._array = np.insert(self._array, index, [x, y, h], axis=0)
+        self._array = np.insert(self._array, index, list, axis=0)
 
         self._size = self._array.size
 
@@ -83,9 +86,1112 @@ class PriorityQueue():
         Returns
         -------
         float[3]
-            The first tuple from the queue [x, y, h]
+            The first tuple from the queue [x, y, h] (or an entry of the width
+            the queue was created with)
         """
         elements = self._array[0,:] # get first set of tuples from array
         self._array = np.delete(self._array, 0, axis=0)
         self._size = self._array.size
-        return elements
\ No newline at end of file
+        return elements
+
+class HeapPriorityQueue():
+    """
+    This class implements a priority queue as a binary heap (heapq), so that
+    pushing and popping are O(log n). Each item (a vertex id) is in the queue
+    at most once: pushing an item that is already there with a lower priority
+    updates it (decrease-key). The old heap entry is not searched for, it is
+    marked as removed through a map from item to entry and skipped when it
+    reaches the top (lazy deletion).
+
+    Entries are [h, -order, item], so on equal priorities the item pushed
+    last comes out first, as in PriorityQueue.
+
+    Attributes
+    ----------
+    size: int
+        The number of items in the queue
+    """
+
+    # Marks a heap entry whose item was updated or removed
+    _REMOVED = object()
+
+    def __init__(self):
+        """
+        Initializes an empty queue
+        """
+        self._heap = []
+        self._entries = {}
+        self._counter = itertools.count()
+
+    @property
+    def size(self):
+        return len(self._entries)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, item):
+        return item in self._entries
+
+    def priority(self, item):
+        """
+        Returns the priority of an item in the queue, None if it is not there
+        """
+        entry = self._entries.get(item)
+        return None if entry is None else entry[0]
+
+    def push(self, item, h: float):
+        """
+        Inserts an item with priority h, or lowers its priority to h if it is
+        already in the queue with a higher one
+
+        Returns
+        -------
+        bool
+            True if the item was inserted or its priority lowered
+        """
+        entry = self._entries.get(item)
+        if entry is not None:
+            if entry[0] <= h:
+                return False
+            # Invalidate the old entry, it stays in the heap until popped
+            entry[2] = self._REMOVED
+        entry = [h, -next(self._counter), item]
+        self._entries[item] = entry
+        heapq.heappush(self._heap, entry)
+        return True
+
+    # Same operation, under the usual name
+    decrease_key = push
+
+    def insert(self, list):
+        """
+        Inserts [item, h] into the queue, as PriorityQueue.insert does
+        """
+        self.push(list[0], list[-1])
+
+    def discard(self, item):
+        """
+        Takes an item out of the queue, if it is there
+        """
+        entry = self._entries.pop(item, None)
+        if entry is not None:
+            entry[2] = self._REMOVED
+
+    def pop(self):
+        """
+        Removes the item with the lowest priority from the queue
+
+        Returns
+        -------
+        item
+            The item
+        float
+            Its priority
+
+        Raises
+        ------
+        IndexError:
+            Raises IndexError if the queue is empty
+        """
+        while self._heap:
+            h, _, item = heapq.heappop(self._heap)
+            if item is not self._REMOVED:
+                del self._entries[item]
+                return item, h
+        raise IndexError("pop from an empty priority queue")
+
+    def peek(self):
+        """
+        Returns the item with the lowest priority and its priority, without
+        taking it out of the queue
+
+        Raises
+        ------
+        IndexError:
+            Raises IndexError if the queue is empty
+        """
+        heap = self._heap
+        # Drop the removed entries that reached the top
+        while heap and heap[0][2] is self._REMOVED:
+            heapq.heappop(heap)
+        if not heap:
+            raise IndexError("peek at an empty priority queue")
+        return heap[0][2], heap[0][0]
+
+    def remove(self):
+        """
+        Removes the first item from our queue, as PriorityQueue.remove does
+
+        Returns
+        -------
+        list[2]
+            [item, h]
+        """
+        item, h = self.pop()
+        return [item, h]
+
+
+class PointStore():
+    """
+    This class stores the coordinates of a set of points as one contiguous
+    array, indexed by point id (the order in which they were added), as shown:
+
+    [x0][y0]
+    [x1][y1]
+    ....n
+
+    The array grows by doubling, so appending is amortized O(1). With an
+    integer dtype only integer coordinates that fit the type can be stored.
+
+    Attributes
+    ----------
+    coords: np.ndarray
+        A n x 2 view of the coordinates of the points
+    size: int
+        The number of points
+    dtype: np.dtype
+        The type of the coordinates
+    """
+
+    def __init__(self, capacity: int = 16, dtype=np.float64):
+        """
+        Initializes an empty store
+
+        Parameters
+        ----------
+        capacity: int
+            How many points fit before the array has to grow, defaults to 16
+        dtype: np.dtype
+            The type of the coordinates, defaults to float64
+        """
+        self._array = np.zeros((max(capacity, 1), 2), dtype=dtype)
+        self._size = 0
+
+    @classmethod
+    def from_array(cls, coords: np.ndarray):
+        """
+        Makes a store over an existing n x 2 array, without copying it (the
+        array can be a read-only np.memmap, it is copied when points are added)
+
+        Parameters
+        ----------
+        coords: np.ndarray
+            The coordinates of the points, by id
+
+        Returns
+        -------
+        PointStore
+            The new store
+        """
+        store = cls(1, coords.dtype)
+        store._array = coords
+        store._size = len(coords)
+        return store
+
+    @property
+    def size(self):
+        return self._size
+
+    @property
+    def coords(self):
+        return self._array[:self._size]
+
+    @property
+    def dtype(self):
+        return self._array.dtype
+
+    @property
+    def nbytes(self):
+        return self._array.nbytes
+
+    def _check(self, coords: np.ndarray):
+        # Integer stores only take integer coordinates in the range of the type
+        if np.issubdtype(self._array.dtype, np.integer) and len(coords):
+            info = np.iinfo(self._array.dtype)
+            if np.any(coords != np.floor(coords)) or coords.min() < info.min or coords.max() > info.max:
+                raise ValueError("coordinates do not fit a " + str(self._array.dtype) + " point store")
+
+    def _reserve(self, size: int):
+        # Amortized growth of the coordinate array
+        if size > self._array.shape[0]:
+            grown = np.zeros((max(size, 2 * self._array.shape[0]), 2), dtype=self._array.dtype)
+            grown[:self._size] = self._array[:self._size]
+            self._array = grown
+
+    def trim(self):
+        """
+        Gives back the room kept for points that were never added
+        """
+        self._array = self._array[:max(self._size, 1)].copy()
+
+    def append(self, x: float, y: float):
+        """
+        Adds a point to the store
+
+        Returns
+        -------
+        int
+            The id of the new point
+        """
+        self._check(np.array([x, y], dtype=np.float64))
+        self._reserve(self._size + 1)
+        idx = self._size
+        self._array[idx, 0] = x
+        self._array[idx, 1] = y
+        self._size += 1
+        return idx
+
+    def extend(self, coords: np.ndarray):
+        """
+        Adds many points to the store at once
+
+        Returns
+        -------
+        np.ndarray
+            The ids of the new points
+        """
+        coords = np.asarray(coords).reshape(-1, 2)
+        self._check(coords)
+        self._reserve(self._size + len(coords))
+        self._array[self._size:self._size + len(coords)] = coords
+        self._size += len(coords)
+        return np.arange(self._size - len(coords), self._size)
+
+
+class HeuristicCache():
+    """
+    This class caches, per destination, the straight-line distance from every
+    point of a PointStore to that destination, as one float64 array indexed by
+    point id. The array is computed in a single vectorized pass the first time
+    a destination is asked for; points appended to the store afterwards are
+    filled in the next time it is asked for. Only the most recently used
+    destinations are kept.
+
+    Attributes
+    ----------
+    store: PointStore
+        The points the distances are measured from
+    capacity: int
+        How many destinations are kept
+    nbytes: int
+        The memory held by the cached arrays
+    """
+
+    def __init__(self, store: PointStore, capacity: int = 8):
+        """
+        Parameters
+        ----------
+        store: PointStore
+            The points the distances are measured from
+        capacity: int
+            How many destinations are kept, defaults to 8
+        """
+        self._store = store
+        self._capacity = max(capacity, 1)
+        self._arrays = OrderedDict()
+
+    @property
+    def store(self):
+        return self._store
+
+    @property
+    def capacity(self):
+        return self._capacity
+
+    @property
+    def nbytes(self):
+        return sum(array.nbytes for array in self._arrays.values())
+
+    def __len__(self):
+        return len(self._arrays)
+
+    def __contains__(self, destination: int):
+        return destination in self._arrays
+
+    def _distances(self, start: int, destination: int):
+        # Distances from the points [start, size) to the destination
+        coords = self._store.coords
+        target = coords[destination].astype(np.float64)
+        delta = coords[start:].astype(np.float64) - target
+        return np.sqrt(np.einsum("ij,ij->i", delta, delta))
+
+    def heuristic(self, destination: int):
+        """
+        Returns the distances from every point to the destination
+
+        Parameters
+        ----------
+        destination: int
+            The id of the destination point
+
+        Returns
+        -------
+        np.ndarray
+            An array of floats, the distance from point i to the destination
+            at position i
+
+        Raises
+        ------
+        IndexError:
+            If there is no point with that id
+        """
+        if not 0 <= destination < self._store.size:
+            raise IndexError("no point with id " + str(destination))
+        array = self._arrays.pop(destination, None)
+        if array is None:
+            array = self._distances(0, destination)
+        elif len(array) < self._store.size:
+            # Points were added since the array was computed
+            array = np.concatenate((array, self._distances(len(array), destination)))
+        self._arrays[destination] = array
+        if len(self._arrays) > self._capacity:
+            self._arrays.popitem(last=False)
+        return array
+
+    def clear(self):
+        """
+        Drops all cached arrays
+        """
+        self._arrays.clear()
+
+
+class TileCache():
+    """
+    This class keeps the most recently used tiles of a tiled graph in
+    memory, within a budget of bytes. Tiles are loaded on demand by a
+    function given to the cache; when the budget is exceeded the least
+    recently used tiles are dropped (the tile being used is always kept,
+    even if it alone is larger than the budget).
+
+    Attributes
+    ----------
+    budget: int
+        The memory the tiles may use, in bytes
+    nbytes: int
+        The memory used by the tiles in the cache, in bytes
+    hits, misses, evictions: int
+        How many tiles were found in the cache, had to be loaded, and were
+        dropped to stay within the budget
+    """
+
+    def __init__(self, loader, budget: int):
+        """
+        Parameters
+        ----------
+        loader: function
+            Called with the number of a tile, returns the tile. Tiles must
+            have a nbytes attribute
+        budget: int
+            The memory the tiles may use, in bytes
+        """
+        self._loader = loader
+        self._budget = budget
+        self._tiles = OrderedDict()
+        self._nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @property
+    def budget(self):
+        return self._budget
+
+    @property
+    def nbytes(self):
+        return self._nbytes
+
+    def __len__(self):
+        return len(self._tiles)
+
+    def __contains__(self, tile: int):
+        return tile in self._tiles
+
+    def get(self, tile: int):
+        """
+        Returns a tile, loading it if it is not in the cache
+
+        Parameters
+        ----------
+        tile: int
+            The number of the tile
+        """
+        found = self._tiles.get(tile)
+        if found is not None:
+            self.hits += 1
+            self._tiles.move_to_end(tile)
+            return found
+
+        self.misses += 1
+        found = self._loader(tile)
+        self._tiles[tile] = found
+        self._nbytes += found.nbytes
+        while self._nbytes > self._budget and len(self._tiles) > 1:
+            _, dropped = self._tiles.popitem(last=False)
+            self._nbytes -= dropped.nbytes
+            self.evictions += 1
+        return found
+
+    def clear(self):
+        """
+        Drops every tile
+        """
+        self._tiles.clear()
+        self._nbytes = 0
+
+
+class SpatialGrid():
+    """
+    This class implements a uniform grid used as a spatial index over the
+    points of a graph. Points are identified by the order in which they were
+    inserted (their id), and the grid keeps them bucketed by cell, as shown:
+
+    order:      [ids of cell 0][ids of cell 1][ids of cell 2]....
+    cell_start: [start of cell 0][start of cell 1]....[len(order)]
+
+    Cells are numbered row by row, so a horizontal run of cells is a single
+    contiguous slice of order. Points inserted after the last rebuild go
+    straight into a growable list of their cell, next to the compiled slice,
+    and the grid is rebuilt with a new cell size once they outnumber the
+    compiled points, so inserting is amortized O(log n) and queries only look
+    at the cells around them.
+
+    Attributes
+    ----------
+    size: int
+        The number of points in the index
+    cell_size: float
+        The side of each (square) cell of the grid
+    """
+
+    def __init__(self, x_size: int, y_size: int, store: PointStore = None, index_dtype=np.int64):
+        """
+        Initializes an empty grid covering [0, x_size] x [0, y_size]
+
+        Parameters
+        ----------
+        x_size: int
+            The maximum x coordinate of the indexed space
+        y_size: int
+            The maximum y coordinate of the indexed space
+        store: PointStore, optional
+            Where the coordinates of the points are, the grid only keeps their
+            ids. Defaults to a store of its own
+        index_dtype: np.dtype
+            The integer type of the ids kept by the grid, defaults to int64
+        """
+        self._xSize = x_size
+        self._ySize = y_size
+        self._index_dtype = np.dtype(index_dtype)
+
+        self._store = store if store is not None else PointStore()
+        self._size = 0
+
+        # Compiled grid, starts with a single cell and nothing in it
+        self._cell_size = float(max(x_size, y_size, 1)) + 1.0
+        self._ncx = 1
+        self._ncy = 1
+        self._order = np.zeros(0, dtype=np.int64)
+        self._cell_start = np.zeros(2, dtype=np.int64)
+        # Ids inserted since the last rebuild, by cell
+        self._extra = {}
+        self._extra_count = 0
+
+    @property
+    def size(self):
+        return self._size
+
+    @property
+    def cell_size(self):
+        return self._cell_size
+
+    @property
+    def store(self):
+        return self._store
+
+    @property
+    def nbytes(self):
+        """
+        The memory used by the grid (not counting the store), in bytes
+        """
+        return self._order.nbytes + self._cell_start.nbytes
+
+    def insert(self, x: float, y: float):
+        """
+        Adds a point to the store and to the index
+
+        Parameters
+        ----------
+        x: float
+            The x coordinate of the point
+        y: float
+            The y coordinate of the point
+
+        Returns
+        -------
+        int
+            The id given to the point (its insertion order)
+        """
+        idx = self._store.append(x, y)
+        self.add(idx)
+        return idx
+
+    def add(self, idx: int):
+        """
+        Indexes a point that was already added to the store
+
+        Parameters
+        ----------
+        idx: int
+            The id of the point
+        """
+        x, y = self._store.coords[idx].tolist()
+        cx = min(max(int(x // self._cell_size), 0), self._ncx - 1)
+        cy = min(max(int(y // self._cell_size), 0), self._ncy - 1)
+        self._extra.setdefault(cy * self._ncx + cx, []).append(idx)
+        self._extra_count += 1
+        self._size += 1
+        # The cells got about twice as full as the layout was chosen for
+        if self._extra_count > max(32, self._size - self._extra_count):
+            self.rebuild()
+
+    def sync(self):
+        """
+        Indexes every point of the store that is not indexed yet (points added
+        to the store in bulk) and rebuilds the grid
+        """
+        self._size = self._store.size
+        self.rebuild()
+
+    def _layout(self, n: int):
+        # A cell size that keeps about two of n points per cell
+        area = float(self._xSize + 1) * float(self._ySize + 1)
+        self._cell_size = max(np.sqrt(2.0 * area / max(n, 1)), 1.0)
+        self._ncx = int(np.ceil((self._xSize + 1) / self._cell_size))
+        self._ncy = int(np.ceil((self._ySize + 1) / self._cell_size))
+
+    @property
+    def arrays(self):
+        """
+        The compiled order and cell_start arrays, with every point indexed
+        """
+        if self._extra_count:
+            self.rebuild()
+        return self._order, self._cell_start
+
+    def attach(self, order: np.ndarray, cell_start: np.ndarray):
+        """
+        Uses arrays saved from the arrays property of a grid over the same
+        points instead of rebuilding them (they are not copied)
+
+        Parameters
+        ----------
+        order: np.ndarray
+            The ids of the points, bucketed by cell
+        cell_start: np.ndarray
+            Where the ids of each cell start in order
+
+        Raises
+        ------
+        ValueError:
+            If the arrays do not match the points of the store
+        """
+        self._size = self._store.size
+        self._layout(self._size)
+        if len(order) != self._size or len(cell_start) != self._ncx * self._ncy + 1:
+            raise ValueError("the grid arrays do not match the points of the store")
+        self._order = order
+        self._cell_start = cell_start
+        self._extra = {}
+        self._extra_count = 0
+
+    def rebuild(self):
+        """
+        Rebuilds the grid from every point inserted so far, choosing a cell
+        size that keeps about two points per cell
+        """
+        n = self._size
+        self._layout(n)
+
+        coords = self._store.coords
+        cells = self._cell_of(coords[:n, 0], coords[:n, 1])
+        # A stable sort keeps the ids of each cell in insertion order
+        self._order = np.argsort(cells, kind="stable").astype(self._index_dtype)
+        counts = np.bincount(cells, minlength=self._ncx * self._ncy)
+        self._cell_start = np.zeros(self._ncx * self._ncy + 1, dtype=self._index_dtype)
+        np.cumsum(counts, out=self._cell_start[1:])
+        self._extra = {}
+        self._extra_count = 0
+
+    def _cell_of(self, x, y):
+        # Cell column and row, clamped to the grid so that points on (or past)
+        # the border fall into the border cells
+        cx = np.clip(np.floor_divide(x, self._cell_size).astype(np.int64), 0, self._ncx - 1)
+        cy = np.clip(np.floor_divide(y, self._cell_size).astype(np.int64), 0, self._ncy - 1)
+        return cy * self._ncx + cx
+
+    def _ring(self, cx: int, cy: int, r: int):
+        """
+        Returns the ids stored in the cells at Chebyshev distance r from (cx, cy)
+        """
+        x0 = max(cx - r, 0)
+        x1 = min(cx + r, self._ncx - 1)
+        slices = []
+
+        def run(row, a, b):
+            if 0 <= row < self._ncy and a <= b:
+                start = self._cell_start[row * self._ncx + a]
+                end = self._cell_start[row * self._ncx + b + 1]
+                if end > start:
+                    slices.append(self._order[start:end])
+                if self._extra:
+                    for cell in range(row * self._ncx + a, row * self._ncx + b + 1):
+                        extra = self._extra.get(cell)
+                        if extra:
+                            slices.append(np.asarray(extra, dtype=np.int64))
+
+        if r == 0:
+            run(cy, cx, cx)
+        else:
+            # Top and bottom rows are contiguous runs of cells
+            run(cy - r, x0, x1)
+            run(cy + r, x0, x1)
+            # Left and right columns, without the corners
+            for row in range(max(cy - r + 1, 0), min(cy + r - 1, self._ncy - 1) + 1):
+                if cx - r >= 0:
+                    run(row, cx - r, cx - r)
+                if cx + r < self._ncx:
+                    run(row, cx + r, cx + r)
+
+        return slices
+
+    def _distances(self, ids, x: float, y: float):
+        coords = self._store.coords
+        dx = coords[ids, 0].astype(np.float64) - x
+        dy = coords[ids, 1].astype(np.float64) - y
+        return np.sqrt(dx * dx + dy * dy)
+
+    def _search(self, x: float, y: float, accept):
+        """
+        Walks the grid ring by ring around (x, y)
+
+        accept(ids, dists, bound) receives the candidates found so far (every
+        indexed point nearer than bound is among them) and returns True when
+        the query is answered
+        """
+        cx = min(max(int(x // self._cell_size), 0), self._ncx - 1)
+        cy = min(max(int(y // self._cell_size), 0), self._ncy - 1)
+
+        # Distance from (x, y) to the border of its own cell
+        ox = x - cx * self._cell_size
+        oy = y - cy * self._cell_size
+        margin = max(min(ox, self._cell_size - ox, oy, self._cell_size - oy), 0.0)
+
+        ids = np.zeros(0, dtype=np.int64)
+        dists = np.zeros(0)
+        max_ring = max(self._ncx, self._ncy)
+
+        for r in range(0, max_ring + 1):
+            found = self._ring(cx, cy, r)
+            if found:
+                found = np.concatenate(found)
+                ids = np.concatenate((ids, found))
+                dists = np.concatenate((dists, self._distances(found, x, y)))
+            # Every point outside rings 0..r is at least this far away
+            bound = np.inf if r == max_ring else r * self._cell_size + margin
+            if accept(ids, dists, bound):
+                break
+
+    def nearest(self, x: float, y: float, k: int = 1, min_distance: float = 0.0):
+        """
+        Finds the k nearest points to (x, y) that are strictly farther than
+        min_distance, ties are broken by the lowest id
+
+        Parameters
+        ----------
+        x: float
+            The x coordinate of the query
+        y: float
+            The y coordinate of the query
+        k: int
+            How many points to return, defaults to 1
+        min_distance: float
+            Only look for points farther than this distance, defaults to 0
+
+        Returns
+        -------
+        np.ndarray
+            The ids of the points found, nearest first
+        np.ndarray
+            Their distances to (x, y)
+        """
+        result = [np.zeros(0, dtype=np.int64), np.zeros(0)]
+
+        def accept(ids, dists, bound):
+            keep = dists > min_distance
+            ids, dists = ids[keep], dists[keep]
+            order = np.lexsort((ids, dists))[:k]
+            result[0], result[1] = ids[order], dists[order]
+            # Answered once we have k points nearer than anything left unseen
+            return len(order) == k and result[1][-1] < bound
+
+        self._search(x, y, accept)
+        return result[0], result[1]
+
+    def nearest_beyond(self, x: float, y: float, distance: float):
+        """
+        Finds the nearest point to (x, y) that is strictly farther than distance
+
+        Returns
+        -------
+        int
+            The id of the point found, -1 if there is none
+        float
+            Its distance to (x, y), inf if there is none
+        """
+        ids, dists = self.nearest(x, y, 1, distance)
+        if len(ids) == 0:
+            return -1, np.inf
+        return int(ids[0]), float(dists[0])
+
+    def within_radius(self, x: float, y: float, radius: float):
+        """
+        Finds every point at distance less or equal to radius from (x, y)
+
+        Returns
+        -------
+        np.ndarray
+            The ids of the points found, nearest first
+        np.ndarray
+            Their distances to (x, y)
+        """
+        result = [np.zeros(0, dtype=np.int64), np.zeros(0)]
+
+        def accept(ids, dists, bound):
+            if bound <= radius:
+                return False
+            keep = dists <= radius
+            ids, dists = ids[keep], dists[keep]
+            order = np.lexsort((ids, dists))
+            result[0], result[1] = ids[order], dists[order]
+            return True
+
+        self._search(x, y, accept)
+        return result[0], result[1]
+
+
+class CsrAdjacency():
+    """
+    This class implements the adjacency of an undirected graph in compressed
+    sparse row form. The neighbours of vertex i, and the lengths of the edges
+    that lead to them, are the slices offsets[i]:offsets[i+1] of two parallel
+    arrays, as shown:
+
+    offsets:    [0][d0][d0+d1]....[2E]
+    neighbours: [neighbours of 0][neighbours of 1]....
+    lengths:    [lengths of 0][lengths of 1]....
+
+    Each edge shows up in the rows of both of its ends, each row in the order
+    the edges were added. Edges added since the last compile are kept in
+    pending lists (and a set of their keys, to find duplicates in O(1)) until
+    the arrays are needed.
+
+    The lengths array can be left out (length_dtype None) to save memory, the
+    lengths are then computed from the coordinates of a PointStore when a
+    row is read.
+
+    Attributes
+    ----------
+    vertex_count: int
+        The number of vertices
+    edge_count: int
+        The number of (undirected) edges
+    """
+
+    def __init__(self, vertex_count: int = 0, index_dtype=np.int64, length_dtype=np.float64,
+                 store: PointStore = None):
+        """
+        Initializes an adjacency with no edges
+
+        Parameters
+        ----------
+        vertex_count: int
+            The number of vertices, defaults to 0
+        index_dtype: np.dtype
+            The integer type of the offsets and neighbour ids, defaults to int64
+        length_dtype: np.dtype
+            The type of the stored edge lengths, None to compute them from the
+            store instead, defaults to float64
+        store: PointStore, optional
+            The coordinates of the vertices, needed when lengths are not stored
+        """
+        if length_dtype is None and store is None:
+            raise ValueError("edge lengths are not stored and there are no coordinates to compute them")
+
+        self._vertex_count = vertex_count
+        self._index_dtype = np.dtype(index_dtype)
+        self._length_dtype = None if length_dtype is None else np.dtype(length_dtype)
+        self._store = store
+
+        self._offsets = np.zeros(vertex_count + 1, dtype=self._index_dtype)
+        # offsets is a view of the start of this buffer, which grows by
+        # doubling as vertices are added
+        self._offsets_buffer = self._offsets
+        self._neighbours = np.zeros(0, dtype=self._index_dtype)
+        self._lengths = None if length_dtype is None else np.zeros(0, dtype=self._length_dtype)
+
+        # Edges added after the last compile
+        self._pending = []
+        self._pending_keys = set()
+
+    @classmethod
+    def from_arrays(cls, offsets: np.ndarray, neighbours: np.ndarray, lengths: np.ndarray = None,
+                    store: PointStore = None):
+        """
+        Makes an adjacency over existing compiled arrays, without copying
+        them (they can be read-only np.memmaps, adding edges makes new arrays)
+
+        Parameters
+        ----------
+        offsets: np.ndarray
+            Where the row of each vertex starts, one more than the vertices
+        neighbours: np.ndarray
+            The neighbour ids of every row
+        lengths: np.ndarray, optional
+            The edge lengths parallel to neighbours, None to compute them from
+            the store
+        store: PointStore, optional
+            The coordinates of the vertices, needed when lengths is None
+
+        Returns
+        -------
+        CsrAdjacency
+            The new adjacency
+        """
+        adjacency = cls(0, offsets.dtype, None if lengths is None else lengths.dtype, store)
+        adjacency._vertex_count = len(offsets) - 1
+        adjacency._offsets = offsets
+        adjacency._offsets_buffer = offsets
+        adjacency._neighbours = neighbours
+        adjacency._lengths = lengths
+        return adjacency
+
+    @property
+    def vertex_count(self):
+        return self._vertex_count
+
+    @property
+    def edge_count(self):
+        return len(self._neighbours) // 2 + len(self._pending)
+
+    @property
+    def index_dtype(self):
+        return self._index_dtype
+
+    @property
+    def length_dtype(self):
+        return self._length_dtype
+
+    @property
+    def offsets(self):
+        self._compile()
+        return self._offsets
+
+    @property
+    def neighbour_array(self):
+        self._compile()
+        return self._neighbours
+
+    @property
+    def length_array(self):
+        """
+        The lengths parallel to neighbour_array (computed if not stored)
+        """
+        self._compile()
+        if self._lengths is not None:
+            return self._lengths
+        return self._compute_lengths(self._sources(), self._neighbours)
+
+    @property
+    def nbytes(self):
+        """
+        The memory used by the compiled arrays, in bytes
+        """
+        self._compile()
+        total = self._offsets.nbytes + self._neighbours.nbytes
+        return total + (0 if self._lengths is None else self._lengths.nbytes)
+
+    def add_vertices(self, count: int = 1):
+        """
+        Adds count vertices with no edges, their ids follow the existing ones
+        """
+        size = self._vertex_count + 1
+        last = self._offsets[-1]
+        # Amortized growth of the offsets, as PointStore does for the coordinates
+        if size + count > len(self._offsets_buffer):
+            grown = np.empty(max(size + count, 2 * len(self._offsets_buffer)), dtype=self._index_dtype)
+            grown[:size] = self._offsets
+            self._offsets_buffer = grown
+        self._offsets_buffer[size:size + count] = last
+        self._vertex_count += count
+        self._offsets = self._offsets_buffer[:size + count]
+
+    def has_edge(self, i: int, j: int):
+        """
+        Verifies if the edge i-j (or j-i) is in the adjacency, in O(degree)
+        """
+        u, v = min(i, j), max(i, j)
+        if (u, v) in self._pending_keys:
+            return True
+        if u < len(self._offsets) - 1:
+            row = self._neighbours[self._offsets[u]:self._offsets[u + 1]]
+            return bool((row == v).any())
+        return False
+
+    def add(self, i: int, j: int, length: float):
+        """
+        Adds the undirected edge i-j
+
+        Parameters
+        ----------
+        i: int
+            One end of the edge
+        j: int
+            The other end of the edge
+        length: float
+            The length of the edge
+
+        Returns
+        -------
+        bool
+            False if the edge was already there (either way round) or is a loop
+        """
+        if i == j or self.has_edge(i, j):
+            return False
+        u, v = min(i, j), max(i, j)
+        self._pending.append((u, v, length))
+        self._pending_keys.add((u, v))
+        return True
+
+    def add_many(self, src: np.ndarray, dst: np.ndarray, lengths: np.ndarray = None):
+        """
+        Adds many undirected edges at once, skipping loops, duplicates among
+        them and edges that are already there
+
+        Returns
+        -------
+        int
+            How many edges were added
+        """
+        self._compile()
+        src = np.asarray(src, dtype=np.int64)
+        dst = np.asarray(dst, dtype=np.int64)
+        u = np.minimum(src, dst)
+        v = np.maximum(src, dst)
+
+        # First occurrence of each new pair, in the order given
+        keys = u * self._vertex_count + v
+        _, first = np.unique(keys, return_index=True)
+        first = np.sort(first)
+        first = first[u[first] != v[first]]
+        old_u, old_v, _ = self.pairs(lengths=False)
+        if len(old_u):
+            old = np.sort(old_u.astype(np.int64) * self._vertex_count + old_v)
+            at = np.minimum(np.searchsorted(old, keys[first]), len(old) - 1)
+            first = first[old[at] != keys[first]]
+
+        if lengths is not None:
+            lengths = np.asarray(lengths)[first]
+        self._merge(u[first], v[first], lengths)
+        return len(first)
+
+    def _compile(self):
+        # Moves the pending edges to the arrays
+        if not self._pending:
+            return
+        pending = np.array(self._pending, dtype=np.float64).reshape(-1, 3)
+        self._pending = []
+        self._pending_keys = set()
+        self._merge(pending[:, 0].astype(np.int64), pending[:, 1].astype(np.int64), pending[:, 2])
+
+    def _sources(self):
+        # The vertex each entry of the neighbour array belongs to
+        degrees = np.diff(self._offsets)
+        return np.repeat(np.arange(self._vertex_count, dtype=self._index_dtype), degrees)
+
+    def _compute_lengths(self, src, dst):
+        coords = self._store.coords
+        dx = coords[src, 0].astype(np.float64) - coords[dst, 0]
+        dy = coords[src, 1].astype(np.float64) - coords[dst, 1]
+        return np.sqrt(dx * dx + dy * dy)
+
+    def _merge(self, u, v, length):
+        """
+        Adds the new edges u-v to the rows. Edge e goes to positions 2e (u -> v)
+        and 2e+1 (v -> u) after the existing entries, a stable sort by source
+        then keeps each row in the order the edges were added
+        """
+        src = np.empty(2 * len(u), dtype=np.int64)
+        dst = np.empty(2 * len(u), dtype=np.int64)
+        src[0::2], src[1::2] = u, v
+        dst[0::2], dst[1::2] = v, u
+        src = np.concatenate((self._sources(), src))
+        dst = np.concatenate((self._neighbours, dst))
+        if len(dst) > np.iinfo(self._index_dtype).max:
+            raise OverflowError("too many edges for " + str(self._index_dtype) + " offsets")
+        order = np.argsort(src, kind="stable")
+
+        if self._lengths is not None:
+            if length is None:
+                length = self._compute_lengths(u, v)
+            self._lengths = np.concatenate((self._lengths, np.repeat(length, 2)))[order].astype(self._length_dtype)
+        self._neighbours = dst[order].astype(self._index_dtype)
+        self._offsets = np.zeros(self._vertex_count + 1, dtype=self._index_dtype)
+        self._offsets_buffer = self._offsets
+        np.cumsum(np.bincount(src, minlength=self._vertex_count), out=self._offsets[1:])
+
+    def neighbours(self, i: int):
+        """
+        Returns the neighbours of vertex i, in O(degree)
+
+        Returns
+        -------
+        np.ndarray
+            The ids of the neighbours
+        np.ndarray
+            The lengths of the edges that lead to them
+        """
+        self._compile()
+        start, end = self._offsets[i], self._offsets[i + 1]
+        ids = self._neighbours[start:end]
+        if self._lengths is not None:
+            return ids, self._lengths[start:end]
+        return ids, self._compute_lengths(np.full(len(ids), i), ids)
+
+    def pairs(self, lengths: bool = True):
+        """
+        Returns every edge once, by lower end
+
+        Parameters
+        ----------
+        lengths: bool
+            Wether to return the lengths too, defaults to True
+
+        Returns
+        -------
+        np.ndarray
+            The lower end of each edge
+        np.ndarray
+            The higher end of each edge
+        np.ndarray
+            The length of each edge (None if not asked for)
+        """
+        self._compile()
+        src = self._sources()
+        lower = src < self._neighbours
+        u, v = src[lower], self._neighbours[lower]
+        if not lengths:
+            return u, v, None
+        if self._lengths is not None:
+            return u, v, self._lengths[lower]
+        return u, v, self._compute_lengths(u, v)
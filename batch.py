@@ -0,0 +1,250 @@
+import math
+import multiprocessing
+import os
+import shutil
+import tempfile
+import numpy as np
+from grafo_knn import Knn_Graph, Tiled_Knn_Graph, read_graph_table
+from searches import ALGORITHMS, path_length
+
+"""
+
+This file runs many path queries at once, spread over a pool of processes.
+
+The workers do not get the graph by pickling: it is saved once to a graph
+file (or the file of a tiled graph is used), and each worker memory-maps
+that file when it starts, so all of them share the same pages. Only the
+query pairs and the result arrays go through the pool.
+
+"""
+
+
+class BatchResult:
+    """
+    The results of a batch of path queries, as arrays parallel to the pairs
+
+    Attributes
+    ----------
+    found: np.ndarray
+        Wether each destination was reached
+    lengths: np.ndarray
+        The length of each path, inf if the destination was not reached
+    expansions: np.ndarray
+        How many vertices each search expanded
+    path_offsets: np.ndarray
+        With paths, path i is path_ids[path_offsets[i]:path_offsets[i+1]],
+        None otherwise
+    path_ids: np.ndarray
+        With paths, the vertex ids of every path one after the other, None
+        otherwise
+    """
+
+    __slots__ = ("found", "lengths", "expansions", "path_offsets", "path_ids")
+
+    def __init__(self, found, lengths, expansions, path_offsets=None, path_ids=None):
+        self.found = found
+        self.lengths = lengths
+        self.expansions = expansions
+        self.path_offsets = path_offsets
+        self.path_ids = path_ids
+
+    def __len__(self):
+        return len(self.found)
+
+    def path(self, i: int):
+        """
+        Returns the ids of the vertices of path i
+
+        Raises
+        ------
+        ValueError:
+            If the paths were not kept
+        """
+        if self.path_ids is None:
+            raise ValueError("the paths were not kept, run the batch with paths=True")
+        return self.path_ids[self.path_offsets[i]:self.path_offsets[i + 1]]
+
+    @classmethod
+    def concatenate(cls, parts: list):
+        """
+        Joins the results of consecutive slices of a batch
+        """
+        found = np.concatenate([p.found for p in parts])
+        lengths = np.concatenate([p.lengths for p in parts])
+        expansions = np.concatenate([p.expansions for p in parts])
+        if parts[0].path_ids is None:
+            return cls(found, lengths, expansions)
+        sizes = np.concatenate([np.diff(p.path_offsets) for p in parts])
+        offsets = np.zeros(len(sizes) + 1, dtype=np.int64)
+        np.cumsum(sizes, out=offsets[1:])
+        return cls(found, lengths, expansions, offsets, np.concatenate([p.path_ids for p in parts]))
+
+
+def run_queries(graph: Knn_Graph, pairs: np.ndarray, algorithm: str = "AStar", paths: bool = False):
+    """
+    Runs path queries one after the other in this process
+
+    Parameters
+    ----------
+    graph: Knn_Graph
+        The graph
+    pairs: np.ndarray
+        A q x 2 array of (source id, destination id)
+    algorithm: str
+        The name of the search, a key of searches.ALGORITHMS, defaults to "AStar"
+    paths: bool
+        Wether to keep the paths, defaults to False
+
+    Returns
+    -------
+    BatchResult
+        The results
+    """
+    search_class = ALGORITHMS[algorithm]
+    pairs = np.asarray(pairs, dtype=np.int64).reshape(-1, 2)
+    found = np.zeros(len(pairs), dtype=bool)
+    lengths = np.full(len(pairs), math.inf)
+    expansions = np.zeros(len(pairs), dtype=np.int64)
+    found_paths = []
+
+    for q, (source, destination) in enumerate(pairs.tolist()):
+        search = search_class(graph.point(destination))
+        found[q] = search.search(graph.point(source), graph)
+        expansions[q] = search.stats.expansions
+        path = search.path if found[q] else []
+        if found[q]:
+            lengths[q] = path_length(graph, path)
+        if paths:
+            found_paths.append(path)
+
+    if not paths:
+        return BatchResult(found, lengths, expansions)
+    offsets = np.zeros(len(pairs) + 1, dtype=np.int64)
+    np.cumsum([len(p) for p in found_paths], out=offsets[1:])
+    ids = np.fromiter((i for p in found_paths for i in p), dtype=np.int64, count=int(offsets[-1]))
+    return BatchResult(found, lengths, expansions, offsets, ids)
+
+
+def graph_file(graph: Knn_Graph, path: str = None):
+    """
+    Finds a file worker processes can open the graph from: the file of a
+    tiled graph, the given path, or else a temporary copy of the graph
+
+    Returns
+    -------
+    str
+        The file
+    bool
+        Wether it is a tiled graph file
+    str
+        The temporary directory to remove when the workers are done, None
+        if the file is not a temporary copy
+    """
+    if isinstance(graph, Tiled_Knn_Graph):
+        return graph._path, True, None
+    if path is not None:
+        return path, False, None
+    directory = tempfile.mkdtemp(prefix="knn-batch-")
+    path = os.path.join(directory, "graph.knn")
+    graph.save(path)
+    return path, False, directory
+
+
+def open_graph_file(path: str, tiled: bool = None):
+    """
+    Opens a graph file memory-mapped, tiled or not (None looks at the file)
+    """
+    if tiled is None:
+        meta, _ = read_graph_table(path)
+        tiled = meta.get("layout") == "tiled"
+    return Tiled_Knn_Graph(path) if tiled else Knn_Graph.load(path, mmap=True)
+
+
+# The graph of a pool worker, opened once when the worker starts
+_graph = None
+
+
+def init_worker(path: str, tiled: bool):
+    """
+    Opens the graph of a worker process, the initializer of its pool (see
+    graph_file for the arguments)
+    """
+    global _graph
+    _graph = open_graph_file(path, tiled)
+
+
+def worker_queries(task):
+    """
+    Runs a slice of a batch in a worker process started with init_worker
+
+    Parameters
+    ----------
+    task: tuple
+        (first, pairs, algorithm, paths): the position of the slice in the
+        batch, then the arguments of run_queries
+
+    Returns
+    -------
+    int
+        first, to put the slices back in order
+    BatchResult
+        The results of the slice
+    """
+    first, pairs, algorithm, paths = task
+    return first, run_queries(_graph, pairs, algorithm, paths)
+
+
+def batch_search(graph: Knn_Graph, pairs: np.ndarray, algorithm: str = "AStar", workers: int = 0,
+                 paths: bool = False, path: str = None, chunk_size: int = None):
+    """
+    Runs many path queries, spread over a pool of processes
+
+    Parameters
+    ----------
+    graph: Knn_Graph
+        The graph, a Knn_Graph or a Tiled_Knn_Graph
+    pairs: np.ndarray
+        A q x 2 array of (source id, destination id)
+    algorithm: str
+        The name of the search, a key of searches.ALGORITHMS, defaults to "AStar"
+    workers: int
+        How many processes to use, 0 uses one per CPU, 1 runs the queries in
+        this process, defaults to 0
+    paths: bool
+        Wether to keep the paths, defaults to False
+    path: str, optional
+        A file the graph was saved to with Knn_Graph.save, which the workers
+        open instead of a temporary copy
+    chunk_size: int, optional
+        How many queries each task gets, by default the queries are split
+        in about four tasks per worker
+
+    Returns
+    -------
+    BatchResult
+        The results, in the order of the pairs
+
+    Raises
+    ------
+    KeyError:
+        If the algorithm is unknown
+    """
+    if algorithm not in ALGORITHMS:
+        raise KeyError("unknown search: " + str(algorithm))
+    pairs = np.asarray(pairs, dtype=np.int64).reshape(-1, 2)
+    workers = workers if workers > 0 else (os.cpu_count() or 1)
+    if workers == 1 or len(pairs) <= 1:
+        return run_queries(graph, pairs, algorithm, paths)
+
+    path, tiled, directory = graph_file(graph, path)
+    try:
+        chunk_size = chunk_size or max(1, -(-len(pairs) // (4 * workers)))
+        tasks = [(first, pairs[first:first + chunk_size], algorithm, paths)
+                 for first in range(0, len(pairs), chunk_size)]
+        with multiprocessing.Pool(workers, init_worker, (path, tiled)) as pool:
+            parts = sorted(pool.imap_unordered(worker_queries, tasks), key=lambda part: part[0])
+    finally:
+        if directory is not None:
+            shutil.rmtree(directory, ignore_errors=True)
+
+    return BatchResult.concatenate([part for _, part in parts])
@@ -0,0 +1,290 @@
+import argparse
+import json
+import math
+import platform
+import sys
+import time
+import tracemalloc
+import numpy as np
+from grafo_knn import Knn_Graph
+from searches import ALGORITHMS, path_length
+
+"""
+
+This file compares the searches on processing time, memory and nodes
+expanded, over seeded random graphs of several sizes and degrees.
+
+    python benchmark.py --sizes 1000 10000 --k 5 7 --queries 50 --output report.json
+    python benchmark.py --sizes 1000 10000 --k 5 7 --queries 50 --baseline report.json
+
+With --baseline the report is compared with a stored one and the run fails
+if a search or build got slower than the tolerance allows.
+
+"""
+
+
+# Area of the euclidean space per point of the graph (main.py puts 500
+# points in a 500 x 500 space)
+AREA_PER_POINT = 500
+
+# Landmarks chosen for LandmarkAStar on each graph
+DEFAULT_LANDMARKS = 8
+
+
+def query_pairs(graph: Knn_Graph, queries: int, seed=None):
+    """
+    Draws pairs of distinct vertex ids to search between
+
+    Returns
+    -------
+    np.ndarray
+        A queries x 2 array of (start, destination) ids
+    """
+    rng = np.random.default_rng(seed)
+    n = graph.vertex_count
+    start = rng.integers(0, n, queries)
+    # A destination different from the start
+    destination = (start + rng.integers(1, max(n, 2), queries)) % n
+    return np.stack((start, destination), axis=1)
+
+
+def run_search(algorithm, graph: Knn_Graph, start: int, destination: int):
+    """
+    Runs one search between two vertices
+
+    Returns
+    -------
+    GenericSearch
+        The search, after it ran
+    bool
+        Wether the destination was reached
+    """
+    search = algorithm(graph.point(destination))
+    found = search.search(graph.point(start), graph)
+    return search, bool(found)
+
+
+def traced_peak(function, *args):
+    """
+    Calls a function with tracemalloc on, returns the peak of memory
+    allocated during the call (in bytes) and the result of the call
+    """
+    tracemalloc.start()
+    try:
+        result = function(*args)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return peak, result
+
+
+def build_graph(n: int, k: int, seed: int):
+    """
+    Builds a k-NN graph over n seeded random points
+    """
+    side = int(math.ceil(math.sqrt(n * AREA_PER_POINT)))
+    graph = Knn_Graph(side, side)
+    graph.grafo_knn(n, k, seed=seed)
+    return graph
+
+
+def benchmark_searches(graph: Knn_Graph, pairs: np.ndarray, algorithms: dict, memory: bool = True):
+    """
+    Runs every search over the same query pairs
+
+    Returns
+    -------
+    dict
+        By algorithm name, the times, expansions, pushes, peak queue sizes,
+        path lengths, how many destinations were reached and (with memory)
+        the peak memory of a search
+    """
+    results = {}
+    for name, algorithm in algorithms.items():
+        times = []
+        expansions = []
+        pushes = []
+        peak_open = []
+        lengths = []
+        found = 0
+        for start, destination in pairs.tolist():
+            began = time.perf_counter()
+            search, reached = run_search(algorithm, graph, start, destination)
+            times.append(time.perf_counter() - began)
+            expansions.append(search.stats.expansions)
+            pushes.append(search.stats.pushes)
+            peak_open.append(search.stats.peak_open)
+            if reached:
+                found += 1
+                lengths.append(path_length(graph, search.path))
+
+        result = {
+            "time_total": float(np.sum(times)),
+            "time_mean": float(np.mean(times)),
+            "time_median": float(np.median(times)),
+            "time_max": float(np.max(times)),
+            "expansions_mean": float(np.mean(expansions)),
+            "expansions_max": int(np.max(expansions)),
+            "pushes_mean": float(np.mean(pushes)),
+            "peak_open_mean": float(np.mean(peak_open)),
+            "path_length_mean": float(np.mean(lengths)) if lengths else None,
+            "found": found,
+        }
+        if memory:
+            # Traced separately, tracemalloc slows the searches down
+            result["peak_bytes"] = max(traced_peak(run_search, algorithm, graph, start, destination)[0]
+                                       for start, destination in pairs.tolist())
+        results[name] = result
+    return results
+
+
+def run_benchmark(sizes, degrees, queries: int = 20, seed: int = 0, algorithms: dict = None, memory: bool = True,
+                  landmarks: int = DEFAULT_LANDMARKS):
+    """
+    Sweeps the graph size and degree, building a seeded random graph for
+    each pair and timing every search over the same random queries
+
+    Parameters
+    ----------
+    sizes: list of int
+        The numbers of points n
+    degrees: list of int
+        The numbers of neighbours k
+    queries: int
+        How many searches to run on each graph, defaults to 20
+    seed: int
+        The seed of the points and of the queries, defaults to 0
+    algorithms: dict
+        The searches to run, by name, defaults to ALGORITHMS
+    memory: bool
+        Wether to measure the peak memory with tracemalloc (the build and
+        the searches are run again for it), defaults to True
+    landmarks: int
+        How many landmarks to select on each graph before the searches when
+        LandmarkAStar is among them (the time it takes is reported apart from
+        the build), defaults to DEFAULT_LANDMARKS
+
+    Returns
+    -------
+    dict
+        The report: a "meta" section describing the run and a "results"
+        list with one entry per (n, k)
+    """
+    algorithms = ALGORITHMS if algorithms is None else algorithms
+    report = {
+        "meta": {
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "machine": platform.machine(),
+            "seed": seed,
+            "queries": queries,
+            "algorithms": list(algorithms),
+            "landmarks": landmarks if "LandmarkAStar" in algorithms else 0,
+        },
+        "results": [],
+    }
+    for n in sizes:
+        for k in degrees:
+            began = time.perf_counter()
+            graph = build_graph(n, k, seed)
+            entry = {
+                "n": n,
+                "k": k,
+                "build_time": time.perf_counter() - began,
+                "graph_bytes": graph.memory_usage()["total"],
+            }
+            if memory:
+                entry["build_peak_bytes"] = traced_peak(build_graph, n, k, seed)[0]
+            if "LandmarkAStar" in algorithms:
+                # Without landmarks LandmarkAStar would only use the straight-line distance
+                began = time.perf_counter()
+                graph.select_landmarks(landmarks, seed)
+                entry["landmark_time"] = time.perf_counter() - began
+            entry["searches"] = benchmark_searches(graph, query_pairs(graph, queries, seed), algorithms, memory)
+            report["results"].append(entry)
+    return report
+
+
+def compare_reports(report: dict, baseline: dict, tolerance: float = 0.25, floor: float = 1e-3):
+    """
+    Looks for slowdowns of a report against a baseline, matching results by
+    (n, k) and searches by name
+
+    Parameters
+    ----------
+    report: dict
+        The new report
+    baseline: dict
+        The stored report
+    tolerance: float
+        How much slower a time may get, 0.25 allows 25%, defaults to 0.25
+    floor: float
+        Times under this many seconds in both reports are not compared, they
+        are mostly noise, defaults to 1ms
+
+    Returns
+    -------
+    list
+        One dict per slowdown, with the (n, k), what got slower, and the
+        old and new times
+    """
+    old = {(entry["n"], entry["k"]): entry for entry in baseline["results"]}
+    regressions = []
+
+    def check(n, k, what, before, after):
+        if before is None or after is None or max(before, after) < floor:
+            return
+        if after > before * (1.0 + tolerance):
+            regressions.append({"n": n, "k": k, "what": what, "baseline": before, "time": after,
+                                "ratio": after / before if before > 0 else math.inf})
+
+    for entry in report["results"]:
+        n, k = entry["n"], entry["k"]
+        if (n, k) not in old:
+            continue
+        check(n, k, "build", old[(n, k)]["build_time"], entry["build_time"])
+        for name, result in entry["searches"].items():
+            before = old[(n, k)]["searches"].get(name)
+            if before is not None:
+                check(n, k, name, before["time_median"], result["time_median"])
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compares the searches on time, memory and expansions")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 5000], help="numbers of points n")
+    parser.add_argument("--k", type=int, nargs="+", default=[5, 7], help="numbers of neighbours k")
+    parser.add_argument("--queries", type=int, default=20, help="searches per graph")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--algorithms", nargs="+", choices=sorted(ALGORITHMS), default=list(ALGORITHMS))
+    parser.add_argument("--landmarks", type=int, default=DEFAULT_LANDMARKS,
+                        help="landmarks selected for LandmarkAStar on each graph")
+    parser.add_argument("--no-memory", action="store_true", help="skip the tracemalloc runs")
+    parser.add_argument("--output", help="where to write the JSON report")
+    parser.add_argument("--baseline", help="a stored report to compare with")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed slowdown, 0.25 is 25%%")
+    args = parser.parse_args(argv)
+
+    report = run_benchmark(args.sizes, args.k, args.queries, args.seed,
+                           {name: ALGORITHMS[name] for name in args.algorithms}, not args.no_memory, args.landmarks)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare_reports(report, baseline, args.tolerance)
+        for r in regressions:
+            print("SLOWER: n=%d k=%d %s %.6fs -> %.6fs (x%.2f)" % (r["n"], r["k"], r["what"], r["baseline"],
+                                                                 r["time"], r["ratio"]), file=sys.stderr)
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,474 @@
+import argparse
+import heapq
+import json
+import math
+import sys
+import time
+import numpy as np
+from grafo_knn import Knn_Graph, Point
+from auxiliary_structures import HeapPriorityQueue
+from searches import AStar, GenericSearch
+
+"""
+
+This file builds a contraction hierarchy over a knn graph, for graphs that
+are built once and searched many times.
+
+The vertices are contracted one at a time, least important first: a vertex
+is taken out of the graph, and a shortcut edge is added between two of its
+neighbours whenever the path through it was their only shortest connection
+(no witness path is found around it). Each vertex keeps the edges to the
+neighbours it had when it was contracted, all of them more important than
+itself, so a query only climbs: a search up from the start and one up from
+the destination meet at the most important vertex of the shortest path.
+
+    hierarchy = ContractionHierarchy.build(graph)
+    print(hierarchy.stats())
+    search = ContractionSearch(graph.point(destination), hierarchy)
+    search.search(graph.point(start), graph)
+    search.path, search.distance
+
+    python contraction.py --size 20000 --k 5 --queries 200
+
+builds one and reports the preprocessing, the shortcuts and the query
+times against AStar.
+
+The hierarchy is only valid for the graph it was built on: it is rejected
+once the graph changes (see Knn_Graph.version).
+
+"""
+
+
+class ContractionHierarchy:
+    """
+    The contraction order of the vertices of a graph and its upward edges,
+    original or shortcut, as CSR arrays
+
+    Attributes
+    ----------
+    rank: np.ndarray
+        The position of each vertex in the contraction order, by vertex id
+    offsets: np.ndarray
+        The upward edges of vertex i are at positions offsets[i] to
+        offsets[i+1] of targets, weights and middles
+    targets: np.ndarray
+        The more important end of each upward edge
+    weights: np.ndarray
+        The length of each upward edge
+    middles: np.ndarray
+        For a shortcut, the vertex it skips, -1 for an original edge
+    version: int
+        The version of the graph it was built on
+    preprocessing_time: float
+        Seconds spent building it
+    original_edges: int
+        The edges of the graph, each counted once
+    """
+
+    def __init__(self, rank, offsets, targets, weights, middles, version: int = 0,
+                 preprocessing_time: float = 0.0, original_edges: int = 0):
+        self.rank = rank
+        self.offsets = offsets
+        self.targets = targets
+        self.weights = weights
+        self.middles = middles
+        self.version = version
+        self.preprocessing_time = preprocessing_time
+        self.original_edges = original_edges
+
+    @property
+    def vertex_count(self):
+        return len(self.rank)
+
+    @property
+    def shortcuts(self):
+        """
+        How many upward edges are shortcuts
+        """
+        return int(np.count_nonzero(self.middles >= 0))
+
+    @property
+    def nbytes(self):
+        return self.rank.nbytes + self.offsets.nbytes + self.targets.nbytes + self.weights.nbytes + self.middles.nbytes
+
+    def stats(self):
+        """
+        Returns the preprocessing time, the number of original and shortcut
+        edges, the shortcuts per original edge and the memory used
+        """
+        shortcuts = self.shortcuts
+        return {
+            "vertices": self.vertex_count,
+            "preprocessing_time": self.preprocessing_time,
+            "original_edges": self.original_edges,
+            "shortcuts": shortcuts,
+            "overhead": shortcuts / max(self.original_edges, 1),
+            "upward_edges": len(self.targets),
+            "nbytes": self.nbytes,
+        }
+
+    def upward(self, i: int):
+        """
+        Returns the more important neighbours of a vertex and the lengths of
+        the edges to them
+        """
+        start, end = self.offsets[i], self.offsets[i + 1]
+        return self.targets[start:end], self.weights[start:end]
+
+    def middle(self, u: int, v: int):
+        """
+        Returns the vertex the edge (u, v) skips, -1 if it is an original edge
+
+        Raises
+        ------
+        KeyError:
+            If there is no edge between u and v in the hierarchy
+        """
+        if self.rank[u] > self.rank[v]:
+            u, v = v, u
+        start = self.offsets[u]
+        found = np.flatnonzero(self.targets[start:self.offsets[u + 1]] == v)
+        if len(found) == 0:
+            raise KeyError("no edge between " + str(u) + " and " + str(v))
+        return int(self.middles[start + found[0]])
+
+    def unpack(self, path: list):
+        """
+        Replaces the shortcuts of a path by the original edges they stand for
+
+        Parameters
+        ----------
+        path: list
+            The ids of the vertices of a path in the hierarchy
+
+        Returns
+        -------
+        list
+            The ids of the vertices of the same path in the graph
+        """
+        if not path:
+            return []
+        unpacked = [path[0]]
+        for u, v in zip(path, path[1:]):
+            stack = [(u, v)]
+            while stack:
+                a, b = stack.pop()
+                m = self.middle(a, b)
+                if m < 0:
+                    unpacked.append(b)
+                else:
+                    # (a, m) first, then (m, b)
+                    stack.append((m, b))
+                    stack.append((a, m))
+        return unpacked
+
+    @classmethod
+    def build(cls, graph: Knn_Graph, witness_limit: int = 64):
+        """
+        Contracts every vertex of a graph
+
+        The order is chosen lazily by twice the edge difference (shortcuts
+        added minus edges removed), plus the number of neighbours already
+        contracted and the depth of the vertex in the hierarchy so far, so
+        the hierarchy stays sparse and shallow. Witness searches are Dijkstras
+        that settle at most witness_limit vertices: a witness missed only
+        costs an extra shortcut, never a wrong distance.
+
+        Parameters
+        ----------
+        graph: Knn_Graph
+            The graph
+        witness_limit: int
+            How many vertices a witness search settles at most, defaults to 64
+
+        Returns
+        -------
+        ContractionHierarchy
+            The hierarchy
+        """
+        began = time.perf_counter()
+        n = graph.vertex_count
+
+        # The remaining graph, as one dict of neighbour -> length per vertex
+        adjacency = [dict() for _ in range(n)]
+        for u in range(n):
+            ids, lengths = graph.neighbour_ids(u)
+            for v, length in zip(ids.tolist(), lengths.tolist()):
+                if v != u and length < adjacency[u].get(v, math.inf):
+                    adjacency[u][v] = length
+                    adjacency[v][u] = length
+        original_edges = sum(len(neighbours) for neighbours in adjacency) // 2
+
+        # The vertex each shortcut skips, by (smaller id, larger id)
+        middle = {}
+        contracted = np.zeros(n, dtype=bool)
+        contracted_neighbours = np.zeros(n, dtype=np.int64)
+        # One more than the deepest contracted neighbour, keeps the hierarchy shallow
+        level = np.zeros(n, dtype=np.int64)
+
+        def witness(source: int, avoid: int, limit: float, targets: dict):
+            # Shortest distances from source without going through avoid, as
+            # far as limit and witness_limit allow
+            distances = {source: 0.0}
+            heap = [(0.0, source)]
+            settled = 0
+            remaining = len(targets)
+            while heap and settled < witness_limit and remaining:
+                d, u = heapq.heappop(heap)
+                if d > distances[u]:
+                    continue
+                if d > limit:
+                    break
+                settled += 1
+                if u in targets:
+                    remaining -= 1
+                for v, length in adjacency[u].items():
+                    if v == avoid:
+                        continue
+                    cost = d + length
+                    if cost < distances.get(v, math.inf):
+                        distances[v] = cost
+                        heapq.heappush(heap, (cost, v))
+            return distances
+
+        def shortcuts_of(v: int):
+            # The shortcuts contracting v needs, as (u, x, length)
+            neighbours = list(adjacency[v].items())
+            shortcuts = []
+            for i, (u, to_u) in enumerate(neighbours[:-1]):
+                targets = {x: to_u + to_x for x, to_x in neighbours[i + 1:]}
+                distances = witness(u, v, max(targets.values()), targets)
+                for x, through in targets.items():
+                    if distances.get(x, math.inf) > through:
+                        shortcuts.append((u, x, through))
+            return shortcuts
+
+        def priority(v: int):
+            shortcuts = shortcuts_of(v)
+            return (2 * (len(shortcuts) - len(adjacency[v])) + int(contracted_neighbours[v]) + int(level[v]),
+                    shortcuts)
+
+        heap = [(priority(v)[0], v) for v in range(n)]
+        heapq.heapify(heap)
+
+        rank = np.empty(n, dtype=np.int64)
+        rows = [None] * n
+        order = 0
+        while heap:
+            _, v = heapq.heappop(heap)
+            if contracted[v]:
+                continue
+            # The priority may have gone up since it was pushed
+            current, shortcuts = priority(v)
+            if heap and current > heap[0][0]:
+                heapq.heappush(heap, (current, v))
+                continue
+
+            rank[v] = order
+            order += 1
+            contracted[v] = True
+            # Its remaining neighbours are all contracted later: its upward edges
+            rows[v] = [(u, length, middle.get((min(u, v), max(u, v)), -1)) for u, length in adjacency[v].items()]
+            for u in adjacency[v]:
+                del adjacency[u][v]
+                contracted_neighbours[u] += 1
+                level[u] = max(level[u], level[v] + 1)
+            adjacency[v] = {}
+            for u, x, length in shortcuts:
+                if length < adjacency[u].get(x, math.inf):
+                    adjacency[u][x] = length
+                    adjacency[x][u] = length
+                    middle[(min(u, x), max(u, x))] = v
+
+        offsets = np.zeros(n + 1, dtype=np.int64)
+        np.cumsum([len(row) for row in rows], out=offsets[1:])
+        edges = [edge for row in rows for edge in row]
+        targets = np.fromiter((edge[0] for edge in edges), dtype=np.int64, count=len(edges))
+        weights = np.fromiter((edge[1] for edge in edges), dtype=np.float64, count=len(edges))
+        middles = np.fromiter((edge[2] for edge in edges), dtype=np.int64, count=len(edges))
+        return cls(rank, offsets, targets, weights, middles, graph.version, time.perf_counter() - began,
+                   original_edges)
+
+
+@GenericSearch.register
+class ContractionSearch(GenericSearch):
+    """
+    A shortest path query over a ContractionHierarchy: Dijkstra upward from
+    the start and upward from the destination, taking turns by smallest key,
+    until neither side can improve the best meeting found. The path is then
+    unpacked into the original edges of the graph. Vertices reached by a
+    path that is not a shortest one, as an edge coming down to them shows,
+    are stalled: their edges are not relaxed.
+
+    visited_list and the stats count the vertices of the hierarchy settled by
+    both sides.
+    """
+
+    optimal = True
+
+    def __init__(self, destination: Point, hierarchy: ContractionHierarchy, on_expand=None, on_push=None,
+                 on_goal=None):
+        super().__init__(destination, on_expand, on_push, on_goal)
+        self._hierarchy = hierarchy
+
+        # Distances and parents of the upward search from the destination
+        self._cost = {}
+        self._cost_back = {}
+        self._parent_back = {}
+        self._queue_back = HeapPriorityQueue()
+
+        # Shortest path found so far, through the meeting vertex
+        self._mu = math.inf
+        self._meeting = -1
+
+    @property
+    def distance(self):
+        """
+        The length of the path found, inf if the destination was not reached
+        """
+        return self._mu
+
+    @property
+    def path(self):
+        if self._meeting < 0:
+            return []
+        path = [self._meeting]
+        while self._parent[path[-1]] is not None:
+            path.append(self._parent[path[-1]])
+        path.reverse()
+        while self._parent_back[path[-1]] is not None:
+            path.append(self._parent_back[path[-1]])
+        return self._hierarchy.unpack(path)
+
+    def heuristic(self, point: int, graph: Knn_Graph):
+        # A plain Dijkstra on both sides
+        return 0.0
+
+    def _settle(self, forward: bool):
+        """
+        Settles the vertex with the smallest key on one side and relaxes its
+        upward edges
+        """
+        if forward:
+            queue, cost, parent, other = self._queue, self._cost, self._parent, self._cost_back
+        else:
+            queue, cost, parent, other = self._queue_back, self._cost_back, self._parent_back, self._cost
+        actual, distance = queue.pop()
+        self._stats.pops += 1
+        self._visitedList.append(actual)
+        self._stats.expansions += 1
+        if self._on_expand is not None:
+            self._on_expand(self, actual)
+        if actual in other and distance + other[actual] < self._mu:
+            self._mu = distance + other[actual]
+            self._meeting = actual
+
+        targets, weights = self._hierarchy.upward(actual)
+        targets, weights = targets.tolist(), weights.tolist()
+        # Stall on demand: the edges are undirected, so an upward edge also
+        # comes down to this vertex. If a more important vertex reaches it
+        # shorter, its distance is not a shortest one and its edges are not
+        # relaxed
+        for node, length in zip(targets, weights):
+            if cost.get(node, math.inf) + length < distance:
+                self._stats.duplicate_skips += 1
+                return
+        for node, length in zip(targets, weights):
+            g = distance + length
+            if g < cost.get(node, math.inf):
+                cost[node] = g
+                parent[node] = actual
+                queue.push(node, g)
+                stats = self._stats
+                stats.pushes += 1
+                if len(self._queue) + len(self._queue_back) > stats.peak_open:
+                    stats.peak_open = len(self._queue) + len(self._queue_back)
+                if self._on_push is not None:
+                    self._on_push(self, node, g)
+                if node in other and g + other[node] < self._mu:
+                    self._mu = g + other[node]
+                    self._meeting = node
+
+    def search(self, start: Point, graph: Knn_Graph):
+        """
+        Do the search
+
+        Raises
+        ------
+        ValueError:
+            If the graph changed since the hierarchy was built
+        """
+        if graph.version != self._hierarchy.version or graph.vertex_count != self._hierarchy.vertex_count:
+            raise ValueError("the contraction hierarchy is out of date, build it again")
+        began = time.perf_counter()
+
+        self._destination_id = graph.vertex_id(self._destination)
+        start_id = graph.vertex_id(start)
+        if self._destination_id < 0 or start_id < 0:
+            self._stats.setup_time = time.perf_counter() - began
+            return False
+
+        self._cost[start_id] = 0.0
+        self._parent[start_id] = None
+        self._queue.push(start_id, 0.0)
+        self._cost_back[self._destination_id] = 0.0
+        self._parent_back[self._destination_id] = None
+        self._queue_back.push(self._destination_id, 0.0)
+        self._stats.pushes += 2
+        self._stats.peak_open = 2
+        looping = time.perf_counter()
+        self._stats.setup_time = looping - began
+
+        while True:
+            top = self._queue.peek()[1] if self._queue.size else math.inf
+            top_back = self._queue_back.peek()[1] if self._queue_back.size else math.inf
+            # Neither side can find a shorter path
+            if min(top, top_back) >= self._mu or (top == math.inf and top_back == math.inf):
+                break
+            self._settle(top <= top_back)
+
+        found = self._meeting >= 0
+        if found:
+            self._goal(self._destination_id)
+        self._stats.search_time = time.perf_counter() - looping
+        return found
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Builds a contraction hierarchy and times queries on it")
+    parser.add_argument("--graph", help="the graph file, see Knn_Graph.save")
+    parser.add_argument("--size", type=int, default=10000, help="without --graph, build a graph of this many points")
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--queries", type=int, default=100, help="random queries to time")
+    parser.add_argument("--witness-limit", type=int, default=64)
+    args = parser.parse_args(argv)
+
+    if args.graph:
+        graph = Knn_Graph.load(args.graph)
+    else:
+        side = int(np.ceil(np.sqrt(args.size * 500)))
+        graph = Knn_Graph(side, side)
+        graph.grafo_knn(args.size, args.k, seed=args.seed)
+    hierarchy = ContractionHierarchy.build(graph, args.witness_limit)
+    report = hierarchy.stats()
+
+    pairs = np.random.default_rng(args.seed).integers(0, graph.vertex_count, (args.queries, 2))
+    for name, make in (("AStar", AStar), ("ContractionSearch", lambda d: ContractionSearch(d, hierarchy))):
+        times = []
+        expansions = []
+        for start, destination in pairs.tolist():
+            search = make(graph.point(destination))
+            began = time.perf_counter()
+            search.search(graph.point(start), graph)
+            times.append(time.perf_counter() - began)
+            expansions.append(search.stats.expansions)
+        report[name] = {"time_mean": float(np.mean(times)), "expansions_mean": float(np.mean(expansions))}
+
+    json.dump(report, sys.stdout, indent=2)
+    print()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
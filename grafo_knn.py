@@ -1,5 +1,13 @@
+import heapq
+import json
 import math
+import multiprocessing
+import os
+import struct
+from multiprocessing import shared_memory
 import numpy as np
+from collections import OrderedDict
+from auxiliary_structures import CsrAdjacency, HeuristicCache, PointStore, SpatialGrid, TileCache
 '''
 
 The k-nearest neighbor graph (k-NNG) is a graph in which
@@ -19,6 +27,10 @@ class Point:
     """
     This class defines a point in an euclidean space
 
+    Points that belong to a Knn_Graph are light views of the graph's
+    coordinate arrays: they also carry the id of their vertex. Points are
+    hashable, two points with the same coordinates are equal.
+
     ...
 
     Attributes
@@ -27,13 +39,17 @@ class Point:
         The x coordinate of the point
     y : int
         The y coordinate of the point
+    id : int
+        The id of the vertex of a graph this point is, -1 if none
 
     Methods
     -------
 
     """
 
-    def __init__(self, x: int = 0, y: int = 0):
+    __slots__ = ("_x", "_y", "_id")
+
+    def __init__(self, x: int = 0, y: int = 0, id: int = -1):
         """
         Initializes a point in an euclidean space
 
@@ -43,18 +59,23 @@ class Point:
             The x coordinate of the point, defaults to 0
         y : int, optional
             The y coordinate of the point, defaults to 0
+        id : int, optional
+            The id of the vertex this point is, defaults to -1 (none)
 
         """
 
         self._x = x;
         self._y = y;
+        self._id = id;
 
     @property
     def x(self):
         return self._x
     @x.setter
     def x(self, x):
-        self._x = x 
+        # A moved point is no longer a view of its vertex
+        self._x = x
+        self._id = -1
 
     @property
     def y(self):
@@ -62,21 +83,62 @@ class Point:
     @y.setter
     def y(self, y):
         self._y = y
+        self._id = -1
+
+    @property
+    def id(self):
+        return self._id
 
     # Overload == operator
     def __eq__(self, other):
-        if self._x == other.x:
-            if self._y == other.y:
-                return True
-        return False
+        return self._x == other.x and self._y == other.y
+
+    def __hash__(self):
+        return hash((self._x, self._y))
+
+    def __repr__(self):
+        return "Point(" + str(self._x) + ", " + str(self._y) + ")"
 
     # Overload + operator
     def __add__(self, other):
-        return Point(self._x+other.x(), self._y+other.y())
+        return Point(self._x+other.x, self._y+other.y)
 
     # Overload - operator
     def __sub__(self, other):
-        return Point(self._x-other.x(), self._y-other.y())
+        return Point(self._x-other.x, self._y-other.y)
+
+
+class Point_Sequence:
+    """
+    A read-only sequence of the points of a Knn_Graph, built on demand from
+    the graph's coordinate array: point i is the vertex of id i
+
+    """
+
+    __slots__ = ("_store",)
+
+    def __init__(self, store: PointStore):
+        self._store = store
+
+    def __len__(self):
+        return self._store.size
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError("point id out of range: " + str(i))
+        return self._point(i)
+
+    def _point(self, i: int):
+        x, y = self._store.coords[i].tolist()
+        return Point(x, y, i)
+
+    def __iter__(self):
+        for i, (x, y) in enumerate(self._store.coords.tolist()):
+            yield Point(x, y, i)
 
 
 class Edge:
@@ -121,7 +183,7 @@ class Edge:
         self._p2 = p2
 
     # Overrides the == operator
-    def __EQ__(self, other):
+    def __eq__(self, other):
         """
         Verifies wether an edge is equal to another
         Considers that the edges are not directed, 
@@ -134,20 +196,27 @@ class Edge:
         """
 
         # Gets the two points that define the other edge
-        p1e = other.p1()
-        p2e = other.p2()
-
-        # Compare them:
-        # is the first point equal to any of the points in this edge ?
-        if p1e == self._p1 or p1e == self._p2:
-            # Now we check the other point
-            if p2e == self._p1 or p2e == self._p2:
-                # The edges are equal
-                return True
+        p1e = other.p1
+        p2e = other.p2
+
+        # Compare them, either way round
+        if p1e == self._p1 and p2e == self._p2:
+            return True
+        if p1e == self._p2 and p2e == self._p1:
+            return True
         # The edges are different
         return False
 
 
+# Maximum number of point-to-point distances held in memory at once by the
+# vectorized kernels (2**22 float64 values are 32MB per temporary array)
+DEFAULT_BLOCK_SIZE = 2**22
+
+# Relative rounding error allowed for the float32 landmark distances, twice
+# that of a float32
+LANDMARK_EPSILON = 2.0**-22
+
+
 class Euclidean_Space:
     """
     This class defines an euclidean space
@@ -250,203 +319,2289 @@ class Euclidean_Space:
 
         raise ValueError
 
+    def as_coords(self, points, check: bool = True):
+        """
+        Converts points to a n x 2 float array of coordinates, checking once
+        for the whole array that they belong to this space
 
-class Knn_Graph(Euclidean_Space):
-    """
-    This class inherits functions from the Euclidean Space class
-    and adds a vector of points and a vector of edges, to completely
-    represent a knn graph
-
-    Attributes
-    ----------
-        points: np.ndarray
-            A list of points on this graph
-        edges: np.ndarray
-            A list of edges
-
-    Methods
-    -------
+        Parameters
+        ----------
+        points: Point, list of Points or array like
+            The points, or their coordinates
+        check: bool
+            Wether to check the bounds, defaults to True
 
-    """
+        Returns
+        -------
+        np.ndarray
+            The coordinates, one point per row
 
+        Raises
+        ------
+        ValueError:
+            Raises ValueError if one of the points is outside of this euclidean space
+        """
 
-    def __init__(self, x_size: int, y_size: int):
-        # Calls super constructor
-        super().__init__(x_size, y_size)
+        if isinstance(points, Point):
+            points = [points]
+        if len(points) and isinstance(points[0], Point):
+            points = [(p.x, p.y) for p in points]
+        coords = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+        if check and len(coords) and (coords[:, 0].max() > self._xSize or coords[:, 1].max() > self._ySize):
+            raise ValueError
+        return coords
 
-        # Declare vectors of points and edges
-        self._points = []
-        self._edges = []
+    def distances(self, point, points, check: bool = True):
+        """
+        Calculates the euclidean distances from one point to many
 
+        Parameters
+        ----------
+        point: Point or array like
+            The point to measure from
+        points: list of Points or array like
+            The points to measure to
+        check: bool
+            Wether to check the bounds, defaults to True
 
-    @property
-    def points(self):
-        return self._points
-    @points.setter
-    def points(self, points):
-        self._points = points
+        Returns
+        -------
+        np.ndarray
+            The distance to points[i] at position i
 
-    @property
-    def edges(self):
-        return self._edges
-    @edges.setter
-    def edges(self, edges):
-        self._edges = edges
+        Raises
+        ------
+        ValueError:
+            Raises ValueError if one of the points is outside of this euclidean space
+        """
 
+        origin = self.as_coords(point, check)[0]
+        delta = self.as_coords(points, check) - origin
+        return np.sqrt(np.einsum("ij,ij->i", delta, delta))
 
-    def add_point(self, p: Point):
+    def distance_blocks(self, points1, points2, block_size: int = DEFAULT_BLOCK_SIZE, check: bool = True):
         """
-        Adds a point to this Graph
+        Calculates the euclidean distances between two sets of points, a
+        block of rows at a time, so that no more than block_size distances
+        are held in memory at once
 
         Parameters
         ----------
-        p: Point
-            The point to add
+        points1: list of Points or array like
+            The points of the rows
+        points2: list of Points or array like
+            The points of the columns
+        block_size: int
+            How many distances are computed at once, defaults to
+            DEFAULT_BLOCK_SIZE
+        check: bool
+            Wether to check the bounds, defaults to True
+
+        Yields
+        ------
+        int
+            The index in points1 of the first row of the block
+        np.ndarray
+            The distances from those rows to every point of points2
 
+        Raises
+        ------
+        ValueError:
+            Raises ValueError if one of the points is outside of this euclidean space
         """
 
-        # check if the point already exists in the graph
-        for point in self._points:
-            # Point already exists, try to add a new random point
-            if point == p:
-                self.add_point(Point(np.random.randint(0, self._xSize), np.random.randint(0, self._ySize)))
-        self._points.append(p)
+        rows = self.as_coords(points1, check)
+        cols = self.as_coords(points2, check)
+        step = max(1, block_size // max(len(cols), 1))
+        for start in range(0, len(rows), step):
+            block = rows[start:start + step]
+            dx = block[:, 0, None] - cols[None, :, 0]
+            dy = block[:, 1, None] - cols[None, :, 1]
+            yield start, np.sqrt(dx * dx + dy * dy)
 
-    def add_edge(self, e: Edge):
+    def pairwise_distances(self, points1, points2, block_size: int = DEFAULT_BLOCK_SIZE, check: bool = True):
         """
-        Adds an Edge to this Graph
+        Calculates the euclidean distances between two sets of points
 
-        Parameters
-        ----------
-        e: Edge
-            The edge to add
+        Returns
+        -------
+        np.ndarray
+            A len(points1) x len(points2) matrix, the distance between
+            points1[i] and points2[j] at position (i, j)
 
+        See distance_blocks for the parameters
         """
 
-        # check if the graph contains the points that the edge reffers to
-        if e.p1 in self._points and e.p2 in self._points:
-            # append the edge to the list, if it is not there already
-            if e not in self._edges:
-                self._edges.append(e)
-            else:
-                # The edge is already present on the graph, raise error
-                raise ValueError.with_traceback()
- 
-    def farthest_point(self, point: Point):
-        """
-        Finds the point that is farther away from a given point on the graph
-        obs. The point given as argument must have already been removed from the list
+        rows = self.as_coords(points1, check)
+        cols = self.as_coords(points2, check)
+        result = np.empty((len(rows), len(cols)))
+        for start, block in self.distance_blocks(rows, cols, block_size, False):
+            result[start:start + len(block)] = block
+        return result
 
-        Parameters
-        ----------
-        point: Point
-            The point to which the farthest point will be found
+    def set_distances(self, points, sources, block_size: int = DEFAULT_BLOCK_SIZE, check: bool = True):
+        """
+        Calculates the distance from each point to the nearest of a set of
+        source points
 
         Returns
         -------
-        Float
-            The distance found
-        Point
-            The point that is farther away from the given point
+        np.ndarray
+            The distance from points[i] to its nearest source at position i,
+            inf if there are no sources
+
+        See distance_blocks for the parameters
         """
 
-        # assume the maximum distance to be 0
-        max_distance = 0
-        # Temporary Point
-        pTemp = Point()
+        coords = self.as_coords(points, check)
+        result = np.full(len(coords), np.inf)
+        if len(coords):
+            for start, block in self.distance_blocks(sources, coords, block_size, check):
+                np.minimum(result, block.min(axis=0), out=result)
+        return result
 
-        # Percorre todos os pontos para checar a maior distancia
-        for p in self._points:
-            # Calcula a distancia entre o ponto argumento e o ponto atual
-            distance = self.distance(point, p)
-            # Se a distancia for maior que a máxima, atualiza a máxima e salva o ponto
-            if distance > max_distance:
-                max_distance = distance 
-                pTemp = p
-        # Retorna a distância e o ponto encontrados
-        return distance, pTemp
+    def farthest_from_set(self, points, sources, block_size: int = DEFAULT_BLOCK_SIZE, check: bool = True):
+        """
+        Finds, among some points, the one farthest away from a set of source
+        points (the one whose nearest source is the farthest)
 
-    def nearest_neighbour(self, point: Point, minimalDistance : float = 0.0): 
+        Returns
+        -------
+        int
+            The index of that point, -1 if there are no points
+        float
+            Its distance to the nearest source
+
+        See distance_blocks for the parameters
         """
-        Returns the nearest point to the given point
 
-        Parameters
-        ----------
-        point: Point
-            The point whose nearest neighbour will be found
+        distances = self.set_distances(points, sources, block_size, check)
+        if not len(distances):
+            return -1, math.inf
+        i = int(np.argmax(distances))
+        return i, float(distances[i])
+
+    def nearest_from_set(self, points, sources, block_size: int = DEFAULT_BLOCK_SIZE, check: bool = True):
+        """
+        Finds, among some points, the one nearest to a set of source points
 
-        minimalDistance: float
-            Only look for points farther than this distance, defaults to 0
-        
         Returns
         -------
-        Point
-            The nearest neighbour
-        Float
-            The distance
+        int
+            The index of that point, -1 if there are no points
+        float
+            Its distance to the nearest source
+
+        See distance_blocks for the parameters
         """
 
-        temp = Point() # instantiates a new point at the origin
-        tempMin = self.ySize*self.xSize # Defines the minimum distance as the area of the euclidean space
+        distances = self.set_distances(points, sources, block_size, check)
+        if not len(distances):
+            return -1, math.inf
+        i = int(np.argmin(distances))
+        return i, float(distances[i])
 
-        # go through all the points on the graph
-        for p in self._points:
-            # if a point is nearer than the current minimal distance,
-            # assigns it as the new nearest point
-            dist = self.distance(p, point)
-            if(dist < tempMin and dist > minimalDistance ):
-                # the new nearest neighbour is p
-                temp = p
-                # the new nearest distance is the newfound one
-                tempMin = dist
 
-        return temp, tempMin
+def _knn_block(coords: np.ndarray, rows: np.ndarray, cols: np.ndarray, k: int, limit: np.ndarray, truncate: bool = True):
+    """
+    Finds the k nearest neighbours of a block of rows among a set of columns
 
-    def neighbours(self, point: Point):
-        """
-        Return all the direct neighbours for a given point
+    A neighbour is counted only once per distinct distance and, on ties, the
+    one with the lowest id wins, which is what repeated calls to
+    Knn_Graph.nearest_neighbour produce. Zero distances are ignored.
 
-        Parameters
-        ----------
-        point: Point
-            The point whose neighbours will be returned
+    Parameters
+    ----------
+    coords: np.ndarray
+        The n x 2 array of point coordinates
+    rows: np.ndarray
+        The ids of the points whose neighbours will be found
+    cols: np.ndarray
+        The ids of the candidate neighbours
+    k: int
+        How many neighbours to find for each row
+    limit: np.ndarray
+        For each row, the squared distance under which every point of the
+        graph is known to be among cols (np.inf if cols holds every point)
+    truncate: bool
+        Wether to keep only a few of the nearest candidates (argpartition)
+        before sorting them, defaults to True
+
+    Returns
+    -------
+    np.ndarray
+        A len(rows) x k array of neighbour ids, -1 where there is none
+    np.ndarray
+        A boolean mask of the rows whose answer is exact, the others must be
+        asked again with more columns or without truncation
+    """
 
-        Returns
-        -------
-        neighbours: Point[]
-            A list of neighbour points
+    dx = coords[rows, 0][:, None] - coords[cols, 0][None, :]
+    dy = coords[rows, 1][:, None] - coords[cols, 1][None, :]
+    d2 = dx * dx + dy * dy
+    del dx, dy
+    # The point itself (and its duplicates) is never a neighbour
+    d2[d2 <= 0] = np.inf
+
+    take = min(len(cols), 4 * k + 4)
+    limit = np.array(limit, dtype=np.float64)
+    if truncate and take < len(cols):
+        # Keep only the take smallest distances of each row, every distance
+        # strictly smaller than the largest one kept is then known
+        part = np.argpartition(d2, take - 1, axis=1)[:, :take]
+        vals = np.take_along_axis(d2, part, axis=1)
+        cand = cols[part]
+        np.minimum(limit, vals.max(axis=1), out=limit)
+    else:
+        vals = d2
+        cand = np.broadcast_to(cols, d2.shape)
+    del d2
+
+    result, _, found = _select_nearest(vals, cand, k, limit)
+
+    # A row is done if it found k neighbours, or if it saw every point
+    done = (found >= k) | np.isinf(limit)
+    return result, done
+
+
+def _select_nearest(vals: np.ndarray, cand: np.ndarray, k: int, limit: np.ndarray):
+    """
+    Picks, for each row, the k candidates with the smallest squared distances
+    under limit, one per distinct distance and the lowest id on ties
 
-        """
+    Returns
+    -------
+    np.ndarray
+        The ids picked for each row, -1 where there is none
+    np.ndarray
+        Their squared distances, inf where there is none
+    np.ndarray
+        How many were picked for each row
+    """
 
-        neighbours = []
+    # Sort by distance, then by id
+    order = np.lexsort((cand, vals), axis=1)
+    vals = np.take_along_axis(vals, order, axis=1)
+    cand = np.take_along_axis(cand, order, axis=1)
 
-        # First we find all the edges spanning from point:
-        for edge in self._edges:
-            # Check if point is in one of the edge's ends:
-            if point == edge.p1:
-                # The other point is a neighbour !
-                neighbours.append(edge.p2)
-            elif point == edge.p2:
-                # p1 is a neighbour:
-                neighbours.append(edge.p1)
+    # First occurrence of each distinct distance that is known to be exact
+    keep = np.ones(vals.shape, dtype=bool)
+    keep[:, 1:] = vals[:, 1:] != vals[:, :-1]
+    keep &= vals < limit[:, None]
+    rank = np.cumsum(keep, axis=1)
+    keep &= rank <= k
 
-        return neighbours
+    ids = np.full((len(vals), k), -1, dtype=np.int64)
+    dists = np.full((len(vals), k), np.inf)
+    r, c = np.nonzero(keep)
+    ids[r, rank[r, c] - 1] = cand[r, c]
+    dists[r, rank[r, c] - 1] = vals[r, c]
 
-    def grafo_knn(self, v, k):
-        # Para o tamanho V faça
-        for i in range(0,v):
-            print("gerando ponto .."+str(i))
-            # Adiciona um ponto aleatóreo na lista de pontos, o ponto não pode ser maior do que 
-            # o tamanho do espaço euclidiano
-            self.add_point(Point(np.random.randint(0, self._xSize), np.random.randint(0, self._ySize)))
-        # Para cada vértice faça
-        for edx, vertex in enumerate(self.points):
-            print("Gerando hastes do ponto "+str(edx))
-            min_distance = 0
-            tempPoint = Point()
-            # Designa k arestas
-            for i in range(0,k):
-                #Encontra os k vizinhos mais próximos
-                tempPoint, min_distance = self.nearest_neighbour(vertex, min_distance)
-                # Adiciona ao conjunto de arestas
-                self.add_edge(Edge(vertex, tempPoint))
+    return ids, dists, np.minimum(rank[:, -1], k)
+
+
+def _knn_grid(coords: np.ndarray, k: int):
+    """
+    Buckets the points in a uniform grid with cells big enough to hold a few
+    times k points each
+
+    Returns
+    -------
+    np.ndarray
+        The point ids sorted by cell
+    np.ndarray
+        Where each cell starts in that order (one extra entry at the end)
+    np.ndarray
+        For each point, the squared distance under which every other point is
+        in one of the 3x3 cells around it
+    int
+        The number of cell columns
+    """
+
+    n = len(coords)
+    low = coords.min(axis=0)
+    span = np.maximum(coords.max(axis=0) - low, 1.0)
+    cell = max(np.sqrt(span[0] * span[1] * max(4 * k, 32) / n), 1.0)
+    ncx = int(span[0] // cell) + 1
+    ncy = int(span[1] // cell) + 1
+    cx = ((coords[:, 0] - low[0]) // cell).astype(np.int64)
+    cy = ((coords[:, 1] - low[1]) // cell).astype(np.int64)
+    cells = cy * ncx + cx
+    order = np.argsort(cells, kind="stable")
+    start = np.zeros(ncx * ncy + 1, dtype=np.int64)
+    np.cumsum(np.bincount(cells, minlength=ncx * ncy), out=start[1:])
+
+    # Distance from each point to the border of its cell, anything outside the
+    # 3x3 cells around it is at least one cell plus that far away
+    ox = coords[:, 0] - low[0] - cx * cell
+    oy = coords[:, 1] - low[1] - cy * cell
+    margin = cell + np.minimum(np.minimum(ox, cell - ox), np.minimum(oy, cell - oy))
+
+    return order, start, margin * margin, ncx
+
+
+def _knn_cells(coords, order, start, limit, ncx, k, block_size, first, last, result):
+    """
+    Solves the points of cells first..last-1 against the 3x3 cells around them,
+    writing into result
+
+    Returns
+    -------
+    np.ndarray
+        The ids of the points that must be solved against every point
+    """
+
+    ncy = (len(start) - 1) // ncx
+    retry = [np.zeros(0, dtype=np.int64)]
+    for c in range(first, last):
+        if start[c + 1] == start[c]:
+            continue
+        x, y = c % ncx, c // ncx
+        rows = order[start[c]:start[c + 1]]
+        cols = np.concatenate([
+            order[start[j * ncx + max(x - 1, 0)]:start[j * ncx + min(x + 1, ncx - 1) + 1]]
+            for j in range(max(y - 1, 0), min(y + 1, ncy - 1) + 1)
+        ])
+        step = max(1, block_size // len(cols))
+        for i in range(0, len(rows), step):
+            chunk = rows[i:i + step]
+            ids, done = _knn_block(coords, chunk, cols, k, limit[chunk])
+            result[chunk[done]] = ids[done]
+            retry.append(chunk[~done])
+
+    return np.concatenate(retry)
+
+
+def _knn_rows(coords, rows, k, block_size, result):
+    """
+    Solves the given points against every point, in blocks of rows, writing
+    into result
+    """
+
+    out = np.full((len(rows), k), -1, dtype=np.int64)
+    _knn_rows_into(coords, rows, k, block_size, out)
+    result[rows] = out
+
+
+def _knn_rows_into(coords, rows, k, block_size, out):
+    """
+    Solves the given points against every point, in blocks of rows, writing
+    the neighbours of rows[i] into out[i]
+    """
+
+    cols = np.arange(len(coords))
+    step = max(1, block_size // len(coords))
+    for i in range(0, len(rows), step):
+        chunk = rows[i:i + step]
+        unbounded = np.full(len(chunk), np.inf)
+        ids, done = _knn_block(coords, chunk, cols, k, unbounded)
+        if not done.all():
+            # Too many ties for the truncated sort, sort the whole rows
+            ids[~done], _ = _knn_block(coords, chunk[~done], cols, k, unbounded[~done], False)
+        out[i:i + step] = ids
+
+
+def knn_neighbours(coords: np.ndarray, k: int, block_size: int = DEFAULT_BLOCK_SIZE, workers: int = 1):
+    """
+    Finds the k nearest neighbours of every point, working on all of the
+    coordinates at once
+
+    Points are bucketed in a uniform grid and the neighbours of the points of a
+    cell are first looked for in the 3x3 cells around it. Rows for which that
+    is not enough are solved against every point, in blocks of rows.
+
+    Parameters
+    ----------
+    coords: np.ndarray
+        The n x 2 array of point coordinates
+    k: int
+        How many neighbours to find for each point
+    block_size: int
+        The maximum number of distances computed at once (per worker),
+        defaults to DEFAULT_BLOCK_SIZE
+    workers: int
+        How many processes share the work, see knn_neighbours_parallel
+        (0 uses one per CPU), defaults to 1
+
+    Returns
+    -------
+    np.ndarray
+        A n x k array of neighbour ids, nearest first, -1 where there is none
+    """
+
+    coords = np.asarray(coords, dtype=np.float64)
+    n = len(coords)
+    if n == 0 or k <= 0:
+        return np.full((n, max(k, 0)), -1, dtype=np.int64)
+    if workers != 1:
+        return knn_neighbours_parallel(coords, k, block_size, workers)
+
+    result = np.full((n, k), -1, dtype=np.int64)
+    order, start, limit, ncx = _knn_grid(coords, k)
+    retry = _knn_cells(coords, order, start, limit, ncx, k, block_size, 0, len(start) - 1, result)
+    _knn_rows(coords, np.sort(retry), k, block_size, result)
+
+    return result
+
+
+# Arrays shared with the worker processes of knn_neighbours_parallel, each
+# worker attaches to them once, when it starts
+_shared = {}
+
+
+def _knn_worker_init(layout: dict):
+    for key, (name, shape, dtype) in layout.items():
+        # Pool workers share the resource tracker of the process that created
+        # the blocks, so attaching does not hand over their ownership
+        block = shared_memory.SharedMemory(name=name)
+        _shared[key] = (block, np.ndarray(shape, dtype=dtype, buffer=block.buf))
+
+
+def _knn_worker(task):
+    kind, first, last, k, block_size = task
+    coords = _shared["coords"][1]
+    result = _shared["result"][1]
+    if kind == "cells":
+        order, start, limit = _shared["order"][1], _shared["start"][1], _shared["limit"][1]
+        ncx = int(_shared["ncx"][1][0])
+        return _knn_cells(coords, order, start, limit, ncx, k, block_size, first, last, result)
+    _knn_rows(coords, _shared["retry"][1][first:last], k, block_size, result)
+    return None
+
+
+def _balanced_ranges(weights: np.ndarray, parts: int):
+    """
+    Splits range(len(weights)) into at most parts contiguous ranges of about
+    the same total weight
+    """
+
+    total = np.cumsum(weights)
+    if len(total) == 0 or total[-1] == 0:
+        return []
+    cuts = np.searchsorted(total, np.linspace(0, total[-1], parts + 1)[1:-1], side="right")
+    bounds = np.unique(np.concatenate(([0], cuts, [len(weights)])))
+    return list(zip(bounds[:-1].tolist(), bounds[1:].tolist()))
+
+
+def knn_neighbours_parallel(coords: np.ndarray, k: int, block_size: int = DEFAULT_BLOCK_SIZE, workers: int = 0):
+    """
+    Same as knn_neighbours, with the work split among several processes
+
+    The coordinates, the grid and the result are placed in shared memory once,
+    each worker solves a slice of the cells (then a slice of the remaining
+    rows) and writes its neighbour ids straight into the shared result, so
+    nothing but task bounds and id arrays go through pickling.
+
+    Parameters
+    ----------
+    coords: np.ndarray
+        The n x 2 array of point coordinates
+    k: int
+        How many neighbours to find for each point
+    block_size: int
+        The maximum number of distances computed at once by each worker,
+        defaults to DEFAULT_BLOCK_SIZE
+    workers: int
+        How many processes to use, 0 uses one per CPU, defaults to 0
+
+    Returns
+    -------
+    np.ndarray
+        A n x k array of neighbour ids, nearest first, -1 where there is none
+    """
+
+    coords = np.asarray(coords, dtype=np.float64)
+    n = len(coords)
+    if n == 0 or k <= 0:
+        return np.full((n, max(k, 0)), -1, dtype=np.int64)
+    workers = workers if workers > 0 else (os.cpu_count() or 1)
+
+    order, start, limit, ncx = _knn_grid(coords, k)
+    arrays = {
+        "coords": coords,
+        "order": order,
+        "start": start,
+        "limit": limit,
+        "ncx": np.array([ncx], dtype=np.int64),
+        "result": np.full((n, k), -1, dtype=np.int64),
+        "retry": np.zeros(n, dtype=np.int64),
+    }
+
+    blocks = []
+    layout = {}
+    try:
+        for key, array in arrays.items():
+            block = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+            blocks.append(block)
+            view = np.ndarray(array.shape, dtype=array.dtype, buffer=block.buf)
+            view[...] = array
+            arrays[key] = view
+            layout[key] = (block.name, array.shape, array.dtype.str)
+
+        with multiprocessing.Pool(workers, _knn_worker_init, (layout,)) as pool:
+            # A few tasks per worker, balanced by the number of points per cell
+            ranges = _balanced_ranges(np.diff(start), 4 * workers)
+            retry = pool.map(_knn_worker, [("cells", a, b, k, block_size) for a, b in ranges])
+            retry = np.sort(np.concatenate(retry)) if retry else np.zeros(0, dtype=np.int64)
+
+            arrays["retry"][:len(retry)] = retry
+            ranges = _balanced_ranges(np.ones(len(retry)), 4 * workers)
+            pool.map(_knn_worker, [("rows", a, b, k, block_size) for a, b in ranges])
+
+        result = np.array(arrays["result"])
+    finally:
+        # Views into the blocks must be gone before they can be closed
+        view = None
+        arrays.clear()
+        for block in blocks:
+            block.close()
+            block.unlink()
+
+    return result
+
+
+def _merge_candidates(coords, rows, ids, dists, cand, k, repeats=True):
+    """
+    Merges new candidate neighbours (-1 for none) into the current neighbours
+    of the given rows, returns the new ids and squared distances. repeats
+    tells wether a candidate may show up more than once, or be a current
+    neighbour already
+    """
+
+    dx = coords[rows, 0][:, None] - coords[cand, 0]
+    dy = coords[rows, 1][:, None] - coords[cand, 1]
+    d2 = dx * dx + dy * dy
+    d2[(d2 <= 0) | (cand < 0)] = np.inf
+
+    # A candidate that is already a neighbour, or that shows up more than
+    # once, must not take the place of another one
+    cand = np.concatenate((ids, cand), axis=1)
+    vals = np.concatenate((dists, d2), axis=1)
+    if repeats:
+        by_id = np.argsort(cand, axis=1, kind="stable")
+        sorted_ids = np.take_along_axis(cand, by_id, axis=1)
+        repeated = np.zeros(cand.shape, dtype=bool)
+        repeated[:, 1:] = sorted_ids[:, 1:] == sorted_ids[:, :-1]
+        r, c = np.nonzero(repeated)
+        vals[r, by_id[r, c]] = np.inf
+
+    take = 2 * k + 2
+    if vals.shape[1] > take:
+        # Only the nearest few can make it, the others are not worth sorting
+        part = np.argpartition(vals, take - 1, axis=1)[:, :take]
+        vals = np.take_along_axis(vals, part, axis=1)
+        cand = np.take_along_axis(cand, part, axis=1)
+    new_ids, new_dists, _ = _select_nearest(vals, cand, k, np.full(len(rows), np.inf))
+    return new_ids, new_dists
+
+
+def knn_neighbours_approximate(coords: np.ndarray, k: int, cell_points: float = 2.0, iterations: int = 0,
+                               sample_rate: float = 0.5, seed=None, block_size: int = DEFAULT_BLOCK_SIZE):
+    """
+    Finds approximately the k nearest neighbours of every point
+
+    Points are bucketed in a grid with about cell_points points per cell and
+    the neighbours of each point are looked for only in the 3x3 cells around
+    it, all rows at once and without checking (as knn_neighbours does) that
+    nothing nearer was left outside. The guess can then be refined by a few
+    iterations of NN-descent: every point is compared with the neighbours and
+    reverse neighbours of a sample of its own neighbours and reverse
+    neighbours, since a neighbour of a neighbour is likely to be a neighbour.
+
+    Parameters
+    ----------
+    coords: np.ndarray
+        The n x 2 array of point coordinates
+    k: int
+        How many neighbours to find for each point
+    cell_points: float
+        The average number of points per cell of the grid. Higher values look
+        at more candidates, for a better recall and a slower build, defaults
+        to 2
+    iterations: int
+        How many NN-descent iterations refine the grid guess, defaults to 0
+    sample_rate: float
+        The fraction of the k neighbours (and of as many reverse neighbours)
+        explored per point at each NN-descent iteration, defaults to 0.5
+    seed: int, optional
+        Seed for the NN-descent sampling
+    block_size: int
+        The maximum number of distances computed at once, defaults to
+        DEFAULT_BLOCK_SIZE
+
+    Returns
+    -------
+    np.ndarray
+        A n x k array of neighbour ids, nearest first, -1 where there is none
+    """
+
+    coords = np.asarray(coords, dtype=np.float64)
+    n = len(coords)
+    if n == 0 or k <= 0:
+        return np.full((n, max(k, 0)), -1, dtype=np.int64)
+    rng = np.random.default_rng(seed)
+
+    ids = np.full((n, k), -1, dtype=np.int64)
+    dists = np.full((n, k), np.inf)
+
+    # Grid of cells, padded into a table with one row of ids per cell (the
+    # extra last row, all -1, stands for the cells outside the grid)
+    low = coords.min(axis=0)
+    span = np.maximum(coords.max(axis=0) - low, 1.0)
+    cell = np.sqrt(span[0] * span[1] * cell_points / n)
+    ncx = int(span[0] // cell) + 1
+    ncy = int(span[1] // cell) + 1
+    cx = ((coords[:, 0] - low[0]) // cell).astype(np.int64)
+    cy = ((coords[:, 1] - low[1]) // cell).astype(np.int64)
+    cells = cy * ncx + cx
+    order = np.argsort(cells, kind="stable")
+    counts = np.bincount(cells, minlength=ncx * ncy)
+    start = np.cumsum(counts) - counts
+    # Cells much fuller than the others keep only some of their points as
+    # candidates, so that the table is not mostly padding
+    width = max(1, int(np.ceil(np.percentile(counts[counts > 0], 99))))
+    slot = np.arange(n) - start[cells[order]]
+    fits = slot < width
+    table = np.full((ncx * ncy + 1, width), -1, dtype=np.int64)
+    table[cells[order][fits], slot[fits]] = order[fits]
+
+    step = max(1, block_size // (9 * table.shape[1]))
+    for i in range(0, n, step):
+        rows = np.arange(i, min(i + step, n))
+        cand = []
+        for dy in (-1, 0, 1):
+            for dx in (-1, 0, 1):
+                x = cx[rows] + dx
+                y = cy[rows] + dy
+                inside = (x >= 0) & (x < ncx) & (y >= 0) & (y < ncy)
+                cand.append(table[np.where(inside, y * ncx + x, ncx * ncy)])
+        cand = np.concatenate(cand, axis=1)
+        ids[rows], dists[rows] = _merge_candidates(coords, rows, ids[rows], dists[rows], cand, k, False)
+
+    s = min(k, max(1, int(np.ceil(sample_rate * k))))
+    for _ in range(iterations):
+        # Sample of s neighbours per point
+        keys = rng.random((n, k))
+        keys[ids < 0] = 2.0
+        forward = np.take_along_axis(ids, np.argsort(keys, axis=1)[:, :s], axis=1)
+
+        # Sample of at most s reverse neighbours per point
+        src = np.repeat(np.arange(n), k)
+        dst = ids.ravel()
+        valid = np.nonzero(dst >= 0)[0]
+        valid = valid[rng.permutation(len(valid))]
+        src, dst = src[valid], dst[valid]
+        by_dst = np.argsort(dst, kind="stable")
+        src, dst = src[by_dst], dst[by_dst]
+        rank = np.arange(len(dst)) - np.searchsorted(dst, dst, side="left")
+        reverse = np.full((n, s), -1, dtype=np.int64)
+        take = rank < s
+        reverse[dst[take], rank[take]] = src[take]
+
+        # Neighbours and reverse neighbours of every point are compared with
+        # each other (the local join of NN-descent)
+        pool = np.concatenate((forward, reverse), axis=1)
+        around = np.concatenate((ids, reverse), axis=1)
+        step = max(1, block_size // (k + pool.shape[1] * (around.shape[1] + 1)))
+        for i in range(0, n, step):
+            rows = np.arange(i, min(i + step, n))
+            p = pool[rows]
+            cand = np.where(p[:, :, None] >= 0, around[p], -1).reshape(len(rows), -1)
+            cand = np.concatenate((p, cand), axis=1)
+            ids[rows], dists[rows] = _merge_candidates(coords, rows, ids[rows], dists[rows], cand, k)
+
+    return ids
+
+
+def knn_recall(coords: np.ndarray, neighbours: np.ndarray, sample: int = 1000, seed=None,
+               block_size: int = DEFAULT_BLOCK_SIZE):
+    """
+    Measures how many of the exact k nearest neighbours of a sample of the
+    points are found in a neighbour table
+
+    Neighbours are compared by distance, so that an approximate table that
+    picked another point at the same distance as the exact one is not
+    penalized.
+
+    Parameters
+    ----------
+    coords: np.ndarray
+        The n x 2 array of point coordinates
+    neighbours: np.ndarray
+        The n x k table of neighbour ids to check, -1 where there is none
+    sample: int
+        How many points to check, defaults to 1000
+    seed: int, optional
+        Seed for the choice of the sample
+    block_size: int
+        The maximum number of distances computed at once, defaults to
+        DEFAULT_BLOCK_SIZE
+
+    Returns
+    -------
+    float
+        The fraction of the exact neighbours that were found, from 0 to 1
+    """
+
+    coords = np.asarray(coords, dtype=np.float64)
+    neighbours = np.asarray(neighbours)
+    n, k = neighbours.shape
+    if n == 0 or k == 0:
+        return 1.0
+    rows = np.sort(np.random.default_rng(seed).choice(n, min(sample, n), replace=False))
+
+    exact = np.full((len(rows), k), -1, dtype=np.int64)
+    _knn_rows_into(coords, rows, k, block_size, exact)
+
+    def squared(ids):
+        d = coords[ids] - coords[rows][:, None, :]
+        d2 = (d * d).sum(axis=2)
+        d2[ids < 0] = np.nan
+        return d2
+
+    expected = squared(exact)
+    found = squared(neighbours[rows])
+    hits = (found[:, :, None] == expected[:, None, :]).any(axis=1)
+    total = int((exact >= 0).sum())
+    return 1.0 if total == 0 else int(hits.sum()) / total
+
+
+def unique_random_points(v: int, x_size: int, y_size: int, seed=None, exclude: np.ndarray = None):
+    """
+    Draws v distinct random points with integer coordinates, 0 <= x < x_size
+    and 0 <= y < y_size (the range np.random.randint gives), in a few NumPy
+    operations
+
+    Each point is coded as x * y_size + y and v distinct codes are sampled
+    without replacement among the ones that are still free.
+
+    Parameters
+    ----------
+    v: int
+        How many points to draw
+    x_size: int
+        The maximum x coordinate of the space
+    y_size: int
+        The maximum y coordinate of the space
+    seed: int or np.random.Generator
+        The seed of the random numbers, None draws it from np.random so that
+        np.random.seed still makes the points reproducible
+    exclude: np.ndarray
+        A n x 2 array of points that must not be drawn (the points already
+        in a graph), defaults to none
+
+    Returns
+    -------
+    np.ndarray
+        A v x 2 array of int64 coordinates
+
+    Raises
+    ------
+    ValueError:
+        Raises ValueError if there are not v free points in the space
+    """
+
+    capacity = int(x_size) * int(y_size)
+    taken = np.empty(0, dtype=np.int64)
+    if exclude is not None and len(exclude):
+        exclude = np.asarray(exclude, dtype=np.float64).reshape(-1, 2)
+        x, y = exclude[:, 0], exclude[:, 1]
+        # Only integer points inside the range can collide
+        inside = (x == np.floor(x)) & (y == np.floor(y)) & (x >= 0) & (x < x_size) & (y >= 0) & (y < y_size)
+        taken = np.unique(x[inside].astype(np.int64) * y_size + y[inside].astype(np.int64))
+
+    if v < 0 or v > capacity - len(taken):
+        raise ValueError("cannot draw " + str(v) + " distinct points, the space has "
+                         + str(capacity - len(taken)) + " free points")
+
+    if seed is None:
+        seed = np.random.randint(0, 2**32, dtype=np.uint64)
+    rng = np.random.default_rng(seed)
+
+    # The r-th free code is r plus the number of taken codes before it
+    codes = rng.choice(capacity - len(taken), size=v, replace=False).astype(np.int64)
+    if len(taken):
+        codes += np.searchsorted(taken - np.arange(len(taken)), codes, side="right")
+
+    return np.stack((codes // y_size, codes % y_size), axis=1)
+
+
+# Ways a Knn_Graph can store its arrays, from the widest to the narrowest
+MEMORY_PROFILES = ("default", "compact", "minimal")
+
+
+def memory_profile_dtypes(profile: str, x_size: int, y_size: int):
+    """
+    Picks the types of the arrays of a Knn_Graph for a memory profile
+
+    "default" stores float64 coordinates, int64 ids and float64 edge lengths.
+    "compact" stores the coordinates in the narrowest unsigned integer type
+    that holds [0, x_size] x [0, y_size] (so only integer points inside the
+    space can be added), int32 ids and float32 edge lengths. "minimal" is
+    "compact" without the edge lengths, which are computed from the
+    coordinates when a row of the adjacency is read.
+
+    With k = 7, memory_usage reports about 172 bytes per vertex for
+    "default", 82 for "compact" and 48 for "minimal". At 10 million points
+    that is about 1.7 GB, 820 MB and 480 MB: only "minimal" stays within a
+    few hundred MB.
+
+    Parameters
+    ----------
+    profile: str
+        One of MEMORY_PROFILES
+    x_size: int
+        The maximum x coordinate of the space
+    y_size: int
+        The maximum y coordinate of the space
+
+    Returns
+    -------
+    dict
+        The types of the coordinates ("coords"), of the ids ("index") and of
+        the edge lengths ("lengths", None if they are not stored)
+
+    Raises
+    ------
+    ValueError:
+        Raises ValueError if the profile is unknown
+    """
+
+    if profile == "default":
+        return {"coords": np.dtype(np.float64), "index": np.dtype(np.int64), "lengths": np.dtype(np.float64)}
+    if profile not in MEMORY_PROFILES:
+        raise ValueError("unknown memory profile: " + str(profile))
+
+    largest = max(x_size, y_size)
+    for coords in (np.uint8, np.uint16, np.uint32, np.uint64):
+        if largest <= np.iinfo(coords).max:
+            break
+    lengths = np.dtype(np.float32) if profile == "compact" else None
+    return {"coords": np.dtype(coords), "index": np.dtype(np.int32), "lengths": lengths}
+
+
+# Binary graph files: the magic, the version of the layout, the lengths of
+# the JSON metadata, then the arrays, each starting at a multiple of
+# GRAPH_FILE_ALIGNMENT so that they can be memory-mapped in place
+GRAPH_FILE_MAGIC = b"KNNGRAPH"
+GRAPH_FILE_VERSION = 1
+GRAPH_FILE_ALIGNMENT = 64
+_GRAPH_FILE_HEADER = struct.Struct("<8sII")
+
+
+def _aligned(offset: int):
+    return -(-offset // GRAPH_FILE_ALIGNMENT) * GRAPH_FILE_ALIGNMENT
+
+
+def write_graph_file(path: str, meta: dict, arrays: dict):
+    """
+    Writes a set of named arrays, and some metadata, to a binary graph file
+
+    The file starts with GRAPH_FILE_MAGIC, the layout version and the length
+    of a JSON document that holds the metadata and, for each array, its
+    dtype, shape and position relative to the first (aligned) byte after it.
+
+    Parameters
+    ----------
+    path: str
+        Where to write the file
+    meta: dict
+        Metadata that can be stored as JSON
+    arrays: dict
+        The arrays to store, by name. Instead of an array a (dtype, shape,
+        function) tuple can be given, the function is then called for the
+        array only when it is written, so that the arrays do not all have to
+        be in memory at once
+    """
+
+    table = {}
+    offset = 0
+    for name, array in arrays.items():
+        dtype, shape = (np.dtype(array[0]), tuple(array[1])) if isinstance(array, tuple) else (array.dtype, array.shape)
+        offset = _aligned(offset)
+        table[name] = {"dtype": dtype.str, "shape": list(shape), "offset": offset}
+        offset += dtype.itemsize * int(np.prod(shape))
+    document = json.dumps({"meta": meta, "arrays": table}).encode("utf-8")
+    start = _aligned(_GRAPH_FILE_HEADER.size + len(document))
+
+    with open(path, "wb") as f:
+        f.write(_GRAPH_FILE_HEADER.pack(GRAPH_FILE_MAGIC, GRAPH_FILE_VERSION, len(document)))
+        f.write(document)
+        for name, array in arrays.items():
+            if isinstance(array, tuple):
+                array = array[2]()
+            f.seek(start + table[name]["offset"])
+            f.write(np.ascontiguousarray(array, dtype=table[name]["dtype"]).tobytes())
+
+
+def read_graph_file(path: str, mmap: bool = True):
+    """
+    Reads a file written by write_graph_file
+
+    Parameters
+    ----------
+    path: str
+        The file to read
+    mmap: bool
+        If True the arrays are read-only np.memmaps of the file, shared by
+        every process that opens it, otherwise they are read into memory.
+        Defaults to True
+
+    Returns
+    -------
+    dict
+        The metadata
+    dict
+        The arrays, by name
+
+    Raises
+    ------
+    ValueError:
+        If the file is not a graph file, or its layout version is not known
+    """
+
+    meta, table = read_graph_table(path)
+    arrays = {name: read_graph_array(path, entry, mmap) for name, entry in table.items()}
+    return meta, arrays
+
+
+def read_graph_table(path: str):
+    """
+    Reads the metadata and the table of arrays of a graph file, without
+    reading the arrays (see read_graph_array)
+
+    Returns
+    -------
+    dict
+        The metadata
+    dict
+        By name, the dtype, shape and offset in the file of each array
+
+    Raises
+    ------
+    ValueError:
+        If the file is not a graph file, or its layout version is not known
+    """
+
+    with open(path, "rb") as f:
+        magic, version, length = _GRAPH_FILE_HEADER.unpack(f.read(_GRAPH_FILE_HEADER.size))
+        if magic != GRAPH_FILE_MAGIC:
+            raise ValueError(str(path) + " is not a graph file")
+        if version > GRAPH_FILE_VERSION:
+            raise ValueError("unknown graph file version: " + str(version))
+        document = json.loads(f.read(length).decode("utf-8"))
+    start = _aligned(_GRAPH_FILE_HEADER.size + length)
+
+    # Offsets in the table become offsets in the file
+    for entry in document["arrays"].values():
+        entry["offset"] += start
+    return document["meta"], document["arrays"]
+
+
+def read_graph_array(path: str, entry: dict, mmap: bool = True):
+    """
+    Reads one array of a graph file, entry being its line of the table
+    returned by read_graph_table, see read_graph_file
+    """
+
+    dtype = np.dtype(entry["dtype"])
+    shape = tuple(entry["shape"])
+    if int(np.prod(shape)) == 0:
+        # np.memmap can not map empty arrays
+        return np.zeros(shape, dtype=dtype)
+    if mmap:
+        return np.memmap(path, dtype=dtype, mode="r", offset=entry["offset"], shape=shape)
+    return np.fromfile(path, dtype=dtype, count=int(np.prod(shape)), offset=entry["offset"]).reshape(shape)
+
+
+# Tiled graph files: about this many points per tile, and the memory the
+# tiles in use may take by default
+DEFAULT_TILE_POINTS = 2**16
+DEFAULT_TILE_BUDGET = 2**28
+
+
+def tile_layout(x_size: int, y_size: int, n: int, tile_points: int = DEFAULT_TILE_POINTS):
+    """
+    Chooses square tiles over [0, x_size] x [0, y_size] that hold about
+    tile_points of n uniformly spread points each
+
+    Returns
+    -------
+    float
+        The side of a tile
+    int
+        The number of tile columns
+    int
+        The number of tile rows
+    """
+
+    area = float(x_size + 1) * float(y_size + 1)
+    side = max(math.sqrt(area * tile_points / max(n, 1)), 1.0)
+    return side, int(math.ceil((x_size + 1) / side)), int(math.ceil((y_size + 1) / side))
+
+
+def tile_of(coords: np.ndarray, side: float, ncx: int, ncy: int):
+    """
+    Returns the number of the tile of each point, tiles are numbered row by
+    row (see tile_layout)
+    """
+
+    coords = np.asarray(coords, dtype=np.float64).reshape(-1, 2)
+    cx = np.clip((coords[:, 0] // side).astype(np.int64), 0, ncx - 1)
+    cy = np.clip((coords[:, 1] // side).astype(np.int64), 0, ncy - 1)
+    return cy * ncx + cx
+
+
+class Knn_Graph(Euclidean_Space):
+    """
+    This class inherits functions from the Euclidean Space class
+    and adds a vector of points and a vector of edges, to completely
+    represent a knn graph
+
+    Vertices are identified by their position in the list of points (their
+    id). Their coordinates are kept in a contiguous PointStore and the edges
+    in a CsrAdjacency over those ids
+
+    Attributes
+    ----------
+        points: Point_Sequence
+            The points on this graph, point i being the vertex of id i
+        coords: np.ndarray
+            A n x 2 view of the coordinates of the points, by vertex id
+        edges: np.ndarray
+            A list of edges
+        index: SpatialGrid
+            A spatial index over the points, kept up to date by add_point
+        adjacency: CsrAdjacency
+            The edges of the graph and their lengths, by vertex id
+        heuristics: HeuristicCache
+            Distances from every vertex to recent search destinations
+        memory_profile: str
+            How the arrays are stored, see memory_profile_dtypes
+        version: int
+            Goes up every time points or edges are added, so that results
+            computed on the graph (cached paths) can tell they are stale
+        landmarks: np.ndarray
+            The ids of the landmarks chosen by select_landmarks, None if there
+            are none or the graph changed since
+        landmark_distances: np.ndarray
+            A landmarks x n float32 array, the length of the shortest path
+            from each landmark to each vertex (inf where there is none)
+
+    Methods
+    -------
+
+    """
+
+
+    def __init__(self, x_size: int, y_size: int, memory_profile: str = "default"):
+        # Calls super constructor
+        super().__init__(x_size, y_size)
+
+        self._memory_profile = memory_profile
+        self._dtypes = memory_profile_dtypes(memory_profile, x_size, y_size)
+
+        # Declare vectors of points and edges
+        self._store = PointStore(dtype=self._dtypes["coords"])
+        self._adjacency = self._new_adjacency(0)
+
+        # Spatial index over the points of the store
+        self._index = SpatialGrid(x_size, y_size, self._store, self._dtypes["index"])
+
+        # Straight-line distances to recent search destinations
+        self._heuristics = HeuristicCache(self._store)
+
+        # Bumped by every change to the points or edges
+        self._version = 0
+
+        # Landmark ids and their shortest distances to every vertex, see
+        # select_landmarks
+        self._landmarks = None
+        self._landmark_distances = None
+        self._landmark_version = -1
+
+        # The k of the last call of grafo_knn, 0 if it was never called
+        self._k = 0
+
+    def _new_adjacency(self, vertex_count: int):
+        return CsrAdjacency(vertex_count, self._dtypes["index"], self._dtypes["lengths"], self._store)
+
+
+    @property
+    def memory_profile(self):
+        return self._memory_profile
+
+    @property
+    def version(self):
+        return self._version
+
+    @property
+    def landmarks(self):
+        if self._landmarks is None or self._landmark_version != self._version:
+            return None
+        return self._landmarks
+
+    @property
+    def landmark_distances(self):
+        return None if self.landmarks is None else self._landmark_distances
+
+    @property
+    def points(self):
+        return Point_Sequence(self._store)
+    @points.setter
+    def points(self, points):
+        # Ids change with the points, so do the edges
+        self._store = PointStore(dtype=self._dtypes["coords"])
+        self._store.extend(np.array([(p.x, p.y) for p in points], dtype=np.float64).reshape(-1, 2))
+        self._adjacency = self._new_adjacency(self._store.size)
+        # Reindex the new set of points
+        self._index = SpatialGrid(self._xSize, self._ySize, self._store, self._dtypes["index"])
+        self._index.sync()
+        self._heuristics = HeuristicCache(self._store)
+        self._version += 1
+
+    @property
+    def coords(self):
+        return self._store.coords
+
+    @property
+    def vertex_count(self):
+        return self._store.size
+
+    def memory_usage(self):
+        """
+        Reports the memory used by the arrays of this Graph
+
+        Returns
+        -------
+        dict
+            The bytes used by the coordinates ("coords"), the adjacency
+            ("adjacency") and the spatial index ("index"), their sum
+            ("total") and the total per vertex ("bytes_per_vertex")
+        """
+
+        usage = {
+            "coords": self._store.nbytes,
+            "adjacency": self._adjacency.nbytes,
+            "index": self._index.nbytes,
+        }
+        usage["total"] = sum(usage.values())
+        usage["bytes_per_vertex"] = usage["total"] / max(self._store.size, 1)
+        return usage
+
+    def point(self, i: int):
+        """
+        Returns the point of the vertex of id i
+        """
+        x, y = self._store.coords[i].tolist()
+        return Point(x, y, i)
+
+    @property
+    def index(self):
+        return self._index
+
+    @property
+    def adjacency(self):
+        return self._adjacency
+
+    @property
+    def heuristics(self):
+        return self._heuristics
+
+    @property
+    def edges(self):
+        # Each edge once, in the order they were added
+        u, v, _ = self._adjacency.pairs()
+        return [Edge(self.point(i), self.point(j)) for i, j in zip(u.tolist(), v.tolist())]
+    @edges.setter
+    def edges(self, edges):
+        self._adjacency = self._new_adjacency(self._store.size)
+        self._version += 1
+        for e in edges:
+            self.add_edge(e)
+
+
+    def add_point(self, p: Point):
+        """
+        Adds a point to this Graph
+
+        Parameters
+        ----------
+        p: Point
+            The point to add, if it is already in the graph a random point
+            is added instead
+
+        Raises
+        ------
+        ValueError:
+            Raises ValueError if p is already in the graph and there is no
+            room for a random point
+        """
+
+        # check if the point already exists in the graph
+        if self.contains(p):
+            # Point already exists, add a new random point instead
+            self.random_points(1)
+            return
+        self._index.insert(p.x, p.y)
+        self._adjacency.add_vertices(1)
+        self._version += 1
+
+    def add_points(self, coords: np.ndarray):
+        """
+        Adds many points to this Graph at once, without checking for
+        duplicates
+
+        Parameters
+        ----------
+        coords: np.ndarray
+            A n x 2 array with the coordinates of the points
+
+        Returns
+        -------
+        np.ndarray
+            The ids of the new points
+        """
+
+        ids = self._store.extend(coords)
+        self._index.sync()
+        self._adjacency.add_vertices(len(ids))
+        self._version += 1
+        return ids
+
+    def random_points(self, v: int, seed=None):
+        """
+        Adds v random points with integer coordinates to this Graph, all
+        different from each other and from the points already in it
+
+        Parameters
+        ----------
+        v: int
+            How many points to add
+        seed: int or np.random.Generator
+            The seed of the random numbers, see unique_random_points
+
+        Returns
+        -------
+        np.ndarray
+            The ids of the new points
+
+        Raises
+        ------
+        ValueError:
+            Raises ValueError if there are not v free points in the space
+        """
+
+        return self.add_points(unique_random_points(v, self._xSize, self._ySize, seed, self._store.coords))
+
+    def vertex_id(self, p: Point):
+        """
+        Finds the id of a given point of this Graph
+
+        Parameters
+        ----------
+        p: Point
+            The point to look for
+
+        Returns
+        -------
+        int
+            The id of p (the first one, if it was added more than once), -1
+            if it is not in the graph
+        """
+
+        # Points handed out by this graph know their id
+        i = p.id
+        if 0 <= i < self._store.size:
+            x, y = self._store.coords[i].tolist()
+            if x == p.x and y == p.y:
+                return i
+
+        # Only the points at distance 0 from p can be equal to it
+        ids, _ = self._index.within_radius(p.x, p.y, 0.0)
+        return int(ids[0]) if len(ids) > 0 else -1
+
+    def contains(self, p: Point):
+        """
+        Verifies if a given point is one of the points of this Graph
+
+        Parameters
+        ----------
+        p: Point
+            The point to look for
+
+        Returns
+        -------
+        bool
+            Wether or not p is in the graph
+        """
+
+        return self.vertex_id(p) >= 0
+
+    def add_edge(self, e: Edge):
+        """
+        Adds an Edge to this Graph
+
+        Parameters
+        ----------
+        e: Edge
+            The edge to add
+
+        Raises
+        ------
+        ValueError:
+            Raises ValueError if the edge (either way round) is already in the graph
+
+        """
+
+        # check if the graph contains the points that the edge reffers to
+        i = self.vertex_id(e.p1)
+        j = self.vertex_id(e.p2)
+        if i >= 0 and j >= 0:
+            # add the edge, with its length, if it is not there already
+            if not self._adjacency.add(i, j, self.distance(e.p1, e.p2)):
+                # The edge is already present on the graph, raise error
+                raise ValueError("edge already in the graph: " + str((i, j)))
+            self._version += 1
+
+    def has_edge(self, e: Edge):
+        """
+        Verifies if an Edge (either way round) is in this Graph
+
+        Parameters
+        ----------
+        e: Edge
+            The edge to look for
+
+        Returns
+        -------
+        bool
+            Wether or not the edge is in the graph
+        """
+
+        i = self.vertex_id(e.p1)
+        j = self.vertex_id(e.p2)
+        return i >= 0 and j >= 0 and (i == j or self._adjacency.has_edge(i, j))
+ 
+    def farthest_point(self, point: Point):
+        """
+        Finds the point that is farther away from a given point on the graph
+        obs. The point given as argument must have already been removed from the list
+
+        Parameters
+        ----------
+        point: Point
+            The point to which the farthest point will be found
+
+        Returns
+        -------
+        Float
+            The distance found
+        Point
+            The point that is farther away from the given point
+        """
+
+        # assume the maximum distance to be 0
+        max_distance = 0
+        # Temporary Point
+        pTemp = Point()
+
+        # Distancia do ponto argumento a todos os pontos de uma vez
+        distances = self.distances(point, self._store.coords)
+        if len(distances):
+            # O primeiro ponto com a maior distancia
+            i = int(np.argmax(distances))
+            if distances[i] > max_distance:
+                max_distance = float(distances[i])
+                pTemp = self.point(i)
+        # Retorna a distância e o ponto encontrados
+        return max_distance, pTemp
+
+    def vertex_distances(self, i: int, ids: np.ndarray = None):
+        """
+        Calculates the euclidean distances from a vertex to many
+
+        Parameters
+        ----------
+        i: int
+            The id of the vertex
+        ids: np.ndarray
+            The ids of the vertices to measure to, defaults to all of them
+
+        Returns
+        -------
+        np.ndarray
+            The distance to ids[j] (or to vertex j) at position j
+        """
+
+        coords = self._store.coords
+        return self.distances(coords[i], coords if ids is None else coords[ids], False)
+
+    def farthest_vertex(self, sources: np.ndarray, block_size: int = DEFAULT_BLOCK_SIZE):
+        """
+        Finds the vertex farthest away from a set of vertices (the one whose
+        nearest vertex of the set is the farthest)
+
+        Parameters
+        ----------
+        sources: np.ndarray
+            The ids of the vertices of the set
+
+        Returns
+        -------
+        int
+            The id of the vertex found, -1 if the graph is empty
+        float
+            Its distance to the nearest vertex of the set
+        """
+
+        coords = self._store.coords
+        return self.farthest_from_set(coords, coords[np.asarray(sources, dtype=np.int64)], block_size, False)
+
+    def nearest_neighbour(self, point: Point, minimalDistance : float = 0.0): 
+        """
+        Returns the nearest point to the given point
+
+        Parameters
+        ----------
+        point: Point
+            The point whose nearest neighbour will be found
+
+        minimalDistance: float
+            Only look for points farther than this distance, defaults to 0
+        
+        Returns
+        -------
+        Point
+            The nearest neighbour
+        Float
+            The distance
+        """
+
+        temp = Point() # instantiates a new point at the origin
+        tempMin = self.ySize*self.xSize # Defines the minimum distance as the area of the euclidean space
+
+        # Ask the spatial index for the nearest point beyond minimalDistance,
+        # on ties it returns the one that was added first
+        idx, dist = self._index.nearest_beyond(point.x, point.y, minimalDistance)
+        if idx >= 0 and dist < tempMin:
+            # the new nearest neighbour is p
+            temp = self.point(idx)
+            # the new nearest distance is the newfound one
+            tempMin = dist
+
+        return temp, tempMin
+
+    def k_nearest(self, point: Point, k: int, minimalDistance: float = 0.0):
+        """
+        Returns the k nearest points to the given point
+
+        Parameters
+        ----------
+        point: Point
+            The point whose nearest neighbours will be found
+        k: int
+            How many points to return
+        minimalDistance: float
+            Only look for points farther than this distance, defaults to 0
+
+        Returns
+        -------
+        Point[]
+            The nearest points, nearest first
+        Float[]
+            Their distances
+        """
+
+        ids, dists = self._index.nearest(point.x, point.y, k, minimalDistance)
+        return [self.point(i) for i in ids.tolist()], dists.tolist()
+
+    def within_radius(self, point: Point, radius: float):
+        """
+        Returns all the points at distance less or equal to radius from the given point
+
+        Parameters
+        ----------
+        point: Point
+            The center of the search
+        radius: float
+            The radius of the search
+
+        Returns
+        -------
+        Point[]
+            The points found, nearest first
+        Float[]
+            Their distances
+        """
+
+        ids, dists = self._index.within_radius(point.x, point.y, radius)
+        return [self.point(i) for i in ids.tolist()], dists.tolist()
+
+    def neighbours(self, point: Point):
+        """
+        Return all the direct neighbours for a given point
+
+        Parameters
+        ----------
+        point: Point
+            The point whose neighbours will be returned
+
+        Returns
+        -------
+        neighbours: Point[]
+            A list of neighbour points
+
+        """
+
+        i = self.vertex_id(point)
+        if i < 0:
+            return []
+
+        # The row of the point in the adjacency holds its neighbours
+        ids, _ = self.neighbour_ids(i)
+        return [self.point(j) for j in ids.tolist()]
+
+    def vertex_distance(self, i: int, j: int):
+        """
+        Calculates the euclidean distance between the vertices of ids i and j
+
+        Returns
+        -------
+        float
+            The distance between the two vertices
+        """
+
+        # Two row reads are much cheaper than one fancy-indexed read
+        coords = self._store.coords
+        (xi, yi), (xj, yj) = coords[i].tolist(), coords[j].tolist()
+        return math.sqrt((xi - xj) ** 2 + (yi - yj) ** 2)
+
+    def heuristic(self, destination: int):
+        """
+        Returns the straight-line distance from every vertex to a destination,
+        computed in one pass and cached, so searches to the same destination
+        do not compute it again
+
+        Parameters
+        ----------
+        destination: int
+            The id of the destination vertex
+
+        Returns
+        -------
+        np.ndarray
+            The distance from vertex i to the destination at position i
+        """
+
+        return self._heuristics.heuristic(destination)
+
+    def shortest_distances(self, source: int):
+        """
+        Finds the length of the shortest path from a vertex to every vertex
+        (Dijkstra over the whole graph)
+
+        Parameters
+        ----------
+        source: int
+            The id of the vertex
+
+        Returns
+        -------
+        np.ndarray
+            The length of the shortest path to vertex i at position i, inf if
+            it can not be reached
+        """
+
+        distances = np.full(self.vertex_count, math.inf)
+        distances[source] = 0.0
+        done = np.zeros(self.vertex_count, dtype=bool)
+        heap = [(0.0, source)]
+        while heap:
+            d, u = heapq.heappop(heap)
+            if done[u]:
+                continue
+            done[u] = True
+            ids, lengths = self.neighbour_ids(u)
+            ids = np.asarray(ids, dtype=np.int64)
+            cost = d + lengths.astype(np.float64)
+            # Only the neighbours reached by a shorter path than before
+            better = cost < distances[ids]
+            if better.any():
+                ids, cost = ids[better], cost[better]
+                distances[ids] = cost
+                for v, c in zip(ids.tolist(), cost.tolist()):
+                    heapq.heappush(heap, (c, v))
+        return distances
+
+    def select_landmarks(self, count: int = 8, seed=None):
+        """
+        Chooses landmarks for the landmark heuristic (see landmark_heuristic)
+        and stores the shortest distances from each of them to every vertex
+
+        The first landmark is the vertex farthest from a random one, each
+        next one the vertex farthest from those chosen so far, so they end up
+        spread over the borders of the space. This takes one Dijkstra over
+        the whole graph per landmark, and count x n float32 of memory.
+
+        Parameters
+        ----------
+        count: int
+            How many landmarks, defaults to 8
+        seed: int, optional
+            The seed of the random vertex the choice starts from
+
+        Returns
+        -------
+        np.ndarray
+            The ids of the landmarks
+        """
+
+        n = self.vertex_count
+        count = min(count, n)
+        landmarks = []
+        if count > 0:
+            first = int(np.random.default_rng(seed).integers(0, n))
+            landmarks.append(self.farthest_vertex([first])[0])
+        while len(landmarks) < count:
+            idx, dist = self.farthest_vertex(landmarks)
+            if dist <= 0:
+                # Every vertex is a landmark already
+                break
+            landmarks.append(idx)
+
+        distances = np.empty((len(landmarks), n), dtype=np.float32)
+        for i, landmark in enumerate(landmarks):
+            distances[i] = self.shortest_distances(landmark)
+        self._landmarks = np.asarray(landmarks, dtype=np.int64)
+        self._landmark_distances = distances
+        self._landmark_version = self._version
+        return self._landmarks
+
+    def landmark_heuristic(self, destination: int):
+        """
+        Returns a lower bound of the length of the shortest path from every
+        vertex to a destination: the largest of the straight-line distance
+        and, for each landmark L, |d(L, destination) - d(L, v)| (triangle
+        inequality). It is never looser than heuristic, and much tighter
+        where the graph makes detours.
+
+        Without landmarks, or if the graph changed since they were chosen, it
+        is the straight-line distance.
+
+        Parameters
+        ----------
+        destination: int
+            The id of the destination vertex
+
+        Returns
+        -------
+        np.ndarray
+            The bound for vertex i at position i
+        """
+
+        bound = self.heuristic(destination)
+        distances = self.landmark_distances
+        if distances is None:
+            return bound
+        bound = bound.copy()
+        with np.errstate(invalid="ignore"):
+            for row in distances:
+                to_destination = np.float64(row[destination])
+                row = row.astype(np.float64)
+                # The distances are float32, take off their rounding error so
+                # the bound stays below the true length
+                gap = np.abs(row - to_destination) - LANDMARK_EPSILON * np.maximum(row, to_destination)
+                # fmax ignores the nan of vertices no landmark path reaches
+                np.fmax(bound, gap, out=bound)
+        return bound
+
+    def neighbour_ids(self, i: int):
+        """
+        Return the ids of the direct neighbours of a vertex, and the lengths
+        of the edges that lead to them
+
+        Parameters
+        ----------
+        i: int
+            The id of the vertex
+
+        Returns
+        -------
+        np.ndarray
+            The ids of the neighbours
+        np.ndarray
+            The lengths of the edges
+        """
+
+        return self._adjacency.neighbours(i)
+
+    def grafo_knn(self, v, k, method: str = "blocked", block_size: int = DEFAULT_BLOCK_SIZE, workers: int = 1,
+                  cell_points: float = 2.0, seed=None):
+        """
+        Adds v random points to this Graph and connects each point to its
+        k nearest neighbours
+
+        Parameters
+        ----------
+        v: int
+            How many points to generate
+        k: int
+            How many neighbours each point is connected to
+        method: str
+            "blocked" finds the neighbours of every point at once with NumPy
+            (see knn_neighbours), "loop" calls nearest_neighbour k times per
+            point. Both produce the same edges. "approximate" trades some of
+            the neighbours for speed (see knn_neighbours_approximate, and
+            knn_recall to measure how many). Defaults to "blocked"
+        block_size: int
+            The maximum number of distances the blocked method computes at
+            once, defaults to DEFAULT_BLOCK_SIZE
+        workers: int
+            How many processes the blocked method uses, the coordinates are
+            placed in shared memory and each process solves a slice of the
+            points (see knn_neighbours_parallel), 0 uses one per CPU,
+            defaults to 1. The loop and approximate methods run in this
+            process only
+        cell_points: float
+            The recall/speed trade-off of the approximate method, higher is
+            slower and more exact, defaults to 2
+        seed: int or np.random.Generator
+            The seed of the random points, see unique_random_points
+
+        Raises
+        ------
+        ValueError:
+            Raises ValueError if the method is unknown, if workers is not 1
+            for a method other than "blocked", or if the space does not have
+            room for v more distinct points
+        """
+
+        if method not in ("loop", "blocked", "approximate"):
+            raise ValueError("unknown k-NN graph method: " + str(method))
+        if method != "blocked" and workers != 1:
+            raise ValueError("the " + method + " method does not use workers, only \"blocked\" does")
+
+        # Adiciona V pontos aleatóreos distintos de uma vez, os pontos não podem ser maiores do que
+        # o tamanho do espaço euclidiano
+        self.random_points(v, seed)
+        self._store.trim()
+
+        # Lembra k para medir o recall depois
+        self._k = k
+
+        if method == "blocked":
+            self._add_knn_edges(knn_neighbours(self.coords, k, block_size, workers))
+            return
+        if method == "approximate":
+            self._add_knn_edges(knn_neighbours_approximate(self.coords, k, cell_points, block_size=block_size))
+            return
+
+        # Para cada vértice faça
+        for edx, vertex in enumerate(self.points):
+            min_distance = 0
+            tempPoint = Point()
+            # Designa k arestas
+            for i in range(0,k):
+                #Encontra os k vizinhos mais próximos
+                tempPoint, min_distance = self.nearest_neighbour(vertex, min_distance)
+                # Adiciona ao conjunto de arestas, se ainda não estiver lá
+                edge = Edge(vertex, tempPoint)
+                if not self.has_edge(edge):
+                    self.add_edge(edge)
+
+    def _add_knn_edges(self, neighbours):
+        # Same edges, in the same order, as the loop would add
+        n, k = neighbours.shape
+        src = np.repeat(np.arange(n), k)
+        dst = neighbours.ravel()
+        valid = dst >= 0
+        src, dst = src[valid], dst[valid]
+        # The adjacency computes the lengths from the coordinates
+        self._adjacency.add_many(src, dst)
+        self._version += 1
+
+    def knn_recall(self, sample: int = 1000, seed=None):
+        """
+        Measures how many of the exact k nearest neighbours of a sample of the
+        points are connected to them in this Graph, k being the one given to
+        the last call of grafo_knn
+
+        Parameters
+        ----------
+        sample: int
+            How many points to check, defaults to 1000
+        seed: int, optional
+            Seed for the choice of the sample
+
+        Returns
+        -------
+        float
+            The fraction of the exact neighbours that are connected, from 0 to 1
+        """
+
+        coords = np.asarray(self.coords, dtype=np.float64)
+        n = len(coords)
+        k = self._k
+        if n == 0 or k == 0:
+            return 1.0
+        rows = np.sort(np.random.default_rng(seed).choice(n, min(sample, n), replace=False))
+        exact = np.full((len(rows), k), -1, dtype=np.int64)
+        _knn_rows_into(coords, rows, k, DEFAULT_BLOCK_SIZE, exact)
+
+        # The neighbours of each sampled point
+        hits = 0
+        for i, r in enumerate(rows.tolist()):
+            connected, _ = self._adjacency.neighbours(r)
+            hits += int(np.isin(exact[i][exact[i] >= 0], connected).sum())
+        total = int((exact >= 0).sum())
+        return 1.0 if total == 0 else hits / total
+
+    def save(self, path: str):
+        """
+        Saves this Graph to a binary file (see write_graph_file): the space
+        bounds and memory profile, the coordinates, the adjacency arrays, the
+        stored edge lengths, the spatial index and the landmarks
+
+        Parameters
+        ----------
+        path: str
+            Where to save the graph
+        """
+
+        order, cell_start = self._index.arrays
+        arrays = {
+            "coords": self._store.coords,
+            "offsets": self._adjacency.offsets,
+            "neighbours": self._adjacency.neighbour_array,
+            "index_order": order,
+            "index_start": cell_start,
+        }
+        if self._adjacency.length_dtype is not None:
+            arrays["lengths"] = self._adjacency.length_array
+        if self.landmarks is not None:
+            arrays["landmarks"] = self._landmarks
+            arrays["landmark_distances"] = self._landmark_distances
+        meta = {
+            "x_size": self._xSize,
+            "y_size": self._ySize,
+            "memory_profile": self._memory_profile,
+            "k": self._k,
+        }
+        write_graph_file(path, meta, arrays)
+
+    def save_tiled(self, path: str, tile_points: int = DEFAULT_TILE_POINTS):
+        """
+        Saves this Graph to a binary file split into spatial tiles, to be
+        opened with Tiled_Knn_Graph
+
+        Vertices are renumbered so that the vertices of each tile have
+        consecutive ids. Each tile is written as its own block: the
+        coordinates of its vertices, their rows of the adjacency (with the
+        new ids of the neighbours) and the lengths of those edges. Tiles are
+        written one at a time, the "original_ids" array maps the new ids to
+        the ids in this Graph. Since the neighbours of a point are close to
+        it, most edges stay inside a tile or go to the next one, so a search
+        only needs the tiles along its way.
+
+        The Graph has to be in memory to be saved: tiles are written one at a
+        time, but from the arrays of this Graph, so a graph larger than the
+        memory can be searched tiled but not built and written tiled.
+
+        Parameters
+        ----------
+        path: str
+            Where to save the graph
+        tile_points: int
+            About how many points each tile holds, defaults to
+            DEFAULT_TILE_POINTS
+        """
+
+        n = self._store.size
+        side, ncx, ncy = tile_layout(self._xSize, self._ySize, n, tile_points)
+        tiles = tile_of(self._store.coords, side, ncx, ncy)
+
+        # New ids: the vertices of tile 0, then those of tile 1...
+        order = np.argsort(tiles, kind="stable")
+        new_id = np.empty(n, dtype=np.int64)
+        new_id[order] = np.arange(n)
+        tile_start = np.zeros(ncx * ncy + 1, dtype=np.int64)
+        np.cumsum(np.bincount(tiles, minlength=ncx * ncy), out=tile_start[1:])
+
+        offsets = self._adjacency.offsets
+        degrees = np.diff(offsets)
+        neighbours = self._adjacency.neighbour_array
+        lengths = self._adjacency.length_array
+        index_dtype = self._adjacency.index_dtype
+        length_dtype = self._adjacency.length_dtype or np.dtype(np.float32)
+
+        def rows(t):
+            # Positions in the adjacency arrays of the rows of tile t
+            ids = order[tile_start[t]:tile_start[t + 1]]
+            counts = degrees[ids]
+            starts = np.repeat(offsets[ids].astype(np.int64) - np.cumsum(counts) + counts, counts)
+            return starts + np.arange(len(starts))
+
+        arrays = {"tile_start": tile_start, "original_ids": order.astype(index_dtype)}
+        for t in range(ncx * ncy):
+            ids = order[tile_start[t]:tile_start[t + 1]]
+            edges = int(degrees[ids].sum())
+            arrays["coords_" + str(t)] = (self._store.dtype, (len(ids), 2), lambda ids=ids: self._store.coords[ids])
+            arrays["offsets_" + str(t)] = (index_dtype, (len(ids) + 1,),
+                                           lambda ids=ids: np.concatenate(([0], np.cumsum(degrees[ids]))))
+            arrays["neighbours_" + str(t)] = (index_dtype, (edges,), lambda t=t: new_id[neighbours[rows(t)]])
+            arrays["lengths_" + str(t)] = (length_dtype, (edges,), lambda t=t: lengths[rows(t)])
+        meta = {
+            "layout": "tiled",
+            "x_size": self._xSize,
+            "y_size": self._ySize,
+            "memory_profile": self._memory_profile,
+            "k": self._k,
+            "tiles": {"side": side, "columns": ncx, "rows": ncy},
+        }
+        write_graph_file(path, meta, arrays)
+
+    @classmethod
+    def load(cls, path: str, mmap: bool = True):
+        """
+        Loads a Graph saved with save
+
+        With mmap the arrays are memory-mapped from the file rather than read:
+        loading takes about the same time whatever the size of the graph, and
+        processes that load the same file share its pages. The arrays are
+        read-only, adding points or edges makes copies of the ones it changes.
+
+        Parameters
+        ----------
+        path: str
+            The file to load
+        mmap: bool
+            Wether to memory-map the file instead of reading it, defaults to True
+
+        Returns
+        -------
+        Knn_Graph
+            The graph
+
+        Raises
+        ------
+        ValueError:
+            If the file is not a graph file, its layout version is not known,
+            or it is a tiled graph
+        """
+
+        meta, arrays = read_graph_file(path, mmap)
+        if meta.get("layout") == "tiled":
+            raise ValueError(str(path) + " is a tiled graph, open it with Tiled_Knn_Graph")
+        graph = cls(meta["x_size"], meta["y_size"], meta["memory_profile"])
+        graph._store = PointStore.from_array(arrays["coords"])
+        graph._adjacency = CsrAdjacency.from_arrays(arrays["offsets"], arrays["neighbours"],
+                                                    arrays.get("lengths"), graph._store)
+        graph._index = SpatialGrid(graph._xSize, graph._ySize, graph._store, arrays["index_order"].dtype)
+        graph._index.attach(arrays["index_order"], arrays["index_start"])
+        graph._heuristics = HeuristicCache(graph._store)
+        if "landmarks" in arrays:
+            graph._landmarks = arrays["landmarks"]
+            graph._landmark_distances = arrays["landmark_distances"]
+            graph._landmark_version = graph._version
+        graph._k = meta["k"]
+        return graph
+
+
+class Tile:
+    """
+    The arrays of one tile of a Tiled_Knn_Graph: the coordinates of its
+    vertices, their rows of the adjacency (offsets local to the tile,
+    neighbour ids global) and the lengths of those edges
+    """
+
+    __slots__ = ("coords", "offsets", "neighbours", "lengths")
+
+    def __init__(self, coords: np.ndarray, offsets: np.ndarray, neighbours: np.ndarray, lengths: np.ndarray):
+        self.coords = coords
+        self.offsets = offsets
+        self.neighbours = neighbours
+        self.lengths = lengths
+
+    @property
+    def nbytes(self):
+        return self.coords.nbytes + self.offsets.nbytes + self.neighbours.nbytes + self.lengths.nbytes
+
+
+class Tiled_Point_Sequence(Point_Sequence):
+    """
+    A read-only sequence of the points of a Tiled_Knn_Graph, iterating goes
+    through the tiles in order
+    """
+
+    __slots__ = ()
+
+    def __init__(self, graph):
+        self._store = graph
+
+    def __len__(self):
+        return self._store.vertex_count
+
+    def _point(self, i: int):
+        return self._store.point(i)
+
+    def __iter__(self):
+        graph = self._store
+        for t in range(graph.tile_count):
+            start = graph.tile_range(t)[0]
+            for i, (x, y) in enumerate(graph.tile(t).coords.tolist()):
+                yield Point(x, y, start + i)
+
+
+class Tiled_Heuristic:
+    """
+    Distances from the vertices of a Tiled_Knn_Graph to a destination,
+    computed the first time each vertex is asked for
+    """
+
+    __slots__ = ("_graph", "_x", "_y", "_values")
+
+    def __init__(self, graph, destination: int):
+        self._graph = graph
+        point = graph.point(destination)
+        self._x = float(point.x)
+        self._y = float(point.y)
+        self._values = {}
+
+    def __getitem__(self, i: int):
+        h = self._values.get(i)
+        if h is None:
+            point = self._graph.point(i)
+            h = math.sqrt((point.x - self._x) ** 2 + (point.y - self._y) ** 2)
+            self._values[i] = h
+        return h
+
+
+class Tiled_Knn_Graph(Knn_Graph):
+    """
+    A read-only Knn_Graph kept on disk in spatial tiles (see
+    Knn_Graph.save_tiled), for graphs larger than the memory
+
+    Tiles are read when a vertex in them is needed and kept in a TileCache
+    within a memory budget, the least recently used tiles being dropped.
+    Vertex ids, points, neighbours and heuristics work as in Knn_Graph, so
+    the searches run unchanged; the queries that need the whole graph in
+    memory (the spatial index, the edge list, the coordinate array) and the
+    methods that change the graph raise ValueError.
+
+    Attributes
+    ----------
+        tile_count: int
+            The number of tiles
+        tiles: TileCache
+            The tiles in memory, and the hits, misses and evictions so far
+        original_ids: np.ndarray
+            The id of each vertex in the graph that was saved
+    """
+
+    def __init__(self, path: str, memory_budget: int = DEFAULT_TILE_BUDGET):
+        """
+        Opens a tiled graph file
+
+        Parameters
+        ----------
+        path: str
+            The file written by Knn_Graph.save_tiled
+        memory_budget: int
+            The memory the tiles in the cache may use, in bytes, defaults to
+            DEFAULT_TILE_BUDGET
+
+        Raises
+        ------
+        ValueError:
+            If the file is not a tiled graph file
+        """
+
+        meta, self._table = read_graph_table(path)
+        if meta.get("layout") != "tiled":
+            raise ValueError(str(path) + " is not a tiled graph, open it with Knn_Graph.load")
+        Euclidean_Space.__init__(self, meta["x_size"], meta["y_size"])
+
+        self._path = path
+        self._memory_profile = meta["memory_profile"]
+        self._version = 0
+        self._landmarks = None
+        self._landmark_distances = None
+        self._landmark_version = -1
+        self._k = meta["k"]
+        self._tile_side = meta["tiles"]["side"]
+        self._tile_columns = meta["tiles"]["columns"]
+        self._tile_rows = meta["tiles"]["rows"]
+        self._tile_start = read_graph_array(path, self._table["tile_start"], False)
+        self._tiles = TileCache(self._read_tile, memory_budget)
+
+        # Heuristics of recent destinations
+        self._heuristics = OrderedDict()
+
+    def _read_tile(self, t: int):
+        arrays = [read_graph_array(self._path, self._table[name + "_" + str(t)], False)
+                  for name in ("coords", "offsets", "neighbours", "lengths")]
+        return Tile(*arrays)
+
+    @property
+    def tile_count(self):
+        return len(self._tile_start) - 1
+
+    @property
+    def tiles(self):
+        return self._tiles
+
+    @property
+    def original_ids(self):
+        return read_graph_array(self._path, self._table["original_ids"])
+
+    def tile(self, t: int):
+        """
+        Returns tile t, reading it if it is not in the cache
+        """
+        return self._tiles.get(t)
+
+    def tile_range(self, t: int):
+        """
+        Returns the first id of tile t and the one after its last
+        """
+        return int(self._tile_start[t]), int(self._tile_start[t + 1])
+
+    def _locate(self, i: int):
+        # The tile of vertex i and the position of i in it
+        if not 0 <= i < self.vertex_count:
+            raise IndexError("point id out of range: " + str(i))
+        t = int(np.searchsorted(self._tile_start, i, side="right")) - 1
+        return self._tiles.get(t), i - int(self._tile_start[t])
+
+    @property
+    def points(self):
+        return Tiled_Point_Sequence(self)
+
+    @property
+    def vertex_count(self):
+        return int(self._tile_start[-1])
+
+    def memory_usage(self):
+        """
+        Reports the memory used by the tiles in the cache
+
+        Returns
+        -------
+        dict
+            The bytes used by the tiles ("tiles"), the budget ("budget"), the
+            number of tiles in memory ("tiles_in_memory") and the cache
+            "hits", "misses" and "evictions"
+        """
+
+        return {
+            "tiles": self._tiles.nbytes,
+            "budget": self._tiles.budget,
+            "tiles_in_memory": len(self._tiles),
+            "hits": self._tiles.hits,
+            "misses": self._tiles.misses,
+            "evictions": self._tiles.evictions,
+        }
+
+    def point(self, i: int):
+        """
+        Returns the point of the vertex of id i
+        """
+        tile, j = self._locate(i)
+        x, y = tile.coords[j].tolist()
+        return Point(x, y, i)
+
+    def vertex_id(self, p: Point):
+        """
+        Finds the id of a given point of this Graph, only the tile where the
+        point would be is read
+
+        Returns
+        -------
+        int
+            The id of p (the first one, if it is there more than once), -1 if
+            it is not in the graph
+        """
+
+        # Points handed out by this graph know their id
+        i = p.id
+        if 0 <= i < self.vertex_count:
+            q = self.point(i)
+            if q.x == p.x and q.y == p.y:
+                return i
+
+        t = int(tile_of((p.x, p.y), self._tile_side, self._tile_columns, self._tile_rows)[0])
+        coords = self._tiles.get(t).coords
+        found = np.flatnonzero((coords[:, 0] == p.x) & (coords[:, 1] == p.y))
+        return int(self._tile_start[t]) + int(found[0]) if len(found) else -1
+
+    def has_edge(self, e: Edge):
+        i = self.vertex_id(e.p1)
+        j = self.vertex_id(e.p2)
+        return i >= 0 and j >= 0 and (i == j or bool(np.any(self.neighbour_ids(i)[0] == j)))
+
+    def neighbour_ids(self, i: int):
+        """
+        Return the ids of the direct neighbours of a vertex, and the lengths
+        of the edges that lead to them, see Knn_Graph.neighbour_ids
+        """
+
+        tile, j = self._locate(i)
+        start, end = tile.offsets[j], tile.offsets[j + 1]
+        return tile.neighbours[start:end], tile.lengths[start:end]
+
+    def vertex_distance(self, i: int, j: int):
+        p = self.point(i)
+        q = self.point(j)
+        return math.sqrt((p.x - q.x) ** 2 + (p.y - q.y) ** 2)
+
+    def heuristic(self, destination: int):
+        """
+        Returns the straight-line distances from the vertices to a
+        destination, computed the first time each vertex is asked for and
+        cached for the most recent destinations
+
+        Returns
+        -------
+        Tiled_Heuristic
+            Indexed by vertex id, like the array of Knn_Graph.heuristic
+        """
+
+        heuristic = self._heuristics.pop(destination, None)
+        if heuristic is None:
+            heuristic = Tiled_Heuristic(self, destination)
+        self._heuristics[destination] = heuristic
+        if len(self._heuristics) > 8:
+            self._heuristics.popitem(last=False)
+        return heuristic
+
+    def farthest_point(self, point: Point):
+        """
+        Finds the point that is farther away from a given point, reading the
+        tiles one at a time, see Knn_Graph.farthest_point
+        """
+
+        max_distance = 0
+        pTemp = Point()
+        for t in range(self.tile_count):
+            distances = self.distances(point, self._tiles.get(t).coords, False)
+            if len(distances):
+                i = int(np.argmax(distances))
+                if distances[i] > max_distance:
+                    max_distance = float(distances[i])
+                    pTemp = self.point(int(self._tile_start[t]) + i)
+        return max_distance, pTemp
+
+    def _read_only(self, *args, **kwargs):
+        raise ValueError("tiled graphs are read-only")
+
+    add_point = add_points = random_points = add_edge = grafo_knn = save = save_tiled = select_landmarks = _read_only
+
+    def _in_memory_only(self, *args, **kwargs):
+        raise ValueError("this needs the whole graph in memory, it is not available on a tiled graph "
+                         "(load the untiled file with Knn_Graph.load)")
+
+    vertex_distances = farthest_vertex = nearest_neighbour = k_nearest = within_radius = knn_recall = _in_memory_only
+
+    # The arrays a Knn_Graph holds in memory
+    coords = index = adjacency = edges = property(_in_memory_only)
@@ -1,76 +1,145 @@
+import argparse
+import sys
+import time
+import numpy as np
 from grafo_knn import *
 from auxiliary_structures import *
 from searches import *
-from matplotlib import pyplot as plt
-
-
-def main():
-
-    print("Hello World!")
-
-    #p0 = Point(10, 20)
-    #p1 = Point(20, 30)
-
-
-    grafo = Knn_Graph(500, 500)
-
-    #Inicializa um grafo knn
-    grafo.grafo_knn(500, 7)
-
-    #grafo2 = Knn_Graph(3000, 3000)
-    #grafo2.grafo_knn(3000, 5)
-
-    search = AStar(grafo.points[220])
-
-    _, temp = grafo.farthest_point(grafo.points[220])
-
-    search.search(temp, grafo)
-
-    # Plota gráfico
-    for point in grafo.points:
-        plt.scatter(point.x, point.y)
-    for i, edge in enumerate(grafo.edges):
-        print("plotting edge: "+str(i))
-        plt.plot([edge.p1.x, edge.p2.x], [edge.p1.y, edge.p2.y], marker = '.', markersize = 1, color="GREY")
-
-
-    # Plota caminho da busca:
-    for point in search._visitedList:
-        plt.plot(point.x, point.y, marker = ".", markersize=15, color = "RED")
-
-    # Plota Origem e Destino
-    plt.plot(temp.x, temp.y, marker = "*", markersize=15, color="GREEN")
-    plt.plot(grafo.points[220].x, grafo.points[220].y, marker = "*", markersize=15, color="BLUE")
-    
-    
+from batch import open_graph_file
+
+"""
+
+Command line entry point: builds (or loads) a knn graph, runs searches on it
+and plots the last one (see rendering.py), in a window or to a PNG file.
+
+    python main.py --size 500 --k 7 --algorithm AStar
+    python main.py --graph big.knn --queries 100 --headless --timings
+    python main.py --size 20000 --landmarks 8 --algorithm LandmarkAStar --headless
+    python main.py --size 100000 --k 5 --headless --profile
+    python main.py --size 50000 --k 5 --png graph.png
+
+matplotlib is only imported when the result is plotted, so --headless runs
+never load it.
+
+"""
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Runs searches on a knn graph")
+    parser.add_argument("--size", type=int, default=500, help="number of points of the graph")
+    parser.add_argument("--space", type=int, help="side of the euclidean space, defaults to --size")
+    parser.add_argument("--k", type=int, default=7, help="neighbours of each point")
+    parser.add_argument("--seed", type=int, help="seed of the points and of the queries")
+    parser.add_argument("--algorithm", choices=sorted(ALGORITHMS), default="AStar")
+    parser.add_argument("--queries", type=int, default=1, help="how many searches to run")
+    parser.add_argument("--graph", help="load the graph from this file instead of building it")
+    parser.add_argument("--landmarks", type=int, default=0,
+                        help="choose this many landmarks for LandmarkAStar (saved with --save)")
+    parser.add_argument("--save", help="save the graph to this file")
+    parser.add_argument("--headless", action="store_true", help="do not plot (matplotlib is not imported)")
+    parser.add_argument("--png", help="write the plot to this PNG file instead of opening a window")
+    parser.add_argument("--timings", action="store_true", help="print the time of each phase")
+    parser.add_argument("--profile", nargs="?", const="-", metavar="FILE",
+                        help="run under cProfile, print the top functions or save the stats to FILE")
+    return parser.parse_args(argv)
+
+
+def queries(graph: Knn_Graph, count: int, seed=None):
     """
+    Chooses the ends of the searches: a random destination, and the point
+    farthest away from it as the start
 
-    p = PriorityQueue()
-
-    p.insert([0, 0, 4])
-    p.insert([3, 2, 0])
-    p.insert([6, 1, 3])
-    p.insert([4, 3, 1])
-    p.insert([7, 2, 2])
-    p.insert([8, 3, 8])
-    p.insert([9, 3, 3])
-    p.insert([12, 3, 3])
-
-    print(p.array)
-
-    elements = p.remove()
-
-    print(elements)
-
-    print(p.array)
-
+    Returns
+    -------
+    list
+        (start, destination) pairs of points
     """
-    
-
-    #print("Distance bewteen the two points is: " + str(e1.distance(p0, p1)))
-
-    plt.show()
-
-    input("Falows")
-
-main()
\ No newline at end of file
+    rng = np.random.default_rng(seed)
+    pairs = []
+    for destination in rng.integers(0, graph.vertex_count, count).tolist():
+        destination = graph.point(destination)
+        _, start = graph.farthest_point(destination)
+        pairs.append((start, destination))
+    return pairs
+
+
+def plot(graph: Knn_Graph, search: GenericSearch, start: Point, destination: Point, png: str = None):
+    import rendering
+
+    if png:
+        rendering.render_png(png, graph, search, start, destination)
+    else:
+        rendering.show(graph, search, start, destination)
+
+
+def run(args):
+    timings = {}
+
+    began = time.perf_counter()
+    if args.graph:
+        grafo = open_graph_file(args.graph)
+        timings["load"] = time.perf_counter() - began
+    else:
+        space = args.space or args.size
+        grafo = Knn_Graph(space, space)
+        #Inicializa um grafo knn
+        grafo.grafo_knn(args.size, args.k, seed=args.seed)
+        timings["build"] = time.perf_counter() - began
+
+    if args.landmarks:
+        began = time.perf_counter()
+        grafo.select_landmarks(args.landmarks, args.seed)
+        timings["landmarks"] = time.perf_counter() - began
+
+    if args.save:
+        began = time.perf_counter()
+        grafo.save(args.save)
+        timings["save"] = time.perf_counter() - began
+
+    began = time.perf_counter()
+    pairs = queries(grafo, args.queries, args.seed)
+    timings["queries"] = time.perf_counter() - began
+
+    search = None
+    stats = []
+    began = time.perf_counter()
+    for start, destination in pairs:
+        search = ALGORITHMS[args.algorithm](destination)
+        found = search.search(start, grafo)
+        stats.append(search.stats)
+        if not args.timings:
+            print("%s -> %s: %s, %d expanded" % (start, destination, "found" if found else "not found",
+                                                search.stats.expansions))
+    timings["search"] = time.perf_counter() - began
+
+    if args.timings:
+        for phase, seconds in timings.items():
+            print("%-8s %10.6fs" % (phase, seconds))
+        if stats:
+            print("%d %s searches: %.6fs mean, %.1f expanded on average" % (
+                len(stats), args.algorithm, sum(s.total_time for s in stats) / len(stats),
+                sum(s.expansions for s in stats) / len(stats)))
+
+    if not args.headless and search is not None:
+        plot(grafo, search, *pairs[-1], args.png)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.profile is None:
+        run(args)
+        return 0
+
+    import cProfile
+    import pstats
+    profiler = cProfile.Profile()
+    profiler.runcall(run, args)
+    if args.profile == "-":
+        pstats.Stats(profiler, stream=sys.stderr).sort_stats("cumulative").print_stats(25)
+    else:
+        profiler.dump_stats(args.profile)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
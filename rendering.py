@@ -0,0 +1,160 @@
+import numpy as np
+from matplotlib.collections import LineCollection
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from grafo_knn import Knn_Graph, Point, Tiled_Knn_Graph
+
+"""
+
+This file draws a knn graph, and the result of a search on it, with a
+constant number of matplotlib artists whatever the size of the graph: the
+vertices are a single scatter, the edges a single LineCollection built from
+the adjacency arrays, the visited vertices another scatter and the path a
+single line.
+
+    render_png("graph.png", graph, search, start, destination)
+
+writes the picture without opening a window (no pyplot, no GUI backend),
+show opens it in a window.
+
+Tiled graphs are drawn too, read one tile at a time.
+
+"""
+
+
+def vertex_coords(graph: Knn_Graph):
+    """
+    Returns the coordinates of every vertex of a graph, as an n x 2 float64
+    array indexed by vertex id
+    """
+    if isinstance(graph, Tiled_Knn_Graph):
+        # The ids of a tile are consecutive, and the tiles are in id order
+        coords = [np.asarray(graph.tile(t).coords, dtype=np.float64) for t in range(graph.tile_count)]
+        return np.concatenate(coords) if coords else np.empty((0, 2))
+    return np.asarray(graph.coords, dtype=np.float64)
+
+
+def _edge_ends(graph: Knn_Graph):
+    # Both ends of every edge, each edge once by lower end
+    if not isinstance(graph, Tiled_Knn_Graph):
+        u, v, _ = graph.adjacency.pairs(lengths=False)
+        return u, v
+    lower, higher = [], []
+    for t in range(graph.tile_count):
+        tile = graph.tile(t)
+        first, last = graph.tile_range(t)
+        # Tile offsets are local, the neighbour ids global
+        u = np.repeat(np.arange(first, last), np.diff(np.asarray(tile.offsets, dtype=np.int64)))
+        v = np.asarray(tile.neighbours, dtype=np.int64)
+        keep = u < v
+        lower.append(u[keep])
+        higher.append(v[keep])
+    if not lower:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+    return np.concatenate(lower), np.concatenate(higher)
+
+
+def edge_segments(graph: Knn_Graph, coords: np.ndarray = None):
+    """
+    Returns the segments of every edge of a graph, each edge once
+
+    Parameters
+    ----------
+    graph: Knn_Graph
+        The graph, a Knn_Graph or a Tiled_Knn_Graph
+    coords: np.ndarray, optional
+        The coordinates of the vertices (see vertex_coords), if already read
+
+    Returns
+    -------
+    np.ndarray
+        An E x 2 x 2 array, the coordinates of both ends of each edge
+    """
+    u, v = _edge_ends(graph)
+    coords = vertex_coords(graph) if coords is None else coords
+    return np.stack((coords[u], coords[v]), axis=1)
+
+
+def draw_graph(ax, graph: Knn_Graph, search=None, start: Point = None, destination: Point = None,
+               point_size: float = None, rasterized: bool = True):
+    """
+    Draws a graph and, optionally, the visited vertices and the path of a
+    search on a matplotlib Axes
+
+    Parameters
+    ----------
+    ax: matplotlib.axes.Axes
+        Where to draw
+    graph: Knn_Graph
+        The graph, a Knn_Graph or a Tiled_Knn_Graph
+    search: GenericSearch, optional
+        A search that ran on the graph, its visited vertices are drawn in red
+        and its path in orange
+    start: Point, optional
+        Drawn as a green star
+    destination: Point, optional
+        Drawn as a blue star
+    point_size: float, optional
+        The size of the vertices, by default smaller as the graph grows
+    rasterized: bool
+        Wether the vertices and edges are drawn as an image rather than as
+        vector shapes (much smaller files for big graphs), defaults to True
+    """
+    coords = vertex_coords(graph)
+    if point_size is None:
+        point_size = float(np.clip(20000.0 / max(len(coords), 1), 0.1, 20.0))
+
+    # Plota gráfico
+    ax.add_collection(LineCollection(edge_segments(graph, coords), colors="GREY", linewidths=0.5,
+                                     rasterized=rasterized, zorder=1))
+    ax.scatter(coords[:, 0], coords[:, 1], s=point_size, rasterized=rasterized, zorder=2)
+
+    if search is not None:
+        # Plota caminho da busca:
+        visited = coords[np.asarray(search.visited_list, dtype=np.int64)]
+        ax.scatter(visited[:, 0], visited[:, 1], s=4 * point_size, color="RED", rasterized=rasterized, zorder=3)
+        path = coords[np.asarray(search.path, dtype=np.int64)]
+        ax.plot(path[:, 0], path[:, 1], color="ORANGE", linewidth=2, zorder=4)
+
+    # Plota Origem e Destino
+    if start is not None:
+        ax.plot(start.x, start.y, marker="*", markersize=15, color="GREEN", zorder=5)
+    if destination is not None:
+        ax.plot(destination.x, destination.y, marker="*", markersize=15, color="BLUE", zorder=5)
+
+    ax.set_xlim(0, graph.xSize)
+    ax.set_ylim(0, graph.ySize)
+    ax.set_aspect("equal")
+
+
+def render_png(path: str, graph: Knn_Graph, search=None, start: Point = None, destination: Point = None,
+               size: float = 10.0, dpi: int = 100, point_size: float = None):
+    """
+    Writes a PNG of a graph (see draw_graph) without opening a window
+
+    Parameters
+    ----------
+    path: str
+        Where to write the image
+    size: float
+        The side of the image in inches, defaults to 10
+    dpi: int
+        Pixels per inch, defaults to 100
+
+    See draw_graph for the other parameters
+    """
+    figure = Figure(figsize=(size, size), dpi=dpi)
+    FigureCanvasAgg(figure)
+    draw_graph(figure.add_subplot(), graph, search, start, destination, point_size)
+    figure.savefig(path, dpi=dpi)
+
+
+def show(graph: Knn_Graph, search=None, start: Point = None, destination: Point = None, point_size: float = None):
+    """
+    Draws a graph (see draw_graph) in a window
+    """
+    from matplotlib import pyplot as plt
+
+    _, ax = plt.subplots()
+    draw_graph(ax, graph, search, start, destination, point_size)
+    plt.show()
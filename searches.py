@@ -1,5 +1,8 @@
 from abc import ABCMeta, abstractmethod
 from types import FunctionType
+from collections import OrderedDict
+import math
+import time
 from grafo_knn import *
 from auxiliary_structures import *
 import numpy as np
@@ -15,54 +18,202 @@ variables for time analysis purposes
 
 
 
+class SearchStats:
+    """
+    Counters and timings of one search
+
+    Attributes
+    ----------
+    expansions: int
+        How many vertices were expanded (moved to the visited list)
+    pushes: int
+        How many times a vertex was put on the queue, or had its priority
+        lowered
+    pops: int
+        How many entries were taken from the queue
+    duplicate_skips: int
+        How many times a vertex was not queued or expanded again because it
+        was already visited or already on the queue
+    peak_open: int
+        The largest size the queue reached
+    setup_time: float
+        Seconds spent finding the ends of the search and their heuristics
+    search_time: float
+        Seconds spent in the search loop
+    """
+
+    __slots__ = ("expansions", "pushes", "pops", "duplicate_skips", "peak_open", "setup_time", "search_time")
+
+    def __init__(self):
+        self.expansions = 0
+        self.pushes = 0
+        self.pops = 0
+        self.duplicate_skips = 0
+        self.peak_open = 0
+        self.setup_time = 0.0
+        self.search_time = 0.0
+
+    @property
+    def total_time(self):
+        return self.setup_time + self.search_time
+
+    def as_dict(self):
+        """
+        Returns the counters and timings as a dict
+        """
+        stats = {name: getattr(self, name) for name in self.__slots__}
+        stats["total_time"] = self.total_time
+        return stats
+
+    def __repr__(self):
+        return "SearchStats(" + ", ".join(name + "=" + str(value) for name, value in self.as_dict().items()) + ")"
+
+
 class GenericSearch(metaclass = ABCMeta):
     """
     This class defines a general Framework
     for search algorithms
+
+    Searches work with vertex ids: the queue holds [id, h] entries and the
+    visited list holds ids, in the order in which they were visited.
+    Membership is tested in O(1): the closed set is a set of the visited ids
+    and the open set is the queue itself, which is indexed by id
+
+    Each search counts its work in a SearchStats, and can call hooks as it
+    goes: on_expand(search, id) when a vertex is expanded, on_push(search,
+    id, priority) when a vertex is queued and on_goal(search, id) when the
+    destination is found. Hooks left as None cost nothing.
     """
 
-    def __init__(self, destination : Point):
+    # Wether the paths found are shortest paths
+    optimal = False
+
+    def __init__(self, destination : Point, on_expand=None, on_push=None, on_goal=None):
         """
         Parameters
         ----------
 
         destination: Point
             The destination point for the search algorithm
+        on_expand: function, optional
+            Called with the search and the id of each vertex expanded
+        on_push: function, optional
+            Called with the search, the id and the priority of each vertex queued
+        on_goal: function, optional
+            Called with the search and the id of the destination when it is found
         """
 
-        #Start priority queue of points to visit
-        self._queue =  PriorityQueue()
+        #Start priority queue of points to visit, entries are [id, h]
+        self._queue =  HeapPriorityQueue()
 
-        #Initiate list of points in the order in which they where visited
+        #Initiate list of vertex ids in the order in which they where visited
         self._visitedList = []
 
-        #Store the destination for the search
+        #Set of the visited vertex ids (closed set), for membership tests
+        self._closed = set()
+
+        #Vertex from which each queued vertex was reached, to rebuild the path
+        self._parent = {}
+
+        #Store the destination for the search, its id is found when the search starts
         self._destination =  destination
+        self._destination_id = -1
+
+        #Heuristic of every vertex, set when the search starts
+        self._heuristic = None
+
+        #Counters and timings, and the hooks
+        self._stats = SearchStats()
+        self._on_expand = on_expand
+        self._on_push = on_push
+        self._on_goal = on_goal
+
+    @property
+    def visited_list(self):
+        return self._visitedList
+
+    @property
+    def stats(self):
+        return self._stats
+
+    @property
+    def path(self):
+        """
+        The ids of the vertices of the path found, from the start to the
+        destination, empty if the destination was not reached
+        """
+        if self._destination_id not in self._parent:
+            return []
+        path = [self._destination_id]
+        while self._parent[path[-1]] is not None:
+            path.append(self._parent[path[-1]])
+        path.reverse()
+        return path
 
     @abstractmethod
-    def heuristic(self, point :Point, graph: Knn_Graph):
+    def heuristic(self, point :int, graph: Knn_Graph):
         """
         To override
         """
         pass
 
-    def heuristic(self, point: Point, graph: Knn_Graph):
+    def heuristic(self, point: int, graph: Knn_Graph):
         pass
 
-    def visited(self, point: Point):
-        if point in self._visitedList :
-            return True
-        return False
+    def _destination_heuristic(self, graph: Knn_Graph):
+        """
+        Returns the heuristic array of the destination, read by heuristic
+        """
+        return graph.heuristic(self._destination_id)
+
+    def visited(self, point: int):
+        return point in self._closed
+
+    def _close(self, point: int):
+        """
+        Marks a vertex as visited
+        """
+        self._visitedList.append(point)
+        self._closed.add(point)
+        self._stats.expansions += 1
+        if self._on_expand is not None:
+            self._on_expand(self, point)
 
-    def step(self,actual: Point,  graph : Knn_Graph):
+    def _push(self, point: int, h: float):
+        """
+        Puts a vertex on the queue, or lowers its priority
+        """
+        self._queue.push(point, h)
+        stats = self._stats
+        stats.pushes += 1
+        if len(self._queue) > stats.peak_open:
+            stats.peak_open = len(self._queue)
+        if self._on_push is not None:
+            self._on_push(self, point, h)
+
+    def _goal(self, point: int):
+        """
+        Called when the destination is found
+        """
+        if self._on_goal is not None:
+            self._on_goal(self, point)
+
+    def _begin(self, start: int, graph: Knn_Graph):
+        """
+        Puts the start of the search on the queue
+        """
+        self._parent[start] = None
+        self._push(start, self.heuristic(start, graph))
+
+    def step(self,actual: int,  graph : Knn_Graph):
        
         """
         Expand current node
 
         Parameters
         ----------
-        actual: Point
-            The current point in the graph.
+        actual: int
+            The id of the current point in the graph.
         graph: Knn_Graph
             The current graph
 
@@ -77,33 +228,32 @@ class GenericSearch(metaclass = ABCMeta):
 
         # Check if the point has not yet been visited
         if self.visited(actual):
+            self._stats.duplicate_skips += 1
             return False
 
         # The point has not yet been visited, insert it into the visited list
-        print("Inserting " +str(actual)+"into visited list")
-        self._visitedList.append(actual)
+        self._close(actual)
 
         ## Expand the node        
         # For each node neighbouring the current node
-        for node in graph.neighbours(actual):
+        neighbours, _ = graph.neighbour_ids(actual)
+        for node in neighbours.tolist():
             # Did we find the goal node ?
-            if node == self._destination:
+            if node == self._destination_id:
                 #EUREKA
-                print("SEARCH COMPLETED")
+                self._parent[node] = actual
+                self._goal(node)
                 return True
             # It's not the goal node
             # has it been already visited ?
-            if node in self._visitedList:
-                # do nothing
-                pass
             # is it on the queue ? (has it already been planned for visitting ?)
-            # Don't forget we have to strip x and y dimension to check
-            elif [node.x, node.y, self.heuristic(node, graph)] in self._queue.array.tolist():
-                # also do nothing
-                pass
+            if self.visited(node) or node in self._queue:
+                # do nothing
+                self._stats.duplicate_skips += 1
             else:
                 # Insert the value into the open list:
-                self._queue.insert([node.x, node.y, self.heuristic(node, graph)])
+                self._parent[node] = actual
+                self._push(node, self.heuristic(node, graph))
 
         # Went trough all direct neighbours, found no destinatino
         # returns false
@@ -119,43 +269,61 @@ class GenericSearch(metaclass = ABCMeta):
             Where to start the search
         graph: Knn_Graph
             The graph in which to do the search
+
+        Returns
+        -------
+        bool
+            Wether the destination was reached
         """
 
         finish = False
+        began = time.perf_counter()
 
-        # Insert the starting node into the queue
-        self._queue.insert([start.x, start.y, self.heuristic(start, graph)])
-
-        print("Starting search !!")
+        # Find the vertex ids of both ends of the search
+        self._destination_id = graph.vertex_id(self._destination)
+        start_id = graph.vertex_id(start)
+        if self._destination_id < 0 or start_id < 0:
+            self._stats.setup_time = time.perf_counter() - began
+            return False
 
-        print("from node: "+str(start))
+        # Distances from every vertex to the destination, shared by all
+        # searches on this graph to the same destination
+        self._heuristic = self._destination_heuristic(graph)
 
+        # Insert the starting node into the queue
+        self._begin(start_id, graph)
+        looping = time.perf_counter()
+        self._stats.setup_time = looping - began
+        if start_id == self._destination_id:
+            self._goal(start_id)
+            return True
 
         while(finish == False):
 
             if self._queue.size == 0:
-                return False
+                break
 
             current_node_values = self._queue.remove()
+            self._stats.pops += 1
 
-            # Discards the heuristic value and create an auxiliary
-            # node with x and y values
-            current_node = Point(current_node_values[0], current_node_values[1])
+            # Discards the heuristic value and keeps the vertex id
+            current_node = int(current_node_values[0])
 
             # Step
             finish = self.step(current_node, graph)
 
-        return True
+        self._stats.search_time = time.perf_counter() - looping
+        return finish
 
 # As this fuction inherits from the generic search function, we only need to 
 # Define it's heuristic and the rest is python's problem ;)
 @GenericSearch.register
 class BestFirst(GenericSearch):
 
-    def __init__(self, destination: Point):
-        super().__init__(destination)
+    def __init__(self, destination: Point, on_expand=None, on_push=None, on_goal=None):
+        super().__init__(destination, on_expand, on_push, on_goal)
 
-    def heuristic(self, origin: Point, graph: Knn_Graph):
+    def heuristic(self, origin: int, graph: Knn_Graph):
         """
         Returns the heuristic for the
         best first search, given a sef of two points.
@@ -165,29 +333,53 @@ class BestFirst(GenericSearch):
 
         Parameters
         ----------
-            origin: Point
-                The origin point from which to calculate the heuristic
+            origin: int
+                The id of the origin point from which to calculate the heuristic
 
         Returns
         -------
             Float
-                The result of the formula:  h =  distance
+                The result of the formula:  h =  distance, read from the
+                distances to the destination cached by the graph
 
         """
 
-        return graph.distance(origin, self._destination)
+        return float(self._heuristic[origin])
 
     def search(self, origin: Point, graph: Knn_Graph):
-        super().search(origin, graph)
+        return super().search(origin, graph)
 
 @GenericSearch.register
 class AStar(GenericSearch):
-    def __init__(self, destination):
-        super().__init__(destination)
+    """
+    A* keeps, for every vertex reached, the length of the shortest path to it
+    found so far (g), and expands vertices by g + h. When a shorter path to a
+    queued vertex is found its priority is lowered in place (decrease-key).
+    The search ends when the destination is expanded, so the path found is a
+    shortest one.
+
+    With landmarks the heuristic is the landmark bound of the graph (see
+    Knn_Graph.landmark_heuristic), tighter than the straight-line distance
+    once Knn_Graph.select_landmarks was run.
+    """
 
-        self._distance = 0.0
+    optimal = True
 
-    def heuristic(self, origin: Point, graph: Knn_Graph):
+    def __init__(self, destination, on_expand=None, on_push=None, on_goal=None, landmarks: bool = False):
+        super().__init__(destination, on_expand, on_push, on_goal)
+
+        # Length of the shortest known path from the start to each vertex
+        self._cost = {}
+        self._landmarks = landmarks
+
+    @property
+    def distance(self):
+        """
+        The length of the path found, inf if the destination was not reached
+        """
+        return self._cost.get(self._destination_id, math.inf)
+
+    def heuristic(self, origin: int, graph: Knn_Graph):
         """
         Returns the heuristic for the
         best first search, given a sef of two points.
@@ -197,79 +389,42 @@ class AStar(GenericSearch):
 
         Parameters
         ----------
-            origin: Point
-                The origin point from which to calculate the heuristic
+            origin: int
+                The id of the origin point from which to calculate the heuristic
 
         Returns
         -------
             Float
-                The result of the formula:  h =  distance
+                The result of the formula:  h =  distance, read from the
+                distances to the destination cached by the graph
 
         """
 
-        return graph.distance(origin, self._destination)
-
-    def search(self, start: Point, graph: Knn_Graph):
-        """
-        Do the search
-
-        Parameters
-        ----------
-        start: Point
-            Where to start the search
-        graph: Knn_Graph
-            The graph in which to do the search
-        """
+        return float(self._heuristic[origin])
 
-        finish = False
+    def _destination_heuristic(self, graph: Knn_Graph):
+        if self._landmarks:
+            return graph.landmark_heuristic(self._destination_id)
+        return graph.heuristic(self._destination_id)
 
-        # Insert the starting node into the queue
+    def _begin(self, start: int, graph: Knn_Graph):
         # Distance to starting node is 0
-        self._queue.insert([start.x, start.y, self.heuristic(start, graph)])
-
-        print("Starting search !!")
-
-        print("from node: "+str(start))
-
-        while(finish == False):
-
-            if self._queue.size == 0:
-                return False
-
-            current_node_values = self._queue.remove()
-
-            
-
-            # Discards the heuristic value and create an auxiliary
-            # node with x and y values
-            current_node = Point(current_node_values[0], current_node_values[1])
-            # Only add distance if it actually expanded the node
-            will_add = False
-            # Step
-            finish = self.step(current_node, graph, will_add)
-
-            next_node = self._queue.array[0]  # First value will be the next node
-
-            # Add the distance between the previous to the new first as the current distance:
-            self._distance += graph.distance(Point(current_node[0], current_node[1]), Point(next_node[0], next_node[1])) if will_add else 0
-
-        return True
+        self._cost[start] = 0.0
+        super()._begin(start, graph)
 
     # For A* we have to change the STEP function to include the distance travelled into the heuristics
     # Here is how we do it:
-    def step(self,actual: Point,  graph : Knn_Graph, will_add : bool):
+    def step(self,actual: int,  graph : Knn_Graph):
            
         """
         Expand current node
 
         Parameters
         ----------
-        actual: Point
-            The current point in the graph.
+        actual: int
+            The id of the current point in the graph.
         graph: Knn_Graph
             The current graph
-        current_distance: float
-            Current distance between origin point and actual node
 
         Returns
         -------
@@ -282,41 +437,562 @@ class AStar(GenericSearch):
 
         # Check if the point has not yet been visited
         if self.visited(actual):
-            will_add = False
+            self._stats.duplicate_skips += 1
             return False
 
         # The point has not yet been visited, insert it into the visited list
-        print("Inserting " +str(actual)+"into visited list")
-        will_add = True
-        self._visitedList.append(actual)
+        self._close(actual)
+
+        # Did we expand the goal node ?
+        if actual == self._destination_id:
+            #EUREKA
+            self._goal(actual)
+            return True
 
         ## Expand the node        
         # For each node neighbouring the current node
-        for node in graph.neighbours(actual):
-            # Did we find the goal node ?
-            if node == self._destination:
-                #EUREKA
-                print("SEARCH COMPLETED")
-                return True
-            # It's not the goal node
+        distance = self._cost[actual]
+        neighbours, lengths = graph.neighbour_ids(actual)
+        for node, length in zip(neighbours.tolist(), lengths.tolist()):
             # has it been already visited ?
-            if node in self._visitedList:
+            if self.visited(node):
                 # do nothing
-                will_add = False
-                pass
-            # is it on the queue ? (has it already been planned for visitting ?)
-            # Don't forget we have to strip x and y dimension to check
-            elif [node.x, node.y, self.heuristic(node, graph)] in self._queue.array.tolist():
-                # also do nothing
-                pass
-            else:
-                # Insert the value into the open list:
-                # This time the prioirity is the distance to end + distance so far + distance to next node
-                # Where distance so far = current_distance
-                # And distance to next node = Distance(actual node, node)
-                self._queue.insert([node.x, node.y, self.heuristic(node, graph)+graph.distance(actual, node)+self._distance])
+                self._stats.duplicate_skips += 1
+                continue
+            # This time the prioirity is the distance to end + distance so far + distance to next node
+            # Where distance so far = distance to actual node
+            # And distance to next node = length of the edge (actual node, node)
+            cost = distance + length
+            # Only keep it if it is the shortest way to node found so far, if node
+            # is already on the queue its priority is lowered
+            if cost < self._cost.get(node, math.inf):
+                self._cost[node] = cost
+                self._parent[node] = actual
+                self._push(node, cost + self.heuristic(node, graph))
 
         # Went trough all direct neighbours, found no destination
         # returns false
         return False
 
+
+@GenericSearch.register
+class LandmarkAStar(AStar):
+    """
+    AStar with the landmark heuristic (ALT)
+    """
+
+    def __init__(self, destination, on_expand=None, on_push=None, on_goal=None):
+        super().__init__(destination, on_expand, on_push, on_goal, landmarks=True)
+
+
+@GenericSearch.register
+class BidirectionalAStar(GenericSearch):
+    """
+    A* from both ends at once: a forward search from the start and a backward
+    one from the destination, which meet about half way, so each floods a
+    disc of about half the radius.
+
+    Both use the average potential p(v) = (h_t(v) - h_s(v)) / 2, where h_t
+    and h_s are the straight-line distances to the destination and to the
+    start: the forward search expands by g + p and the backward one by g - p,
+    so both are consistent and agree on edge costs. mu is the length of the
+    shortest path found through a vertex reached from both sides, and the
+    search ends when the two smallest keys add up to at least mu, no shorter
+    path can be left then.
+    """
+
+    optimal = True
+
+    def __init__(self, destination, on_expand=None, on_push=None, on_goal=None):
+        super().__init__(destination, on_expand, on_push, on_goal)
+
+        # Length of the shortest known path from the start (forward) and to
+        # the destination (backward) for each vertex, and the backward
+        # search's own queue, parents and closed set
+        self._cost = {}
+        self._cost_back = {}
+        self._queue_back = HeapPriorityQueue()
+        self._parent_back = {}
+        self._closed_back = set()
+
+        # Shortest path found so far, through the meeting vertex
+        self._mu = math.inf
+        self._meeting = -1
+        self._start_id = -1
+        # Potential of every vertex for a graph in memory, otherwise of each
+        # vertex met, computed when it is first needed
+        self._potential = None
+        self._potential_memo = {}
+
+    @property
+    def distance(self):
+        """
+        The length of the path found, inf if the destination was not reached
+        """
+        return self._mu
+
+    @property
+    def path(self):
+        if self._meeting < 0:
+            return []
+        path = [self._meeting]
+        while self._parent[path[-1]] is not None:
+            path.append(self._parent[path[-1]])
+        path.reverse()
+        while self._parent_back[path[-1]] is not None:
+            path.append(self._parent_back[path[-1]])
+        return path
+
+    def heuristic(self, origin: int, graph: Knn_Graph):
+        """
+        The forward potential of a vertex, the backward one is its opposite
+
+        For a graph in memory the potentials of every vertex are computed in
+        one vectorized pass when the search starts. On a tiled graph they are
+        read from the heuristic of the destination and the distance to the
+        start one vertex at a time. Either way the start does not take a
+        destination's place in the heuristic cache
+        """
+        if self._potential is not None:
+            return self._potential[origin]
+        potential = self._potential_memo.get(origin)
+        if potential is None:
+            potential = 0.5 * (float(self._heuristic[origin]) - graph.vertex_distance(origin, self._start_id))
+            self._potential_memo[origin] = potential
+        return potential
+
+    def _push_to(self, queue: HeapPriorityQueue, point: int, h: float):
+        queue.push(point, h)
+        stats = self._stats
+        stats.pushes += 1
+        if len(self._queue) + len(self._queue_back) > stats.peak_open:
+            stats.peak_open = len(self._queue) + len(self._queue_back)
+        if self._on_push is not None:
+            self._on_push(self, point, h)
+
+    def _expand(self, graph: Knn_Graph, forward: bool):
+        """
+        Expands the vertex with the smallest key on one side
+        """
+        if forward:
+            queue, closed, cost, parent, other, sign = (self._queue, self._closed, self._cost, self._parent,
+                                                        self._cost_back, 1.0)
+        else:
+            queue, closed, cost, parent, other, sign = (self._queue_back, self._closed_back, self._cost_back,
+                                                        self._parent_back, self._cost, -1.0)
+        actual, _ = queue.pop()
+        self._stats.pops += 1
+        closed.add(actual)
+        self._visitedList.append(actual)
+        self._stats.expansions += 1
+        if self._on_expand is not None:
+            self._on_expand(self, actual)
+
+        distance = cost[actual]
+        neighbours, lengths = graph.neighbour_ids(actual)
+        for node, length in zip(neighbours.tolist(), lengths.tolist()):
+            if node in closed:
+                self._stats.duplicate_skips += 1
+                continue
+            g = distance + length
+            if g < cost.get(node, math.inf):
+                cost[node] = g
+                parent[node] = actual
+                self._push_to(queue, node, g + sign * self.heuristic(node, graph))
+                # Reached from both sides, a path from the start to the destination
+                if node in other and g + other[node] < self._mu:
+                    self._mu = g + other[node]
+                    self._meeting = node
+
+    def search(self, start: Point, graph: Knn_Graph):
+        finish = False
+        began = time.perf_counter()
+
+        self._destination_id = graph.vertex_id(self._destination)
+        start_id = graph.vertex_id(start)
+        if self._destination_id < 0 or start_id < 0:
+            self._stats.setup_time = time.perf_counter() - began
+            return False
+
+        self._heuristic = graph.heuristic(self._destination_id)
+        self._start_id = start_id
+        if isinstance(self._heuristic, np.ndarray):
+            # A plain list reads faster one item at a time than an array
+            self._potential = (0.5 * (self._heuristic - graph.vertex_distances(start_id))).tolist()
+
+        self._cost[start_id] = 0.0
+        self._parent[start_id] = None
+        self._push_to(self._queue, start_id, self.heuristic(start_id, graph))
+        self._cost_back[self._destination_id] = 0.0
+        self._parent_back[self._destination_id] = None
+        self._push_to(self._queue_back, self._destination_id, -self.heuristic(self._destination_id, graph))
+        looping = time.perf_counter()
+        self._stats.setup_time = looping - began
+        if start_id == self._destination_id:
+            self._mu = 0.0
+            self._meeting = start_id
+            self._goal(start_id)
+            return True
+
+        while self._queue.size and self._queue_back.size:
+            top, top_back = self._queue.peek()[1], self._queue_back.peek()[1]
+            # No path through an unexpanded vertex can be shorter than mu
+            if top + top_back >= self._mu:
+                finish = True
+                break
+            self._expand(graph, top <= top_back)
+
+        if finish:
+            self._goal(self._destination_id)
+        self._stats.search_time = time.perf_counter() - looping
+        return finish
+
+
+# The searches, by name
+ALGORITHMS = {
+    "BestFirst": BestFirst,
+    "AStar": AStar,
+    "LandmarkAStar": LandmarkAStar,
+    "BidirectionalAStar": BidirectionalAStar,
+}
+
+
+def path_length(graph: Knn_Graph, path: list):
+    """
+    Returns the length of a path given by the ids of its vertices
+    """
+    return sum(graph.vertex_distance(i, j) for i, j in zip(path, path[1:]))
+
+
+class PathCache:
+    """
+    A bounded LRU cache of search results, in front of the searches
+
+    Results are kept by (algorithm, source id, destination id). For the
+    optimal searches a query is also answered from any cached shortest path
+    that goes through both of its ends, in either direction, since a part of
+    a shortest path is a shortest path. Every cached path is indexed by the
+    vertices on it for that.
+
+    The cache remembers the version of the graph it was filled on, and is
+    emptied when the graph changes (see Knn_Graph.version).
+
+    Attributes
+    ----------
+    hits: int
+        Queries answered from the cache, subpath_hits of them from a part of
+        a longer path
+    misses: int
+        Queries that ran a search
+    evictions: int
+        Results dropped to stay within the capacity
+    invalidations: int
+        How many times the cache was emptied because the graph changed
+    """
+
+    def __init__(self, graph: Knn_Graph, capacity: int = 1024):
+        """
+        Parameters
+        ----------
+        graph: Knn_Graph
+            The graph the searches run on
+        capacity: int
+            How many results are kept, defaults to 1024
+        """
+        self._graph = graph
+        self._capacity = max(capacity, 1)
+        self._entries = OrderedDict()
+        # For each vertex, the keys of the cached shortest paths through it
+        # and its position on them
+        self._on_path = {}
+        self._version = graph.version
+
+        self.hits = 0
+        self.subpath_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def stats(self):
+        """
+        Returns the counters as a dict
+        """
+        return {"size": len(self._entries), "capacity": self._capacity, "hits": self.hits,
+                "subpath_hits": self.subpath_hits, "misses": self.misses, "evictions": self.evictions,
+                "invalidations": self.invalidations}
+
+    def clear(self):
+        """
+        Drops every result
+        """
+        self._entries.clear()
+        self._on_path.clear()
+
+    def _check_version(self):
+        if self._graph.version != self._version:
+            self.clear()
+            self._version = self._graph.version
+            self.invalidations += 1
+
+    def _drop(self, key):
+        _, _, path, _ = self._entries.pop(key)
+        if ALGORITHMS[key[0]].optimal:
+            for vertex in path.tolist():
+                positions = self._on_path.get(vertex)
+                if positions is not None:
+                    positions.pop(key, None)
+                    if not positions:
+                        del self._on_path[vertex]
+
+    def _store(self, key, found: bool, length: float, path: list):
+        path = np.asarray(path, dtype=np.int64)
+        # Length of the path from its start to each of its vertices
+        cumulative = np.zeros(len(path))
+        if len(path) > 1:
+            cumulative[1:] = np.cumsum([self._graph.vertex_distance(i, j)
+                                        for i, j in zip(path[:-1].tolist(), path[1:].tolist())])
+        self._entries[key] = (found, length, path, cumulative)
+        if ALGORITHMS[key[0]].optimal:
+            for position, vertex in enumerate(path.tolist()):
+                self._on_path.setdefault(vertex, {})[key] = position
+        while len(self._entries) > self._capacity:
+            self._drop(next(iter(self._entries)))
+            self.evictions += 1
+
+    def _subpath(self, source: int, destination: int):
+        # A cached shortest path through both ends, as (path, length)
+        on_source = self._on_path.get(source)
+        on_destination = self._on_path.get(destination)
+        if not on_source or not on_destination:
+            return None
+        if len(on_source) > len(on_destination):
+            on_source, on_destination = on_destination, on_source
+            source, destination = destination, source
+            reverse = True
+        else:
+            reverse = False
+        for key, first in on_source.items():
+            last = on_destination.get(key)
+            if last is None:
+                continue
+            _, _, path, cumulative = self._entries[key]
+            self._entries.move_to_end(key)
+            length = abs(float(cumulative[last] - cumulative[first]))
+            part = path[first:last + 1] if first <= last else path[last:first + 1][::-1]
+            return (part[::-1] if reverse else part), length
+        return None
+
+    def query(self, source: int, destination: int, algorithm: str = "AStar"):
+        """
+        Finds a path, from the cache if possible
+
+        Parameters
+        ----------
+        source: int
+            The id of the start of the path
+        destination: int
+            The id of its end
+        algorithm: str
+            The name of the search, a key of ALGORITHMS, defaults to "AStar"
+
+        Returns
+        -------
+        bool
+            Wether the destination can be reached
+        float
+            The length of the path, inf if the destination can not be reached
+        np.ndarray
+            The ids of the vertices of the path, empty if the destination can
+            not be reached
+        """
+        self._check_version()
+        key = (algorithm, source, destination)
+        entry = self._entries.get(key)
+        if entry is not None:
+            self.hits += 1
+            self._entries.move_to_end(key)
+            return entry[0], entry[1], entry[2]
+
+        if ALGORITHMS[algorithm].optimal:
+            found = self._subpath(source, destination)
+            if found is not None:
+                self.hits += 1
+                self.subpath_hits += 1
+                return True, found[1], found[0]
+
+        self.misses += 1
+        search = ALGORITHMS[algorithm](self._graph.point(destination))
+        found = bool(search.search(self._graph.point(source), self._graph))
+        path = search.path if found else []
+        length = path_length(self._graph, path) if found else math.inf
+        self._store(key, found, length, path)
+        return found, length, self._entries[key][2]
+
+
+class ShortestPathTree:
+    """
+    The shortest paths from one source to many vertices, grown with Dijkstra
+    only as far as the targets asked for need
+
+    The tree keeps its queue between queries, so later queries from the same
+    source only settle the vertices not settled yet. Distances and
+    predecessors are kept in arrays indexed by vertex id, -1 standing for no
+    predecessor. The tree starts over if the graph changes (see
+    Knn_Graph.version).
+
+    Attributes
+    ----------
+    source: int
+        The id of the root of the tree
+    settled_count: int
+        How many vertices have their shortest distance known
+    """
+
+    def __init__(self, graph: Knn_Graph, source: int, on_expand=None):
+        """
+        Parameters
+        ----------
+        graph: Knn_Graph
+            The graph
+        source: int
+            The id of the root of the tree
+        on_expand: function, optional
+            Called with the tree and the id of each vertex settled
+        """
+        if not 0 <= source < graph.vertex_count:
+            raise ValueError("not a vertex id: " + str(source))
+        self._graph = graph
+        self._on_expand = on_expand
+        self.source = source
+        self._reset()
+
+    def _reset(self):
+        n = self._graph.vertex_count
+        self._version = self._graph.version
+        self._distance = np.full(n, math.inf)
+        self._parent = np.full(n, -1, dtype=np.int64)
+        self._settled = np.zeros(n, dtype=bool)
+        self._queue = HeapPriorityQueue()
+        self._stats = SearchStats()
+        self.settled_count = 0
+
+        self._distance[self.source] = 0.0
+        self._queue.push(self.source, 0.0)
+        self._stats.pushes += 1
+        self._stats.peak_open = 1
+
+    @property
+    def stats(self):
+        return self._stats
+
+    @property
+    def complete(self):
+        """
+        Wether every vertex reachable from the source is settled
+        """
+        return len(self._queue) == 0
+
+    def settled(self, i: int):
+        return bool(self._settled[i])
+
+    def grow(self, targets=None):
+        """
+        Settles vertices, closest first, until every target is settled or no
+        vertex is left to reach
+
+        Parameters
+        ----------
+        targets: np.ndarray, optional
+            The ids of the vertices to settle, all of them by default
+
+        Returns
+        -------
+        bool
+            Wether every target was reached
+        """
+        if self._graph.version != self._version:
+            self._reset()
+        began = time.perf_counter()
+
+        if targets is None:
+            remaining = -1
+        else:
+            targets = np.unique(np.asarray(targets, dtype=np.int64))
+            if len(targets) and (targets[0] < 0 or targets[-1] >= len(self._settled)):
+                raise ValueError("not a vertex id in the targets")
+            pending = set(targets[~self._settled[targets]].tolist())
+            remaining = len(pending)
+
+        queue = self._queue
+        stats = self._stats
+        distance = self._distance
+        parent = self._parent
+        settled = self._settled
+        while remaining != 0 and len(queue):
+            actual, d = queue.pop()
+            stats.pops += 1
+            settled[actual] = True
+            self.settled_count += 1
+            stats.expansions += 1
+            if self._on_expand is not None:
+                self._on_expand(self, actual)
+            if remaining > 0 and actual in pending:
+                remaining -= 1
+
+            neighbours, lengths = self._graph.neighbour_ids(actual)
+            for node, length in zip(neighbours.tolist(), lengths.tolist()):
+                if settled[node]:
+                    stats.duplicate_skips += 1
+                    continue
+                cost = d + length
+                if cost < distance[node]:
+                    distance[node] = cost
+                    parent[node] = actual
+                    queue.push(node, cost)
+                    stats.pushes += 1
+            if len(queue) > stats.peak_open:
+                stats.peak_open = len(queue)
+
+        stats.search_time += time.perf_counter() - began
+        return remaining <= 0 or targets is None
+
+    def query(self, targets):
+        """
+        The shortest distances and the predecessors of many targets, growing
+        the tree as needed
+
+        Parameters
+        ----------
+        targets: np.ndarray
+            The ids of the targets
+
+        Returns
+        -------
+        np.ndarray
+            The distance from the source to each target, inf if it can not be
+            reached
+        np.ndarray
+            The predecessor of each target on its shortest path, -1 for the
+            source and for the targets that can not be reached
+        """
+        targets = np.asarray(targets, dtype=np.int64).reshape(-1)
+        self.grow(targets)
+        reached = self._settled[targets]
+        return np.where(reached, self._distance[targets], math.inf), np.where(reached, self._parent[targets], -1)
+
+    def path(self, target: int):
+        """
+        The ids of the vertices of the shortest path from the source to a
+        target, empty if it can not be reached
+        """
+        self.grow([target])
+        if not self._settled[target]:
+            return []
+        path = [target]
+        while path[-1] != self.source:
+            path.append(int(self._parent[path[-1]]))
+        path.reverse()
+        return path
@@ -0,0 +1,377 @@
+import argparse
+import asyncio
+import collections
+import json
+import shutil
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import numpy as np
+from grafo_knn import Knn_Graph
+from searches import ALGORITHMS
+from batch import graph_file, init_worker, open_graph_file, run_queries, worker_queries
+
+"""
+
+This file serves path queries over a local socket, from one process that
+holds the graph.
+
+The protocol is one JSON object per line. A query
+
+    {"id": 1, "source": 10, "destination": 250, "algorithm": "AStar", "path": true}
+
+("algorithm" defaults to AStar and "path" to false) is answered with
+
+    {"id": 1, "found": true, "length": 812.4, "expansions": 97, "path": [10, ..., 250]}
+
+or {"id": 1, "error": "..."}, and {"op": "stats"} is answered with the
+latency percentiles, the queue depth and the number of queries served.
+Answers on a connection may come in any order, they carry the id of their
+query.
+
+Queries that arrive within a short window are grouped in a batch, and each
+batch is split in chunks that run on a pool of worker processes (or a
+thread, with no workers) so the event loop keeps accepting queries while
+searches run. A query is answered as soon as its chunk is done.
+
+    python server.py --graph big.knn --port 8765 --workers 4
+
+"""
+
+
+# How many recent latencies the percentiles are computed over
+LATENCY_WINDOW = 10000
+
+
+class QueryServer:
+    """
+    An asyncio server answering path queries against a graph
+
+    Attributes
+    ----------
+    graph: Knn_Graph
+        The graph the queries run on
+    queue_depth: int
+        Queries received and not yet answered
+    served: int
+        Queries answered so far
+    """
+
+    def __init__(self, graph: Knn_Graph, workers: int = 0, window: float = 0.002, max_batch: int = 64,
+                 path: str = None):
+        """
+        Parameters
+        ----------
+        graph: Knn_Graph
+            The graph, a Knn_Graph or a Tiled_Knn_Graph
+        workers: int
+            How many worker processes run the searches, they open the graph
+            from a file (see batch.graph_file). 0 runs them on a thread of
+            this process instead. Defaults to 0
+        window: float
+            How long, in seconds, the first query of a batch waits for others
+            to join it, defaults to 2ms
+        max_batch: int
+            The most queries in a batch, defaults to 64
+        path: str, optional
+            A file the graph was saved to, for the workers to open
+        """
+        self._graph = graph
+        self._workers = workers
+        self._window = window
+        self._max_batch = max_batch
+        self._path = path
+
+        self._queue = None
+        self._executor = None
+        self._directory = None
+        self._batcher = None
+        self._server = None
+        self._running = set()
+        self._connections = set()
+
+        self._latencies = collections.deque(maxlen=LATENCY_WINDOW)
+        self.queue_depth = 0
+        self.served = 0
+        self.batches = 0
+
+    @property
+    def graph(self):
+        return self._graph
+
+    def stats(self):
+        """
+        Returns the latency percentiles (in seconds, over the last
+        LATENCY_WINDOW queries), the queue depth and the queries and batches
+        served
+        """
+        stats = {"queue_depth": self.queue_depth, "served": self.served, "batches": self.batches}
+        if self._latencies:
+            p50, p90, p99 = np.percentile(np.fromiter(self._latencies, dtype=np.float64), [50, 90, 99])
+            stats.update({"p50": p50, "p90": p90, "p99": p99, "max": max(self._latencies)})
+        return stats
+
+    async def start(self, host: str = "127.0.0.1", port: int = 0, unix_path: str = None):
+        """
+        Starts the workers and listens on a TCP port (0 picks a free one) or,
+        with unix_path, on a Unix socket
+
+        Returns
+        -------
+        tuple or str
+            The address the server listens on
+        """
+        if self._workers > 0:
+            path, tiled, self._directory = graph_file(self._graph, self._path)
+            self._executor = ProcessPoolExecutor(self._workers, initializer=init_worker,
+                                                 initargs=(path, tiled))
+        else:
+            self._executor = ThreadPoolExecutor(1)
+
+        self._queue = asyncio.Queue()
+        self._batcher = asyncio.ensure_future(self._batch_loop())
+        if unix_path is not None:
+            self._server = await asyncio.start_unix_server(self._handle, unix_path)
+        else:
+            self._server = await asyncio.start_server(self._handle, host, port)
+        return self._server.sockets[0].getsockname()
+
+    async def serve_forever(self):
+        await self._server.serve_forever()
+
+    async def close(self):
+        """
+        Stops listening, and stops the batches and the workers
+        """
+        if self._server is not None:
+            self._server.close()
+        for task in list(self._connections):
+            task.cancel()
+        if self._connections:
+            await asyncio.gather(*self._connections, return_exceptions=True)
+        if self._server is not None:
+            await self._server.wait_closed()
+        if self._batcher is not None:
+            self._batcher.cancel()
+        # Batches still running, their queries are not answered
+        for task in list(self._running):
+            task.cancel()
+        if self._running:
+            await asyncio.gather(*self._running, return_exceptions=True)
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+        if self._directory is not None:
+            shutil.rmtree(self._directory, ignore_errors=True)
+
+    def _check(self, request: dict):
+        # Returns the query as (source, destination, algorithm, path) or raises ValueError
+        algorithm = request.get("algorithm", "AStar")
+        if algorithm not in ALGORITHMS:
+            raise ValueError("unknown search: " + str(algorithm))
+        source, destination = request.get("source"), request.get("destination")
+        n = self._graph.vertex_count
+        for vertex in (source, destination):
+            # JSON true and false are ints to Python, they are not vertex ids
+            if not isinstance(vertex, int) or isinstance(vertex, bool) or not 0 <= vertex < n:
+                raise ValueError("not a vertex id: " + str(vertex))
+        return source, destination, algorithm, bool(request.get("path", False))
+
+    async def query(self, source: int, destination: int, algorithm: str = "AStar", path: bool = False):
+        """
+        Runs one query through the batches, as the socket clients do
+
+        Returns
+        -------
+        dict
+            The answer, without the id
+        """
+        received = time.perf_counter()
+        future = asyncio.get_running_loop().create_future()
+        self.queue_depth += 1
+        await self._queue.put(((source, destination, algorithm, path), future))
+        try:
+            return await future
+        finally:
+            self.queue_depth -= 1
+            self.served += 1
+            self._latencies.append(time.perf_counter() - received)
+
+    async def _batch_loop(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            # Wait a little for more queries to join the batch
+            deadline = loop.time() + self._window
+            while len(batch) < self._max_batch:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            self.batches += 1
+            task = asyncio.ensure_future(self._run_batch(batch))
+            self._running.add(task)
+            task.add_done_callback(self._running.discard)
+
+    async def _run_batch(self, batch: list):
+        # One run per (algorithm, path) group of the batch, split in about one
+        # chunk per worker process so the workers share it and each query is
+        # answered when its chunk is done. The thread runs each group whole
+        groups = collections.defaultdict(list)
+        for query, future in batch:
+            groups[query[2:]].append((query, future))
+        chunks = []
+        for (algorithm, path), members in groups.items():
+            size = -(-len(members) // self._workers) if self._workers > 0 else len(members)
+            for first in range(0, len(members), size):
+                chunks.append(self._run_chunk(algorithm, path, members[first:first + size]))
+        await asyncio.gather(*chunks)
+
+    async def _run_chunk(self, algorithm: str, path: bool, members: list):
+        loop = asyncio.get_running_loop()
+        pairs = np.array([query[:2] for query, _ in members], dtype=np.int64)
+        try:
+            if self._workers > 0:
+                _, result = await loop.run_in_executor(self._executor, worker_queries, (0, pairs, algorithm, path))
+            else:
+                result = await loop.run_in_executor(self._executor, run_queries, self._graph, pairs, algorithm, path)
+        except Exception as error:
+            for _, future in members:
+                if not future.done():
+                    future.set_exception(error)
+            return
+        for i, (_, future) in enumerate(members):
+            answer = {
+                "found": bool(result.found[i]),
+                "length": float(result.lengths[i]) if result.found[i] else None,
+                "expansions": int(result.expansions[i]),
+            }
+            if path:
+                answer["path"] = result.path(i).tolist()
+            if not future.done():
+                future.set_result(answer)
+
+    async def _answer(self, request: dict, writer: asyncio.StreamWriter, lock: asyncio.Lock):
+        try:
+            answer = await self.query(*self._check(request))
+        except Exception as error:
+            answer = {"error": str(error)}
+        answer["id"] = request.get("id")
+        async with lock:
+            writer.write((json.dumps(answer) + "\n").encode("utf-8"))
+            await writer.drain()
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        lock = asyncio.Lock()
+        pending = set()
+        connection = asyncio.current_task()
+        self._connections.add(connection)
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                try:
+                    request = json.loads(line)
+                    if not isinstance(request, dict):
+                        raise ValueError("a request is a JSON object")
+                except ValueError as error:
+                    request = {"op": "error", "error": str(error)}
+
+                if request.get("op") in ("stats", "error"):
+                    answer = self.stats() if request["op"] == "stats" else {"error": request["error"]}
+                    answer["id"] = request.get("id")
+                    async with lock:
+                        writer.write((json.dumps(answer) + "\n").encode("utf-8"))
+                        await writer.drain()
+                    continue
+
+                # Queries of a connection run concurrently, so they can share batches
+                task = asyncio.ensure_future(self._answer(request, writer, lock))
+                pending.add(task)
+                task.add_done_callback(pending.discard)
+            if pending:
+                await asyncio.gather(*pending)
+        except (ConnectionError, asyncio.CancelledError):
+            # The client went away, or the server is closing
+            for task in pending:
+                task.cancel()
+        finally:
+            self._connections.discard(connection)
+            writer.close()
+
+
+async def request(requests: list, host: str = "127.0.0.1", port: int = None, unix_path: str = None):
+    """
+    Sends queries to a QueryServer over one connection and waits for all the
+    answers
+
+    Parameters
+    ----------
+    requests: list
+        The queries, dicts as described at the top of this file, each with
+        a different id
+
+    Returns
+    -------
+    list
+        The answers, in the order of the requests
+    """
+    if unix_path is not None:
+        reader, writer = await asyncio.open_unix_connection(unix_path)
+    else:
+        reader, writer = await asyncio.open_connection(host, port)
+    try:
+        writer.write("".join(json.dumps(r) + "\n" for r in requests).encode("utf-8"))
+        await writer.drain()
+        answers = {}
+        while len(answers) < len(requests):
+            answer = json.loads(await reader.readline())
+            answers[answer.get("id")] = answer
+        return [answers.get(r.get("id")) for r in requests]
+    finally:
+        writer.close()
+        await writer.wait_closed()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serves path queries over a local socket")
+    parser.add_argument("--graph", help="the graph file to serve")
+    parser.add_argument("--size", type=int, default=10000, help="without --graph, build a graph of this many points")
+    parser.add_argument("--k", type=int, default=7)
+    parser.add_argument("--seed", type=int)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--unix", help="listen on this Unix socket instead of TCP")
+    parser.add_argument("--workers", type=int, default=0, help="worker processes, 0 runs searches on a thread")
+    parser.add_argument("--window", type=float, default=0.002, help="batching window, in seconds")
+    parser.add_argument("--max-batch", type=int, default=64)
+    args = parser.parse_args(argv)
+
+    if args.graph:
+        graph = open_graph_file(args.graph)
+    else:
+        side = int(np.ceil(np.sqrt(args.size * 500)))
+        graph = Knn_Graph(side, side)
+        graph.grafo_knn(args.size, args.k, seed=args.seed)
+
+    async def serve():
+        server = QueryServer(graph, args.workers, args.window, args.max_batch, args.graph)
+        address = await server.start(args.host, args.port, args.unix)
+        print("serving", graph.vertex_count, "vertices on", address, file=sys.stderr)
+        try:
+            await server.serve_forever()
+        finally:
+            await server.close()
+
+    try:
+        asyncio.run(serve())
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
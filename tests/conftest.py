@@ -0,0 +1,23 @@
+import os
+import sys
+import pytest
+
+# The modules live at the root of the repository
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from grafo_knn import Knn_Graph
+
+
+def small_graph(n: int = 300, k: int = 4, seed: int = 0, memory_profile: str = "default"):
+    """
+    A seeded random knn graph of n points
+    """
+    side = int((n * 500) ** 0.5) + 1
+    graph = Knn_Graph(side, side, memory_profile)
+    graph.grafo_knn(n, k, seed=seed)
+    return graph
+
+
+@pytest.fixture
+def graph():
+    return small_graph()
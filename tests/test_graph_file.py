@@ -0,0 +1,39 @@
+import numpy as np
+import pytest
+from conftest import small_graph
+from grafo_knn import Knn_Graph, MEMORY_PROFILES, Point
+
+
+@pytest.mark.parametrize("profile", MEMORY_PROFILES)
+@pytest.mark.parametrize("mmap", [True, False])
+def test_save_load_round_trip(tmp_path, profile, mmap):
+    graph = small_graph(memory_profile=profile)
+    graph.select_landmarks(3, seed=0)
+    path = str(tmp_path / "graph.knn")
+    graph.save(path)
+
+    loaded = Knn_Graph.load(path, mmap)
+    assert loaded.memory_profile == profile
+    assert loaded.vertex_count == graph.vertex_count
+    assert np.array_equal(loaded.coords, graph.coords)
+    for before, after in zip(graph.adjacency.pairs(), loaded.adjacency.pairs()):
+        assert np.array_equal(before, after)
+    assert np.array_equal(loaded.landmarks, graph.landmarks)
+    assert np.array_equal(loaded.landmark_distances, graph.landmark_distances)
+    assert loaded.knn_recall() == graph.knn_recall()
+    assert loaded.nearest_neighbour(Point(7, 9))[0].id == graph.nearest_neighbour(Point(7, 9))[0].id
+
+
+def test_loaded_graph_can_change(tmp_path):
+    graph = small_graph()
+    graph.select_landmarks(2, seed=0)
+    path = str(tmp_path / "graph.knn")
+    graph.save(path)
+
+    loaded = Knn_Graph.load(path)
+    loaded.add_point(Point(1, 1))
+    assert loaded.vertex_count == graph.vertex_count + 1
+    # The landmark distances do not cover the new point
+    assert loaded.landmarks is None
+    # The file was not written through the map
+    assert Knn_Graph.load(path).vertex_count == graph.vertex_count
@@ -0,0 +1,32 @@
+import pytest
+from grafo_knn import Knn_Graph
+
+
+def edges(graph):
+    src, dst = graph.adjacency.pairs(lengths=False)[:2]
+    return sorted(zip(src.tolist(), dst.tolist()))
+
+
+def build(n, k, side, seed, **options):
+    graph = Knn_Graph(side, side)
+    graph.grafo_knn(n, k, seed=seed, **options)
+    return graph
+
+
+# Dense spaces have many ties between distances, sparse ones few
+@pytest.mark.parametrize("n, k, side, seed", [(300, 5, 60, 1), (200, 7, 20, 2), (500, 3, 1000, 3),
+                                              (50, 10, 10, 4), (5, 7, 100, 5)])
+def test_blocked_matches_loop(n, k, side, seed):
+    expected = edges(build(n, k, side, seed, method="loop"))
+    assert edges(build(n, k, side, seed, method="blocked")) == expected
+    assert edges(build(n, k, side, seed, method="blocked", block_size=64)) == expected
+
+
+def test_parallel_matches_loop():
+    expected = edges(build(400, 6, 80, 6, method="loop"))
+    assert edges(build(400, 6, 80, 6, workers=2)) == expected
+
+
+def test_workers_need_the_blocked_method():
+    with pytest.raises(ValueError):
+        build(10, 2, 100, 7, method="approximate", workers=2)
@@ -0,0 +1,60 @@
+import pytest
+from auxiliary_structures import HeapPriorityQueue
+
+
+def drain(queue):
+    items = []
+    while len(queue):
+        items.append(queue.pop())
+    return items
+
+
+def test_pops_by_priority():
+    queue = HeapPriorityQueue()
+    for item, h in [(1, 5.0), (2, 1.0), (3, 3.0), (4, 2.0)]:
+        queue.push(item, h)
+    assert drain(queue) == [(2, 1.0), (4, 2.0), (3, 3.0), (1, 5.0)]
+
+
+def test_ties_pop_last_pushed_first():
+    queue = HeapPriorityQueue()
+    for item in range(5):
+        queue.push(item, 1.0)
+    queue.push(9, 0.5)
+    assert [item for item, _ in drain(queue)] == [9, 4, 3, 2, 1, 0]
+
+
+def test_decrease_key():
+    queue = HeapPriorityQueue()
+    queue.push(1, 4.0)
+    queue.push(2, 3.0)
+    assert queue.decrease_key(1, 2.0)
+    # A higher priority does not replace a lower one
+    assert not queue.push(2, 7.0)
+    assert len(queue) == 2
+    assert queue.priority(1) == 2.0
+    assert queue.peek() == (1, 2.0)
+    assert drain(queue) == [(1, 2.0), (2, 3.0)]
+
+
+def test_decreased_item_is_newest_among_ties():
+    queue = HeapPriorityQueue()
+    queue.push(1, 5.0)
+    queue.push(2, 2.0)
+    queue.push(1, 2.0)
+    assert [item for item, _ in drain(queue)] == [1, 2]
+
+
+def test_discard_and_empty():
+    queue = HeapPriorityQueue()
+    queue.push(1, 1.0)
+    queue.push(2, 2.0)
+    queue.discard(1)
+    queue.discard(3)
+    assert 1 not in queue and 2 in queue
+    assert queue.peek() == (2, 2.0)
+    assert queue.pop() == (2, 2.0)
+    with pytest.raises(IndexError):
+        queue.pop()
+    with pytest.raises(IndexError):
+        queue.peek()
@@ -0,0 +1,27 @@
+import math
+import numpy as np
+import pytest
+from conftest import small_graph
+from searches import ALGORITHMS, path_length
+
+
+@pytest.mark.parametrize("name", sorted(ALGORITHMS))
+@pytest.mark.parametrize("seed", [0, 1, 2])
+def test_searches_agree_with_dijkstra(name, seed):
+    # k = 3 leaves some vertices out of reach of others
+    graph = small_graph(n=200, k=3, seed=seed)
+    graph.select_landmarks(3, seed=seed)
+    rng = np.random.default_rng(seed)
+    for start, destination in rng.integers(0, graph.vertex_count, (20, 2)).tolist():
+        expected = float(graph.shortest_distances(destination)[start])
+        search = ALGORITHMS[name](graph.point(destination))
+        found = bool(search.search(graph.point(start), graph))
+        assert found == math.isfinite(expected)
+        if not found:
+            continue
+        path = search.path
+        assert path[0] == start and path[-1] == destination
+        if search.optimal:
+            assert path_length(graph, path) == pytest.approx(expected)
+        else:
+            assert path_length(graph, path) >= expected - 1e-9
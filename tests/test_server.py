@@ -0,0 +1,65 @@
+import asyncio
+import pytest
+from batch import run_queries
+from server import QueryServer, request
+
+
+def serve(graph, requests, workers=0):
+    # Starts a server on a free localhost port, sends the requests over one
+    # connection and returns the answers and the stats
+    async def run():
+        server = QueryServer(graph, workers=workers)
+        host, port = (await server.start("127.0.0.1", 0))[:2]
+        try:
+            answers = await request(requests, host, port)
+            stats = (await request([{"op": "stats", "id": "stats"}], host, port))[0]
+        finally:
+            await server.close()
+        return answers, stats
+
+    return asyncio.run(run())
+
+
+@pytest.mark.parametrize("algorithm", ["AStar", "BestFirst"])
+def test_answers_match_direct_searches(graph, algorithm):
+    pairs = [(0, 10), (5, 200), (17, 17), (250, 3)]
+    requests = [{"id": i, "source": s, "destination": d, "algorithm": algorithm, "path": True}
+                for i, (s, d) in enumerate(pairs)]
+    answers, stats = serve(graph, requests)
+
+    expected = run_queries(graph, pairs, algorithm, paths=True)
+    for i, answer in enumerate(answers):
+        assert answer["id"] == i
+        assert answer["found"] == bool(expected.found[i])
+        if answer["found"]:
+            assert answer["length"] == pytest.approx(expected.lengths[i])
+            assert answer["path"] == expected.path(i).tolist()
+    assert stats["served"] == len(pairs)
+    assert stats["queue_depth"] == 0
+    assert stats["p50"] <= stats["p99"] <= stats["max"]
+
+
+def test_rejects_bad_queries(graph):
+    requests = [
+        {"id": "bool", "source": True, "destination": 3},
+        {"id": "negative", "source": -1, "destination": 3},
+        {"id": "too big", "source": 0, "destination": graph.vertex_count},
+        {"id": "float", "source": 1.0, "destination": 3},
+        {"id": "algorithm", "source": 0, "destination": 3, "algorithm": "Nope"},
+    ]
+    answers, stats = serve(graph, requests)
+    for answer, sent in zip(answers, requests):
+        assert answer["id"] == sent["id"]
+        assert "error" in answer
+    assert stats["served"] == 0
+
+
+def test_worker_processes(graph):
+    pairs = [(i, (7 * i + 3) % graph.vertex_count) for i in range(12)]
+    requests = [{"id": i, "source": s, "destination": d} for i, (s, d) in enumerate(pairs)]
+    answers, _ = serve(graph, requests, workers=2)
+    expected = run_queries(graph, pairs)
+    assert [a["found"] for a in answers] == expected.found.tolist()
+    for answer, length in zip(answers, expected.lengths.tolist()):
+        if answer["found"]:
+            assert answer["length"] == pytest.approx(length)
@@ -0,0 +1,33 @@
+import numpy as np
+from auxiliary_structures import SpatialGrid
+
+
+def brute_nearest(points, x, y, k):
+    dists = np.hypot(points[:, 0] - x, points[:, 1] - y)
+    order = np.lexsort((np.arange(len(points)), dists))[:k]
+    return order, dists
+
+
+def test_queries_between_insertions_match_brute_force():
+    rng = np.random.default_rng(1)
+    grid = SpatialGrid(1000, 1000)
+    points = rng.uniform(0, 1000, (3000, 2))
+    for i, (x, y) in enumerate(points.tolist()):
+        grid.insert(x, y)
+        if i % 53 == 0:
+            qx, qy = rng.uniform(-10, 1010, 2).tolist()
+            ids, _ = grid.nearest(qx, qy, 5)
+            expected, dists = brute_nearest(points[:i + 1], qx, qy, 5)
+            assert ids.tolist() == expected.tolist()
+            inside, _ = grid.within_radius(qx, qy, 60.0)
+            assert sorted(inside.tolist()) == np.flatnonzero(dists <= 60.0).tolist()
+
+
+def test_arrays_index_every_point():
+    rng = np.random.default_rng(2)
+    grid = SpatialGrid(500, 500)
+    for x, y in rng.uniform(0, 500, (700, 2)).tolist():
+        grid.insert(x, y)
+    order, cell_start = grid.arrays
+    assert sorted(order.tolist()) == list(range(700))
+    assert cell_start[-1] == 700